@@ -11,22 +11,40 @@
 #
 # log_timestamp "This is an interesting point to take note of"
 # logger_warn "tread carefully"
+#
+# logger_trace_begin "dhcp"
+# logger_trace_end "dhcp"
+
+# The functions below only use bash builtins and write to a file descriptor
+# which is kept open, so logging doesn't fork any processes, besides creating
+# the logs dir the first time.
 
-APP_NAME="`basename $0`"
+APP_NAME="${0##*/}"
 
 
 # Takes and exports the variables from the logging conf file
 # it expects that in this file there will be the following:
 # log_level:_value_
 # output_level:_value_
+# Variables already set in the environment, e.g. LOG_LEVEL, take precedence
+# as they do for kano.logging.
+# Parameters:
+# 1: conf file, defaults to /etc/kano-logs.conf
 function set_log_envs
 {
-    local kano_conf_file="/etc/kano-logs.conf"
-    eval `awk '{print toupper(substr($1, 0, length($1)))"=" "\""$2"\""}' "$kano_conf_file"`
-}
+    local kano_conf_file="${1:-/etc/kano-logs.conf}"
+    local key value
 
+    [ -r "$kano_conf_file" ] || return 0
 
-set_log_envs
+    while read -r key value; do
+        key="${key%:}"
+        if [[ "$key" =~ ^[A-Za-z_][A-Za-z0-9_]*$ ]]; then
+            key="${key^^}"
+            [ -n "${!key+set}" ] || printf -v "$key" '%s' "$value"
+        fi
+    done < "$kano_conf_file"
+}
 
 
 logger_set_app_name()
@@ -34,6 +52,63 @@ logger_set_app_name()
     export APP_NAME="$1"
 }
 
+# Sets _klog_level to the level name kano.logging would use for $1, which
+# may be abbreviated e.g. "warn", and _klog_level_num to its severity,
+# from 0 for "none" to 4 for "debug"
+function _klog_normalise
+{
+    case "${1,,}" in
+        e|er|err|erro|error)
+            _klog_level="error"; _klog_level_num=1 ;;
+        w|wa|war|warn|warni|warnin|warning)
+            _klog_level="warning"; _klog_level_num=2 ;;
+        i|in|inf|info)
+            _klog_level="info"; _klog_level_num=3 ;;
+        d|de|deb|debu|debug)
+            _klog_level="debug"; _klog_level_num=4 ;;
+        *)
+            _klog_level="none"; _klog_level_num=0 ;;
+    esac
+}
+
+# Works out which levels go to the log file and to stderr. This is done
+# once when the script is sourced, call it again after changing LOG_LEVEL
+# or OUTPUT_LEVEL.
+function logger_load_levels
+{
+    _klog_normalise "$LOG_LEVEL"
+    _klog_log_threshold=$_klog_level_num
+    _klog_normalise "$OUTPUT_LEVEL"
+    _klog_output_threshold=$_klog_level_num
+}
+
+# Sets _klog_dir to the logs dir kano.logging uses: the system one for root,
+# otherwise the one in the home of the user, who ran sudo if it was used
+function _klog_logs_dir
+{
+    local home="$HOME"
+
+    if [ -n "$SUDO_USER" ]; then
+        home="/root"
+        # tilde expansion looks the user up without forking
+        if [[ "$SUDO_USER" =~ ^[A-Za-z0-9._][A-Za-z0-9._-]*$ ]]; then
+            eval "home=~$SUDO_USER"
+            # something weird happened with sudo, as kano.logging does
+            [ "${home:0:1}" == "/" ] || home="/root"
+        fi
+    elif [ "$EUID" -eq 0 ]; then
+        _klog_dir="/var/log/kano"
+        return 0
+    fi
+
+    _klog_dir="${home%/}/.kano-logs"
+}
+
+
+set_log_envs
+logger_load_levels
+_klog_logs_dir
+
 # Sample minimum log message example:
 # "message": "Screen model: SyncMaster", "level": "info", "pid": 1832, "time": 1423047420.465359}
 
@@ -86,20 +161,13 @@ function normalise_log_lvl
 }
 
 # Echoes the full path for the logfile
-# If the user is root (i.e. EUID is 0) the log is stored in /var/
-# otherwise it is stored in the user's home dir
+# If the user is root (i.e. EUID is 0) and didn't use sudo the log is stored
+# in /var/ otherwise it is stored in the user's home dir
 # Usage:
 # dir="`log_file_full_path my_log.log`"
 function log_file_full_path
 {
-    SYSTEM_LOGS_DIR="/var/log/kano/"
-    USER_LOGS_DIR="$HOME/.kano-logs/"
-
-    if [ "$EUID" -eq 0 ]; then
-        echo "$SYSTEM_LOGS_DIR$1"
-    else
-        echo "$USER_LOGS_DIR$1"
-    fi
+    echo "$_klog_dir/$1"
 
     return 0
 }
@@ -148,7 +216,8 @@ function logger_log_timestamp
     # once we find it, we set a variable
     if [ "$prof_log_en" == ""  ]; then
         if [ -e "$profiling_conf_file"  ]; then
-            echo `date +%s.%06N`#$1
+            _klog_now
+            echo "$_klog_time#$1"
             prof_log_en="y"
         else
             prof_log_en="n"
@@ -156,43 +225,149 @@ function logger_log_timestamp
     fi
 
     if [ "$prof_log_en" == "y"  ]; then
-        logger_log_msg debug "$1"
+        _klog_now
+        _klog_write debug "$1"
+        logger_trace_event i "$1"
     fi
 }
 
-# Parameters for this function, with regard to position:
-# 1: level, can be "error", "warning", "info", "debug",  not case sensitive
-#    else it defaults to "none"
-# 2: Message to be logged
-function logger_log_msg
+# Records an event on the timeline shared with kano.profiling and the C
+# tools while profiling is enabled, see kano-trace.
+# The binary files those write can't be written from bash without forking,
+# so the events of the script and its subshells are appended as lines of
+# time, pid, phase and name separated by tabs.
+# Parameters:
+# 1: phase, "B" to begin, "E" to end or "i" for an instant event
+# 2: event name
+function logger_trace_event
 {
-    local level="`normalise_log_lvl $1`"
-    local log_msg_location="`log_file_full_path "$APP_NAME.log"`"
-    local time="`date +%s.%06N`"
-    local line_json='{"message": "%s", "level": "%s", "pid": %i, "time": %s}\n'
-    local line_cmd='%s [%i] %s %s\n'
-    local ret=1
+    local trace_dir
+
+    if [ -z "$_ktrace_enabled" ]; then
+        _ktrace_enabled="n"
+
+        if [ -e "$profiling_conf_file" ]; then
+            trace_dir="$_klog_dir/trace"
+            [ -d "$trace_dir" ] || mkdir -p "$trace_dir" 2>/dev/null
+            { exec {_ktrace_fd}>>"$trace_dir/$APP_NAME-$$.ktrace"; } \
+                2>/dev/null && _ktrace_enabled="y"
+        fi
+    fi
+
+    [ "$_ktrace_enabled" == "y" ] || return 1
 
-    # Check whether we need to add to file
-    cmp_log_level "`normalise_log_lvl "$LOG_LEVEL"`" "$level"
-    local log_lvl="$?"
+    _klog_now
+    printf '%s\t%i\t%s\t%s\n' "$_klog_time" "$BASHPID" "$1" \
+        "${2//[$'\t\n']/ }" >&$_ktrace_fd
+}
 
-    # Check whether we need to echo to stderr
-    cmp_log_level "`normalise_log_lvl "$OUTPUT_LEVEL"`" "$level"
-    local output_lvl="$?"
+function logger_trace_begin
+{
+    logger_trace_event "B" "$1"
+}
 
-    if [ "$log_lvl" -eq 0 ]; then
-        printf "$line_json" "$2" "$level" $$ "$time" >> "$log_msg_location"
+function logger_trace_end
+{
+    logger_trace_event "E" "$1"
+}
+
+# Sets _klog_time to the current time, with microseconds. Without
+# EPOCHREALTIME (bash < 5) only the builtin clock can be read without
+# forking, it has whole seconds: records and trace events within the same
+# second then can't be told apart, or ordered against those of kano.logging.
+function _klog_now
+{
+    if [ -n "$EPOCHREALTIME" ]; then
+        # the decimal separator follows the locale
+        _klog_time="${EPOCHREALTIME/,/.}"
+    else
+        printf -v _klog_time '%(%s)T' -1
+    fi
+}
+
+# Makes sure _klog_fd is open on the log file of APP_NAME, reopening it
+# when the app name changed or the file was rotated
+function _klog_open
+{
+    local log_path="$_klog_dir/$APP_NAME.log"
+
+    if [ -n "$_klog_fd" ]; then
+        if [ "$log_path" == "$_klog_path" ] && \
+           [ "$log_path" -ef "/dev/fd/$_klog_fd" ]; then
+            return 0
+        fi
+
+        exec {_klog_fd}>&-
+        _klog_fd=""
+    fi
+
+    # what is created with sudo belongs to the user, as with kano.logging
+    if [ ! -d "$_klog_dir" ]; then
+        mkdir -p "$_klog_dir" 2>/dev/null || return 1
+        if [ -n "$SUDO_USER" ] && [ "$EUID" -eq 0 ]; then
+            chown "$SUDO_USER:" "$_klog_dir" 2>/dev/null
+        fi
+    fi
+
+    if [ -n "$SUDO_USER" ] && [ "$EUID" -eq 0 ] && [ ! -e "$log_path" ]; then
+        { : >>"$log_path"; } 2>/dev/null
+        chown "$SUDO_USER:" "$log_path" 2>/dev/null
+    fi
+
+    _klog_path="$log_path"
+    { exec {_klog_fd}>>"$log_path"; } 2>/dev/null
+}
+
+# Sets _klog_msg to $1 escaped to go in a JSON string
+function _klog_escape
+{
+    _klog_msg="${1//\\/\\\\}"
+    _klog_msg="${_klog_msg//\"/\\\"}"
+    _klog_msg="${_klog_msg//$'\n'/\\n}"
+    _klog_msg="${_klog_msg//$'\r'/\\r}"
+    _klog_msg="${_klog_msg//$'\t'/\\t}"
+}
+
+# Writes a message at the time in _klog_time, see logger_log_msg
+function _klog_write
+{
+    local ret=1
+
+    _klog_normalise "$1"
+    [ "$_klog_level_num" -gt 0 ] || return 1
+
+    if [ "$_klog_level_num" -le "$_klog_log_threshold" ] && _klog_open; then
+        _klog_escape "$2"
+        printf '{"message": "%s", "level": "%s", "pid": %i, "time": %s}\n' \
+            "$_klog_msg" "$_klog_level" $$ "$_klog_time" >&$_klog_fd
         ret=0
     fi
 
-    if [ "$output_lvl" -eq 0 ]; then
-        >&2 printf "$line_cmd" "$APP_NAME" $$ "$level" "$2"
+    if [ "$_klog_level_num" -le "$_klog_output_threshold" ]; then
+        >&2 printf '%s [%i] %s %s\n' "$APP_NAME" $$ "$_klog_level" "$2"
         ret=0
     fi
+
     return "$ret"
 }
 
+# Parameters for this function, with regard to position:
+# 1: level, can be "error", "warning", "info", "debug",  not case sensitive
+#    else it defaults to "none"
+# 2: Message to be logged
+function logger_log_msg
+{
+    # only look at the clock for messages which go somewhere
+    _klog_normalise "$1"
+    if [ "$_klog_level_num" -gt "$_klog_log_threshold" ] && \
+       [ "$_klog_level_num" -gt "$_klog_output_threshold" ]; then
+        return 1
+    fi
+
+    _klog_now
+    _klog_write "$1" "$2"
+}
+
 function logger_debug
 {
     logger_log_msg "debug" "$1"
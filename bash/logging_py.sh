@@ -13,35 +13,44 @@
 #
 # logger_write "Error! Error!"
 #
+# The records are written by logging.sh, without starting python for each.
+#
 
-APP_NAME="$0"
+# next to this file, which may have been sourced by a bare name
+_klog_source="${BASH_SOURCE[0]}"
+[[ "$_klog_source" == */* ]] || _klog_source="./$_klog_source"
+. "${_klog_source%/*}/logging.sh"
+unset _klog_source
 
+# Names the app the way kano.logging does
 logger_set_app_name()
 {
-    export APP_NAME="$1"
+    local name="${1##*/}"
+    name="${name,,}"
+    export APP_NAME="${name// /_}"
 }
 
+logger_set_app_name "$0"
+
 logger_write()
 {
-    __msg="$1"
-    __level=$2
-
-    __kwargs=""
-    if [ -n "$__level" ]; then
-        __kwargs="$__kwargs, level=\"$__level\""
-    fi
-
-    python <<EOF
-from kano.logging import logger, normalise_level
-
-logger._pid = $$
-logger.set_app_name("$APP_NAME")
-logger.write("""$__msg""" $__kwargs)
-EOF
+    local __msg="$1"
+    local __level="${2:-info}"
+    local __line
+
+    # one record per line, as kano.logging does
+    while [ -n "$__msg" ]; do
+        __line="${__msg%%$'\n'*}"
+        logger_log_msg "$__level" "$__line"
+
+        if [ "$__line" == "$__msg" ]; then
+            break
+        fi
+        __msg="${__msg#*$'\n'}"
+    done
 }
 
 logger_error() { logger_write "$1" "error"; }
 logger_info()  { logger_write "$1" "info"; }
 logger_warn()  { logger_write "$1" "warning"; }
 logger_debug() { logger_write "$1" "debug"; }
-
@@ -11,22 +11,87 @@ This module provides the core Kano Logging functionality
 import os
 import sys
 import re
+import errno
 import pwd
 import grp
+import gzip
 import json
 import time
-import yaml
+import shutil
+import atexit
+import Queue
+import itertools
+import threading
 from kano.colours import decorate_string_only_terminal, decorate_with_preset
+from kano.conf_cache import load_conf, dump_conf, watch_conf
 from kano.utils import get_home_by_username
 
 LOG_ENV = "LOG_LEVEL"
 OUTPUT_ENV = "OUTPUT_LEVEL"
 FORCE_FLUSH_ENV = "KLOG_FORCE_FLUSH"
+BUFFER_ENV = "KLOG_BUFFERED"
+ASYNC_ENV = "KLOG_ASYNC"
+FLIGHT_RECORDER_ENV = "KLOG_FLIGHT_RECORDER"
 SYSTEM_LOGS_DIR = "/var/log/kano/"
 
 # The length to which will the log files be cut to when cleaned up
 TAIL_LENGTH = 500
 
+# Log files are rotated once they reach ROTATE_SIZE bytes, keeping the last
+# ROTATE_COUNT rotated segments. Both can be changed with the rotate_size and
+# rotate_count options in the configuration file, a size of 0 disables it.
+ROTATE_SIZE = 1024 * 1024
+ROTATE_COUNT = 4
+
+# How often (in seconds) a writer checks whether another process has rotated
+# the log file from under it
+ROTATE_CHECK_INTERVAL = 10
+
+# Rotated segments are named <app>.log.<timestamp>, compressed to .gz
+LOG_SEGMENT_RE = re.compile(r'^(?P<log>.+\.log)\.\d{8}T\d{6}\.\d{6}(\.gz)?$')
+
+# Each log file has a sparse sidecar index, <app>.log.idx, with an entry
+# every INDEX_INTERVAL bytes. The first line holds the inode of the log file
+# it belongs to, the rest are "<time> <offset>" pairs meaning that every
+# record before offset was logged at or before time. See kano.log_reader.
+INDEX_SUFFIX = ".idx"
+INDEX_INTERVAL = 32 * 1024
+
+# When kano-logd is running it listens on this datagram socket in the logs
+# dir it serves. Each datagram is the app name, optionally followed by
+# " flush", on the first line and the JSON-lines records to append after it.
+LOGD_SOCKET = ".kano-logd.sock"
+
+# Default limits for the buffered write mode, see Logger.set_buffered()
+BUFFER_MAX_BYTES = 64 * 1024
+BUFFER_MAX_RECORDS = 512
+BUFFER_FLUSH_INTERVAL = 5.0
+
+# What an asynchronous logger does when its queue is full, see
+# Logger.set_async(). Dropped records are counted either way and reported
+# in the log once the writer catches up.
+QUEUE_FULL_BLOCK = "block"
+QUEUE_FULL_DROP_DEBUG = "drop_debug"
+QUEUE_FULL_DROP = "drop"
+ASYNC_QUEUE_SIZE = 1024
+
+# Identical consecutive records can be collapsed into one carrying a
+# "repeat" count, see Logger.set_suppress_repeats(). The count is written
+# out at the latest this many seconds after the first repeat.
+REPEAT_REPORT_INTERVAL = 30.0
+
+# Token bucket rate limiting of the records, see Logger.set_rate_limit().
+# Records over the limit are dropped, the next record let through for the
+# same level or call site carries a "rate_limited" count of them.
+RATE_LIMIT_LEVEL = "level"
+RATE_LIMIT_CALL_SITE = "call_site"
+RATE_LIMIT_BURST = 20
+
+# The flight recorder keeps the last FLIGHT_RECORDER_SIZE records which
+# weren't written to the log file, whatever the log level, and writes them
+# out when the app crashes. See Logger.set_flight_recorder().
+FLIGHT_RECORDER_SIZE = 256
+
 # get_user_unsudoed() cannot be used due to a circular dependency
 is_sudoed = 'SUDO_USER' in os.environ
 usr = os.getenv("SUDO_USER") if is_sudoed else pwd.getpwuid(os.getuid())[0]
@@ -54,6 +119,11 @@ LEVELS = {
     "debug": 4
 }
 
+ERROR_LEVEL = LEVELS["error"]
+WARNING_LEVEL = LEVELS["warning"]
+INFO_LEVEL = LEVELS["info"]
+DEBUG_LEVEL = LEVELS["debug"]
+
 
 def _test_override_logs_dir(logs_dir):
     # For unit test purposes only
@@ -84,13 +154,55 @@ def normalise_level(level):
 class Logger:
     def __init__(self):
         self._log_file = None
+        self._logd = None
         self._app_name = None
         self._force_flush = False
         self._pid = os.getpid()
 
+        self._buffered = False
+        self._buffer = []
+        self._buffer_bytes = 0
+        self._buffer_max_bytes = BUFFER_MAX_BYTES
+        self._buffer_max_records = BUFFER_MAX_RECORDS
+        self._buffer_interval = BUFFER_FLUSH_INTERVAL
+        self._flush_timer = None
+        self._cancelled_timers = []
+        self._atexit_registered = False
+        self._lock = threading.RLock()
+
+        self._async = False
+        self._queue = None
+        self._queue_policy = QUEUE_FULL_DROP_DEBUG
+        self._writer = None
+        self._dropped = 0
+        self._dropped_total = 0
+
+        self._suppress_repeats = False
+        self._last_record = None
+        self._repeats = 0
+        self._repeats_since = None
+        self._repeats_time = None
+
+        self._rate_limit = 0
+        self._rate_limit_burst = RATE_LIMIT_BURST
+        self._rate_limit_scope = RATE_LIMIT_LEVEL
+        self._rate_buckets = {}
+        self._rate_limited_total = 0
+
+        self._recorder_size = 0
+        self._recorder_seq = None
+
+        self._rotate_size = ROTATE_SIZE
+        self._rotate_count = ROTATE_COUNT
+
         self._cached_log_level = None
         self._cached_output_level = None
-        self._load_conf()
+        self._conf_notifier = None
+        self._log_threshold = 0
+        self._output_threshold = 0
+        self._write_threshold = 0
+        self._threshold = 0
+        conf = self._load_conf()
 
         log = os.getenv(LOG_ENV)
         if log is not None:
@@ -100,16 +212,28 @@ class Logger:
         if output is not None:
             self._cached_output_level = normalise_level(output)
 
+        self._update_thresholds()
+
         force_flush = os.getenv(FORCE_FLUSH_ENV)
         if force_flush is not None:
             self._force_flush = True
 
-    def _load_conf(self):
-        conf = None
-        if os.path.exists(CONF_FILE):
-            with open(CONF_FILE, "r") as f:
-                conf = yaml.load(f)
+        buffered = os.getenv(BUFFER_ENV)
+        if buffered is not None:
+            self.set_buffered()
 
+        async_policy = os.getenv(ASYNC_ENV)
+        if async_policy is not None:
+            if async_policy in (QUEUE_FULL_BLOCK, QUEUE_FULL_DROP_DEBUG,
+                                QUEUE_FULL_DROP):
+                self.set_async(policy=async_policy)
+            else:
+                self.set_async()
+
+        self._configure(conf)
+
+    def _load_conf(self):
+        conf = load_conf(CONF_FILE)
         if conf is None:
             conf = {}
 
@@ -125,6 +249,115 @@ class Logger:
         if self._cached_output_level is None:
             self._cached_output_level = normalise_level(conf["output_level"])
 
+        self._update_thresholds()
+
+        return conf
+
+    def _configure(self, conf):
+        '''
+        Sets up the features to what the configuration says, turning off
+        those it doesn't mention so that a reload also undoes what the
+        previous configuration turned on
+        '''
+
+        try:
+            rotate_size = int(conf.get("rotate_size", ROTATE_SIZE))
+            rotate_count = int(conf.get("rotate_count", ROTATE_COUNT))
+        except (TypeError, ValueError):
+            rotate_size = ROTATE_SIZE
+            rotate_count = ROTATE_COUNT
+
+        with self._lock:
+            self._rotate_size = rotate_size
+            self._rotate_count = rotate_count
+            if self._log_file is not None:
+                self._log_file.rotate_size = rotate_size
+                self._log_file.rotate_count = rotate_count
+
+        if conf.get("suppress_repeats"):
+            self.set_suppress_repeats()
+        elif self._suppress_repeats:
+            self.unset_suppress_repeats()
+
+        try:
+            rate_limit = float(conf.get("rate_limit", 0))
+            burst = float(conf.get("rate_limit_burst", RATE_LIMIT_BURST))
+        except (TypeError, ValueError):
+            rate_limit = 0
+
+        if rate_limit > 0:
+            scope = conf.get("rate_limit_scope", RATE_LIMIT_LEVEL)
+            if scope not in (RATE_LIMIT_LEVEL, RATE_LIMIT_CALL_SITE):
+                scope = RATE_LIMIT_LEVEL
+            self.set_rate_limit(rate_limit, burst, scope)
+        else:
+            self.unset_rate_limit()
+
+        # the environment takes precedence, as for the levels
+        recorder_size = os.getenv(FLIGHT_RECORDER_ENV)
+        if recorder_size is not None:
+            try:
+                recorder_size = int(recorder_size)
+            except ValueError:
+                recorder_size = FLIGHT_RECORDER_SIZE
+        else:
+            try:
+                recorder_size = int(conf.get("flight_recorder", 0))
+            except (TypeError, ValueError):
+                recorder_size = 0
+
+        if recorder_size > 0:
+            # reallocating the slots would lose the records they hold
+            if recorder_size != self._recorder_size:
+                self.set_flight_recorder(recorder_size)
+        elif self._recorder_size:
+            self.unset_flight_recorder()
+
+    def reload_conf(self):
+        '''
+        Reads the configuration file again, the environment still takes
+        precedence for the levels and the flight recorder. Levels forced
+        from the code are reset, and so are the features the configuration
+        file can set up: they are turned off when it doesn't mention them.
+        '''
+
+        log = os.getenv(LOG_ENV)
+        self._cached_log_level = normalise_level(log) if log is not None \
+            else None
+
+        output = os.getenv(OUTPUT_ENV)
+        self._cached_output_level = normalise_level(output) \
+            if output is not None else None
+
+        self._configure(self._load_conf())
+
+    def watch_conf(self):
+        '''
+        Reloads the configuration whenever the file changes, so that long
+        running processes pick up new levels without being restarted.
+        Needs pyinotify, returns whether the file is being watched.
+        '''
+
+        if self._conf_notifier is None:
+            self._conf_notifier = watch_conf(CONF_FILE, self.reload_conf)
+
+        return self._conf_notifier is not None
+
+    def _update_thresholds(self):
+        '''
+        Precomputes the numeric levels so that a disabled log call costs a
+        single comparison, see debug(), info(), warn() and error()
+        '''
+
+        self._log_threshold = LEVELS[self._cached_log_level or "none"]
+        self._output_threshold = LEVELS[self._cached_output_level or "none"]
+        self._write_threshold = max(self._log_threshold,
+                                    self._output_threshold)
+
+        # the flight recorder wants every record
+        recorder_threshold = DEBUG_LEVEL if self._recorder_size else 0
+        self._threshold = max(self._write_threshold, recorder_threshold)
+
     def get_log_level(self):
         if self._cached_log_level is None:
             self._load_conf()
@@ -142,18 +375,22 @@ class Logger:
         if not self._cached_log_level or \
            LEVELS[self._cached_log_level] < LEVELS[normalised]:
             self._cached_log_level = normalised
+            self._update_thresholds()
 
     def force_debug_level(self, level):
         normalised = normalise_level(level)
         if not self._cached_output_level or \
            LEVELS[self._cached_output_level] < LEVELS[normalised]:
             self._cached_output_level = normalised
+            self._update_thresholds()
 
     def set_app_name(self, name):
+        # Pending records belong to the previous log file
+        self.flush()
+
         self._app_name = os.path.basename(name.strip()).lower().replace(" ", "_")
         if self._log_file is not None:
-            self._log_file.close()
-            self._log_file = None
+            self._close_log_file()
 
     def set_force_flush(self):
         self._force_flush = True
@@ -161,94 +398,554 @@ class Logger:
     def unset_force_flush(self):
         self._force_flush = False
 
+    def set_buffered(self, max_bytes=BUFFER_MAX_BYTES,
+                     max_records=BUFFER_MAX_RECORDS,
+                     interval=BUFFER_FLUSH_INTERVAL):
+        '''
+        Keep serialised records in memory and write them to the log file
+        in a single call once max_bytes or max_records is reached, when
+        interval seconds have passed since the first pending record, on
+        flush() and when the process exits.
+        '''
+
+        with self._lock:
+            self._buffered = True
+            self._buffer_max_bytes = max_bytes
+            self._buffer_max_records = max_records
+            self._buffer_interval = interval
+
+        self._register_atexit()
+
+    def _register_atexit(self):
+        if not self._atexit_registered:
+            atexit.register(self._at_exit)
+            self._atexit_registered = True
+
+    def _at_exit(self):
+        # Stop the writer and the timers while the interpreter is still
+        # whole, daemon threads left running print tracebacks as the
+        # modules go away
+        self.unset_async()
+        self.flush()
+
+        for timer in self._cancelled_timers:
+            if timer is not threading.current_thread():
+                timer.join()
+        self._cancelled_timers = []
+
+    def unset_buffered(self):
+        self._flush_buffer()
+        self._buffered = False
+
+    def set_async(self, queue_size=ASYNC_QUEUE_SIZE,
+                  policy=QUEUE_FULL_DROP_DEBUG):
+        '''
+        Hand records over to a background thread which serialises them and
+        writes them to the log file and stderr. The policy decides what
+        happens when queue_size records are pending: QUEUE_FULL_BLOCK waits
+        for the writer, QUEUE_FULL_DROP_DEBUG drops debug records and waits
+        for the rest, QUEUE_FULL_DROP drops the record.
+        '''
+
+        if self._async:
+            self.unset_async()
+
+        self._queue = Queue.Queue(queue_size)
+        self._queue_policy = policy
+        self._writer = threading.Thread(target=self._async_writer,
+                                        name='kano-logging-writer')
+        self._writer.daemon = True
+        self._writer.start()
+        self._async = True
+
+        self._register_atexit()
+
+    def unset_async(self):
+        if not self._async:
+            return
+
+        self._async = False
+        self._queue.put(None)
+        self._writer.join()
+        self._writer = None
+        self._queue = None
+
+    def get_dropped_count(self):
+        '''
+        Returns the number of records dropped by the asynchronous logger
+        '''
+
+        return self._dropped_total
+
+    def set_suppress_repeats(self):
+        '''
+        Collapse identical consecutive records, i.e. with the same level,
+        message and fields. The first one is written as usual, the repeats
+        are counted and written as a single record with a "repeat" field
+        when a different record comes in, on flush() or after
+        REPEAT_REPORT_INTERVAL seconds.
+        '''
+
+        self._suppress_repeats = True
+        self._register_atexit()
+
+    def unset_suppress_repeats(self):
+        self._flush_repeats()
+        self._suppress_repeats = False
+        self._last_record = None
+
+    def set_rate_limit(self, rate, burst=RATE_LIMIT_BURST,
+                       scope=RATE_LIMIT_LEVEL):
+        '''
+        Let through at most rate records a second on average, in bursts of
+        up to burst records, for each level (RATE_LIMIT_LEVEL) or for each
+        line of code logging (RATE_LIMIT_CALL_SITE). Records over the limit
+        are dropped before their message is even built.
+        '''
+
+        with self._lock:
+            self._rate_limit = float(rate)
+            self._rate_limit_burst = max(1.0, float(burst))
+            self._rate_limit_scope = scope
+            self._rate_buckets = {}
+
+    def unset_rate_limit(self):
+        self._rate_limit = 0
+
+    def get_rate_limited_count(self):
+        '''
+        Returns the number of records dropped by the rate limit
+        '''
+
+        return self._rate_limited_total
+
+    def set_flight_recorder(self, size=FLIGHT_RECORDER_SIZE):
+        '''
+        Keep the last size records which are below the log level in memory,
+        so that dump_flight_recorder() can write them out when something
+        goes wrong, e.g. from the excepthook. Records are kept as they were
+        given, unformatted, in preallocated slots.
+        '''
+
+        self._recorder_seqs = [None] * size
+        self._recorder_times = [0.0] * size
+        self._recorder_levels = [None] * size
+        self._recorder_msgs = [None] * size
+        self._recorder_args = [None] * size
+        self._recorder_kwargs = [None] * size
+        self._recorder_seq = itertools.count()
+        self._recorder_size = size
+
+        self._update_thresholds()
+
+    def unset_flight_recorder(self):
+        self._recorder_size = 0
+        self._recorder_seq = None
+        self._update_thresholds()
+
+    def dump_flight_recorder(self):
+        '''
+        Writes the records kept by the flight recorder to the log file, in
+        the order they were logged and with a "flight_recorder" field, then
+        forgets them. Returns the number of records written.
+        '''
+
+        if not self._recorder_size:
+            return 0
+
+        # the records still queued or buffered come first
+        self.flush()
+
+        seqs = self._recorder_seqs
+        slots = sorted(
+            (pos for pos in xrange(len(seqs)) if seqs[pos] is not None),
+            key=seqs.__getitem__
+        )
+        if not slots:
+            return 0
+
+        self._init_app_name()
+
+        records = []
+        for pos in slots:
+            msg = self._recorder_msgs[pos]
+            args = self._recorder_args[pos]
+            try:
+                if callable(msg):
+                    msg = msg()
+                if args:
+                    msg = msg.format(*args)
+            except Exception:
+                msg = repr(msg)
+
+            log = {}
+            log["pid"] = self._pid
+            log.update(self._recorder_kwargs[pos] or {})
+            log["level"] = self._recorder_levels[pos]
+            log["time"] = self._recorder_times[pos]
+            log["flight_recorder"] = True
+
+            lines = msg.encode('utf8') if type(msg) == unicode else str(msg)
+            for line in lines.strip().split("\n"):
+                log["message"] = line
+                records.append("{}\n".format(json.dumps(log, default=repr)))
+
+            seqs[pos] = None
+            self._recorder_msgs[pos] = None
+            self._recorder_args[pos] = None
+            self._recorder_kwargs[pos] = None
+
+        self._write_record(''.join(records), True)
+
+        return len(slots)
+
     def write(self, msg, force_flush=False, **kwargs):
         lname = "info"
         if "level" in kwargs:
             lname = normalise_level(kwargs["level"])
 
-        level = LEVELS[lname]
-        sys_log_level = LEVELS[self.get_log_level()]
-        sys_output_level = LEVELS[self.get_output_level()]
-
-        if level > 0 and (level <= sys_log_level or level <= sys_output_level):
-            if self._app_name is None:
-                try:
-                    self.set_app_name(sys.argv[0])
-                except (AttributeError, IndexError):
-                    # argv is likely not accessible, use default value
-                    self.set_app_name('unknown-app')
+        self._write(lname, msg, (), force_flush, kwargs)
 
-            lines = msg.encode('utf8') if type(msg) == unicode else msg
-            lines = lines.strip().split("\n")
+    def _write(self, lname, msg, args, force_flush, kwargs):
+        level = LEVELS[lname]
 
-            log = {}
-            log["pid"] = self._pid
-            log.update(kwargs)
-            log["level"] = lname
+        if level > self._log_threshold and self._recorder_size:
+            # The flight recorder, inlined as this runs for every record
+            # which would otherwise be discarded. The sequence number goes
+            # in last, marking the slot as complete.
+            seq = next(self._recorder_seq)
+            pos = seq % self._recorder_size
+            self._recorder_times[pos] = time.time()
+            self._recorder_levels[pos] = lname
+            self._recorder_msgs[pos] = msg
+            self._recorder_args[pos] = args
+            self._recorder_kwargs[pos] = kwargs
+            self._recorder_seqs[pos] = seq
+
+        if level > 0 and level <= self._write_threshold:
+            if self._rate_limit:
+                limited = self._take_token(lname)
+                if limited is None:
+                    return
+                if limited:
+                    kwargs['rate_limited'] = limited
+
+            # build the message only now that we know it is needed
+            if callable(msg):
+                msg = msg()
+            if args:
+                msg = msg.format(*args)
 
             # if an exception object was passed in, add it to the log fields
-            tbk = None
+            # here as the traceback is only available in the calling thread
             if 'exception' in kwargs:
                 import traceback
-                tbk = traceback.format_exc()
-                log['exception'] = unicode(kwargs['exception']).encode('utf8')
-                log['traceback'] = tbk
-
-            for line in lines:
-                log["time"] = time.time()
-                log["message"] = line
+                kwargs['traceback'] = traceback.format_exc()
+                kwargs['exception'] = \
+                    unicode(kwargs['exception']).encode('utf8')
+
+            if self._async:
+                self._enqueue((msg, lname, time.time(), force_flush, kwargs))
+            else:
+                self._emit(msg, lname, None, force_flush, kwargs)
+
+    def _take_token(self, lname):
+        '''
+        Returns None if the record is over the rate limit, otherwise the
+        number of records from the same level or call site which were
+        dropped since the last one let through
+        '''
+
+        if self._rate_limit_scope == RATE_LIMIT_CALL_SITE:
+            # the caller of error(), info(), write(), etc.
+            frame = sys._getframe(3)
+            key = (frame.f_code.co_filename, frame.f_lineno)
+        else:
+            key = lname
+
+        now = time.time()
+        with self._lock:
+            bucket = self._rate_buckets.get(key)
+            if bucket is None:
+                # tokens, time they were counted, records dropped
+                bucket = [self._rate_limit_burst, now, 0]
+                self._rate_buckets[key] = bucket
+            else:
+                bucket[0] = min(
+                    self._rate_limit_burst,
+                    bucket[0] + (now - bucket[1]) * self._rate_limit
+                )
+                bucket[1] = now
+
+            if bucket[0] < 1:
+                bucket[2] += 1
+                self._rate_limited_total += 1
+                return None
+
+            bucket[0] -= 1
+            dropped = bucket[2]
+            bucket[2] = 0
+
+        return dropped
+
+    def _emit(self, msg, lname, timestamp, force_flush, kwargs):
+        if self._suppress_repeats:
+            if timestamp is None:
+                timestamp = time.time()
+
+            with self._lock:
+                if self._is_repeat(msg, lname, timestamp, kwargs):
+                    return
+
+        self._output(msg, lname, timestamp, force_flush, kwargs)
+
+    def _is_repeat(self, msg, lname, timestamp, kwargs):
+        record = (msg, lname, kwargs)
+        if record == self._last_record:
+            if not self._repeats:
+                self._repeats_since = timestamp
+            self._repeats += 1
+            self._repeats_time = timestamp
+
+            if timestamp - self._repeats_since >= REPEAT_REPORT_INTERVAL:
+                self._flush_repeats()
+            return True
+
+        self._flush_repeats()
+        self._last_record = record
+        return False
+
+    def _flush_repeats(self):
+        with self._lock:
+            if not self._repeats or self._last_record is None:
+                return
+
+            msg, lname, kwargs = self._last_record
+            kwargs = dict(kwargs, repeat=self._repeats)
+            timestamp = self._repeats_time
+            self._repeats = 0
+
+            self._output(msg, lname, timestamp, False, kwargs)
+
+    def _output(self, msg, lname, timestamp, force_flush, kwargs):
+        level = LEVELS[lname]
+        sys_log_level = self._log_threshold
+        sys_output_level = self._output_threshold
+
+        self._init_app_name()
+
+        lines = msg.encode('utf8') if type(msg) == unicode else msg
+        lines = lines.strip().split("\n")
+
+        log = {}
+        log["pid"] = self._pid
+        log.update(kwargs)
+        log["level"] = lname
+
+        for line in lines:
+            log["time"] = timestamp if timestamp is not None else time.time()
+            log["message"] = line
+
+            if level <= sys_log_level:
+                self._write_record(
+                    "{}\n".format(json.dumps(log)),
+                    self._force_flush or force_flush
+                )
+
+            if level <= sys_output_level:
+                output_line = "{}[{}] {} {}\n".format(
+                    self._app_name,
+                    decorate_string_only_terminal(self._pid, "yellow"),
+                    decorate_with_preset(log["level"], log["level"], True),
+                    log["message"]
+                )
+                sys.stderr.write(output_line)
+
+    def _enqueue(self, record):
+        try:
+            self._queue.put_nowait(record)
+            return
+        except Queue.Full:
+            pass
+
+        drop_debug = self._queue_policy == QUEUE_FULL_DROP_DEBUG
+        if self._queue_policy == QUEUE_FULL_DROP or \
+           (drop_debug and record[1] == "debug"):
+            with self._lock:
+                self._dropped += 1
+                self._dropped_total += 1
+            return
+
+        self._queue.put(record)
+
+    def _async_writer(self):
+        running = True
+        while running:
+            batch = [self._queue.get()]
+            try:
+                while True:
+                    batch.append(self._queue.get_nowait())
+            except Queue.Empty:
+                pass
 
-                if level <= sys_log_level:
-                    if self._log_file is None:
-                        self._init_log_file()
-                    self._log_file.write("{}\n".format(json.dumps(log)))
+            for record in batch:
+                if record is None:
+                    running = False
+                    continue
+                try:
+                    self._emit(*record)
+                except Exception:
+                    # the writer must survive a failed write (e.g. disk full)
+                    pass
+
+            with self._lock:
+                dropped = self._dropped
+                self._dropped = 0
+
+            try:
+                if dropped:
+                    self._emit(
+                        "{} log records were dropped".format(dropped),
+                        "warning", time.time(), False, {"dropped": dropped}
+                    )
 
-                    if self._force_flush or force_flush:
-                        self.sync()
+                if self._log_file is not None:
+                    self._log_file.flush()
+            except Exception:
+                pass
 
-                if level <= sys_output_level:
-                    output_line = "{}[{}] {} {}\n".format(
-                        self._app_name,
-                        decorate_string_only_terminal(self._pid, "yellow"),
-                        decorate_with_preset(log["level"], log["level"], True),
-                        log["message"]
+            for dummy in batch:
+                self._queue.task_done()
+
+    def _write_record(self, record, force_flush=False):
+        # Never flush() from here: it waits for the asynchronous writer,
+        # which may be waiting for the lock held by this thread
+        if self._buffered:
+            with self._lock:
+                self._buffer.append(record)
+                self._buffer_bytes += len(record)
+
+                if force_flush or \
+                   self._buffer_bytes >= self._buffer_max_bytes or \
+                   len(self._buffer) >= self._buffer_max_records:
+                    self._flush_buffer()
+                elif self._flush_timer is None:
+                    self._flush_timer = threading.Timer(
+                        self._buffer_interval, self._flush_buffer
                     )
-                    sys.stderr.write(output_line)
+                    self._flush_timer.daemon = True
+                    self._flush_timer.start()
+            return
+
+        self._write_data(record, force_flush)
+
+    def _flush_buffer(self):
+        with self._lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                # it takes a moment to notice, see _at_exit()
+                self._cancelled_timers = [
+                    timer for timer in self._cancelled_timers
+                    if timer.is_alive()
+                ] + [self._flush_timer]
+                self._flush_timer = None
+
+            if not self._buffer:
+                return
+
+            data = ''.join(self._buffer)
+            self._buffer = []
+            self._buffer_bytes = 0
+
+            self._write_data(data, True)
+
+    def _write_data(self, data, flush=False):
+        if self._log_file is None:
+            self._init_log_file()
+
+        if self._logd is not None:
+            header = "{} flush\n" if flush else "{}\n"
+            try:
+                self._logd.send(header.format(self._app_name) + data)
+                return
+            except EnvironmentError as err:
+                # keep the daemon for the next write if it is only busy
+                if err.errno not in (errno.EAGAIN, errno.EWOULDBLOCK,
+                                     errno.EMSGSIZE, errno.ENOBUFS):
+                    self._logd.close()
+                    self._logd = None
+
+        self._log_file.write(data)
+        if flush:
+            self._log_file.flush()
 
     def sync(self):
         self.flush()
 
-    def error(self, msg, **kwargs):
-        kwargs["level"] = "error"
-        self.write(msg, **kwargs)
+    # The message can be given as a format string followed by its arguments,
+    # or as a callable returning the message. Either way it is only built if
+    # the record is going to be written somewhere.
+
+    def error(self, msg, *args, **kwargs):
+        if self._threshold < ERROR_LEVEL:
+            return
+        force_flush = kwargs.pop("force_flush", False)
+        self._write("error", msg, args, force_flush, kwargs)
+
+    def debug(self, msg, *args, **kwargs):
+        if self._threshold < DEBUG_LEVEL:
+            return
+        force_flush = kwargs.pop("force_flush", False)
+        self._write("debug", msg, args, force_flush, kwargs)
+
+    def warn(self, msg, *args, **kwargs):
+        if self._threshold < WARNING_LEVEL:
+            return
+        force_flush = kwargs.pop("force_flush", False)
+        self._write("warning", msg, args, force_flush, kwargs)
+
+    def info(self, msg, *args, **kwargs):
+        if self._threshold < INFO_LEVEL:
+            return
+        force_flush = kwargs.pop("force_flush", False)
+        self._write("info", msg, args, force_flush, kwargs)
 
-    def debug(self, msg, **kwargs):
-        kwargs["level"] = "debug"
-        self.write(msg, **kwargs)
-
-    def warn(self, msg, **kwargs):
-        kwargs["level"] = "warn"
-        self.write(msg, **kwargs)
+    def flush(self):
+        # wait for the writer unless it is the one asking
+        if self._async and \
+           threading.current_thread() is not self._writer and \
+           self._writer.is_alive():
+            self._queue.join()
 
-    def info(self, msg, **kwargs):
-        kwargs["level"] = "info"
-        self.write(msg, **kwargs)
+        self._flush_repeats()
+        self._flush_buffer()
 
-    def flush(self):
-        if self._log_file and not self._log_file.closed:
+        if self._log_file is not None:
             self._log_file.flush()
 
         sys.stderr.flush()
 
-    def _init_log_file(self):
+    def _init_app_name(self):
+        if self._app_name is None:
+            try:
+                self.set_app_name(sys.argv[0])
+            except (AttributeError, IndexError):
+                # argv is likely not accessible, use default value
+                self.set_app_name('unknown-app')
+
+    def _close_log_file(self):
         if self._log_file is not None:
             self._log_file.close()
+            self._log_file = None
 
-        if os.getuid() == 0 and not is_sudoed:
-            logs_dir = SYSTEM_LOGS_DIR
-        else:
-            logs_dir = USER_LOGS_DIR
+        if self._logd is not None:
+            self._logd.close()
+            self._logd = None
+
+    def _init_log_file(self):
+        self._close_log_file()
 
+        logs_dir = get_logs_dir()
         if not os.path.exists(logs_dir):
             os.makedirs(logs_dir)
 
@@ -259,18 +956,126 @@ class Logger:
                 os.chown(logs_dir, uid, gid)
 
         log_fn = "{}/{}.log".format(logs_dir, self._app_name)
+        self._log_file = LogFile(log_fn, self._rotate_size, self._rotate_count)
+        self._logd = connect_logd(logs_dir)
+
+
+class LogFile(object):
+    '''
+    A log file which is appended to, indexed and rotated as it grows.
+    It is opened on the first write and reopened after a rotation.
+    '''
+
+    def __init__(self, path, rotate_size=ROTATE_SIZE, rotate_count=ROTATE_COUNT):
+        self.path = path
+        self.rotate_size = rotate_size
+        self.rotate_count = rotate_count
+
+        self._file = None
+        self._index_file = None
+        self._size = 0
+        self._index_offset = 0
+        self._rotate_checked = 0
+
+    def write(self, data):
+        if self._file is None:
+            self._open()
+
+        self._index()
+        self._file.write(data)
+        self._check_rotation(len(data))
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+        if self._index_file is not None:
+            self._index_file.close()
+            self._index_file = None
+
+    def _open(self):
+        if self.rotate_size and os.path.isfile(self.path) and \
+           os.path.getsize(self.path) >= self.rotate_size:
+            try:
+                rotate_log_file(self.path, self.rotate_count)
+            except OSError:
+                pass
 
         # Fix permissions in case we need to create the file with sudo
-        if not os.path.isfile(log_fn) and is_sudoed:
+        if not os.path.isfile(self.path) and is_sudoed:
             # touch
-            with open(log_fn, 'a'):
+            with open(self.path, 'a'):
                 pass
 
             uid = pwd.getpwnam(usr).pw_uid
             gid = grp.getgrnam(usr).gr_gid
-            os.chown(log_fn, uid, gid)
-
-        self._log_file = open("{}/{}.log".format(logs_dir, self._app_name), "a")
+            os.chown(self.path, uid, gid)
+
+        self._file = open(self.path, "a")
+        self._size = os.fstat(self._file.fileno()).st_size
+        self._rotate_checked = time.time()
+        self._index_offset = self._size
+
+    def _index(self):
+        '''
+        Adds an entry to the sidecar index every INDEX_INTERVAL bytes,
+        stating that every record before the current offset was logged at
+        or before now.
+        '''
+
+        if self._size - self._index_offset < INDEX_INTERVAL:
+            return
+
+        self._index_offset = self._size
+        try:
+            if self._index_file is None:
+                self._index_file = _open_index(self.path, self._file.fileno())
+
+            # The offset must not cover bytes which haven't hit the file yet
+            self._file.flush()
+            self._index_file.write(
+                "{!r} {}\n".format(time.time(), self._index_offset)
+            )
+            self._index_file.flush()
+        except (IOError, OSError):
+            pass
+
+    def _check_rotation(self, written):
+        self._size += written
+        if not self.rotate_size:
+            return
+
+        now = time.time()
+        if self._size < self.rotate_size and \
+           now - self._rotate_checked < ROTATE_CHECK_INTERVAL:
+            return
+
+        self._rotate_checked = now
+
+        # Other processes may be writing to (and rotating) the same file
+        self._file.flush()
+        try:
+            stat = os.stat(self.path)
+            rotated = stat.st_ino != os.fstat(self._file.fileno()).st_ino
+        except OSError:
+            rotated = True
+
+        if rotated:
+            self.close()
+            return
+
+        self._size = stat.st_size
+        if self._size >= self.rotate_size:
+            self.close()
+            try:
+                rotate_log_file(self.path, self.rotate_count)
+            except OSError:
+                pass
 
 
 logger = Logger()
@@ -285,17 +1090,209 @@ def set_system_output_level(lvl):
 
 
 def _set_conf_var(var, value):
-    conf = None
-    if os.path.isfile(CONF_FILE):
-        with open(CONF_FILE, "r") as f:
-            conf = yaml.load(f)
+    conf = load_conf(CONF_FILE)
     if conf is None:
         conf = {}
 
     conf[var] = normalise_level(unicode(value))
 
     with open(CONF_FILE, "w") as f:
-        f.write(yaml.dump(conf, default_flow_style=False))
+        f.write(dump_conf(conf))
+
+
+def rotate_log_file(log_path, count=ROTATE_COUNT):
+    '''
+    Moves log_path aside to a timestamped segment, removes all but the
+    newest count segments and compresses the older ones in the background.
+    The segment that was just created is left uncompressed until the next
+    rotation so that other processes still writing to it can notice.
+    '''
+
+    now = time.time()
+    segment = "{}.{}.{:06d}".format(
+        log_path,
+        time.strftime("%Y%m%dT%H%M%S", time.localtime(now)),
+        int((now % 1) * 1000000)
+    )
+    os.rename(log_path, segment)
+
+    # The index only ever describes the live log file
+    try:
+        os.remove(get_index_path(log_path))
+    except OSError:
+        pass
+
+    segments = get_log_segments(log_path)
+    kept = segments[-count:] if count > 0 else []
+    for old in segments:
+        if old not in kept:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+
+    pending = [s for s in kept if not s.endswith(".gz") and s != segment]
+    if pending:
+        threading.Thread(target=_compress_segments, args=(pending,),
+                         name="kano-logging-compress").start()
+
+
+def _compress_segments(segments):
+    for segment in segments:
+        tmp_path = "{}.gz.{}.tmp".format(segment, os.getpid())
+        try:
+            with open(segment, "rb") as src:
+                stat = os.fstat(src.fileno())
+                dst = gzip.open(tmp_path, "wb")
+                try:
+                    shutil.copyfileobj(src, dst)
+                finally:
+                    dst.close()
+
+            try:
+                os.chown(tmp_path, stat.st_uid, stat.st_gid)
+            except OSError:
+                pass
+
+            # Readers skip segments last modified before the time they need
+            os.utime(tmp_path, (stat.st_atime, stat.st_mtime))
+
+            os.rename(tmp_path, "{}.gz".format(segment))
+            os.remove(segment)
+        except (IOError, OSError):
+            # another process got to it first
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+
+def get_logs_dir():
+    if os.getuid() == 0 and not is_sudoed:
+        return SYSTEM_LOGS_DIR
+
+    return USER_LOGS_DIR
+
+
+def get_logd_socket_path(logs_dir):
+    return os.path.join(logs_dir, LOGD_SOCKET)
+
+
+def connect_logd(logs_dir):
+    '''
+    Returns a socket connected to the kano-logd serving logs_dir, or None
+    if it isn't running
+    '''
+
+    socket_path = get_logd_socket_path(logs_dir)
+    if not os.path.exists(socket_path):
+        return None
+
+    # only paid for when the daemon is around
+    import socket
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    try:
+        sock.connect(socket_path)
+    except socket.error:
+        sock.close()
+        return None
+
+    # never wait for the daemon, write to the file ourselves instead
+    sock.setblocking(0)
+    return sock
+
+
+def get_index_path(log_path):
+    return log_path + INDEX_SUFFIX
+
+
+def get_index_header(log_fd):
+    return "# {}\n".format(os.fstat(log_fd).st_ino)
+
+
+def _open_index(log_path, log_fd):
+    '''
+    Opens the index of log_path for appending, starting a new one if it
+    doesn't belong to the file currently at log_path
+    '''
+
+    index_path = get_index_path(log_path)
+    header = get_index_header(log_fd)
+
+    current = None
+    try:
+        with open(index_path, "r") as f:
+            current = f.readline()
+    except IOError:
+        pass
+
+    if current == header:
+        return open(index_path, "a")
+
+    index_file = open(index_path, "w")
+    index_file.write(header)
+
+    # Fix permissions in case we need to create the file with sudo
+    if is_sudoed:
+        uid = pwd.getpwnam(usr).pw_uid
+        gid = grp.getgrnam(usr).gr_gid
+        os.chown(index_path, uid, gid)
+
+    return index_file
+
+
+def get_log_segments(log_path):
+    '''
+    Returns the paths of the rotated segments of log_path followed by
+    log_path itself (if it exists), oldest first.
+    '''
+
+    log_dir, log_name = os.path.split(log_path)
+    segments = []
+    try:
+        for name in os.listdir(log_dir or "."):
+            match = LOG_SEGMENT_RE.match(name)
+            if match and match.group("log") == log_name:
+                segments.append(os.path.join(log_dir, name))
+    except OSError:
+        pass
+
+    # Timestamps sort lexicographically, ignore the compression suffix
+    segments.sort(key=lambda path: re.sub(r"\.gz$", "", path))
+
+    if os.path.isfile(log_path):
+        segments.append(log_path)
+
+    return segments
+
+
+def open_log_segment(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+
+    return open(path, "r")
+
+
+def list_log_files(log_dir, app=None):
+    '''
+    Returns the paths of the logs in log_dir, one per app no matter how
+    many times it was rotated. Use get_log_segments() to read them.
+    '''
+
+    logs = set()
+    if os.path.isdir(log_dir):
+        for name in os.listdir(log_dir):
+            match = LOG_SEGMENT_RE.match(name)
+            if match:
+                name = match.group("log")
+            elif not name.endswith(".log"):
+                continue
+
+            if app is None or name == "{}.log".format(app):
+                logs.add(os.path.join(log_dir, name))
+
+    return sorted(logs)
 
 
 def _get_log_dirs():
@@ -313,18 +1310,16 @@ def _get_log_dirs():
 def read_logs(app=None):
     data = {}
     for d in _get_log_dirs():
-        if os.path.isdir(d):
-            for log in os.listdir(d):
-                if app is None or re.match("^{}\.log".format(app), log):  # noqa
-                    log_path = os.path.join(d, log)
-                    with open(log_path, "r") as f:
-                        data[log_path] = []
-                        for line in f.readlines():
-                            try:
-                                data[log_path].append(json.loads(line))
-                            except Exception:
-                                # unable to read the line, skip it
-                                pass
+        for log_path in list_log_files(d, app):
+            data[log_path] = []
+            for segment in get_log_segments(log_path):
+                with open_log_segment(segment) as f:
+                    for line in f:
+                        try:
+                            data[log_path].append(json.loads(line))
+                        except Exception:
+                            # unable to read the line, skip it
+                            pass
 
     return data
 
@@ -335,15 +1330,25 @@ def cleanup(app=None, line_limit=TAIL_LENGTH):
         dirs.append(SYSTEM_LOGS_DIR)
 
     for d in dirs:
-        if os.path.isdir(d):
-            for log in os.listdir(d):
-                if app is None or re.match("^{}\.log".format(app), log):  # noqa
-                    log_path = os.path.join(d, log)
+        for log_path in list_log_files(d, app):
+            # the rotated segments are older than the lines being kept
+            for segment in get_log_segments(log_path):
+                if segment != log_path:
                     try:
-                        __tail_log_file(log_path, line_limit)
-                    except IOError:
+                        os.remove(segment)
+                    except OSError:
                         pass
 
+            try:
+                os.remove(get_index_path(log_path))
+            except OSError:
+                pass
+
+            try:
+                __tail_log_file(log_path, line_limit)
+            except IOError:
+                pass
+
 
 def __tail_log_file(file_path, length):
     data = None
@@ -370,11 +1375,16 @@ def log_excepthook(exc_class, exc_value, tb):
     except Exception:
         exc_txt = ""
 
+    # Write out what led to the crash first. The error is recorded in turn
+    # if the log level is too low for it, hence the second dump.
+    logger.dump_flight_recorder()
     logger.error("Unhandled exception '{}' at {}"
                  .format(exc_value, exc_txt),
                  traceback=tb_txt,
                  exc_class=repr(exc_class),
                  exc_value=repr(exc_value))
+    logger.dump_flight_recorder()
+    logger.flush()
     sys.__excepthook__(exc_class, exc_value, tb)
 
 
@@ -0,0 +1,351 @@
+# boot_timeline.py
+#
+# Copyright (C) 2019 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Where the seconds go between DHCP bringing the network up and the network
+# scripts being done, see bin/kano-boot-timeline
+#
+# The dhcpcd hook launches kano-sentry-startup, kano-set-system-date and
+# kano-network-hook in parallel. Their events come from the traces recorded
+# while profiling is enabled (kano.tracer), or failing that from their log
+# records and the lines the hook sends to the journal.
+
+
+import re
+import time
+from collections import namedtuple
+
+import kano.logging as logging
+from kano.tracer import read_trace_file, PHASE_BEGIN, PHASE_END, \
+    PHASE_INSTANT
+from kano.log_reader import merge_logs
+
+DHCP_HOOK = 'kano-dhcp-hook'
+NETWORK_SCRIPTS = (
+    'kano-sentry-startup',
+    'kano-set-system-date',
+    'kano-network-hook'
+)
+
+# Instant events marking the milestones, as recorded by the scripts
+DHCP_EVENT_RE = re.compile(r'^dhcp (REBOOT|BOUND)$')
+TIME_SYNCED = 'time synced'
+
+# Log messages standing for the events when there are no traces
+TIME_SYNCED_LOG_RE = re.compile(r'^rdate SUCCESS')
+JOURNAL_DHCP_RE = re.compile(
+    r'^(?P<time>\d+\.\d+) \S+ \S+\[(?P<pid>\d+)\]: '
+    r'kano-dhcp-hook: (?P<reason>REBOOT|BOUND) event'
+)
+
+Event = namedtuple('Event', 'time app pid tid phase name')
+Span = namedtuple('Span', 'name start end')
+Segment = namedtuple('Segment', 'name start end')
+
+
+class Process(object):
+    '''
+    The events of one process: when it was first and last seen, its spans
+    in order of start and its instant events
+    '''
+
+    def __init__(self, app, pid):
+        self.app = app
+        self.pid = pid
+        self.start = None
+        self.end = None
+        self.spans = []
+        self.instants = []
+        self._open = {}
+
+    def add(self, event):
+        if self.start is None or event.time < self.start:
+            self.start = event.time
+        if self.end is None or event.time > self.end:
+            self.end = event.time
+
+        key = (event.tid, event.name)
+        if event.phase == PHASE_BEGIN:
+            self._open.setdefault(key, []).append(event.time)
+        elif event.phase == PHASE_END:
+            starts = self._open.get(key)
+            if starts:
+                self.spans.append(Span(event.name, starts.pop(), event.time))
+        elif event.phase == PHASE_INSTANT:
+            self.instants.append((event.time, event.name))
+
+    def finish(self):
+        # spans which never ended last until the process was last seen
+        for (tid, name), starts in self._open.iteritems():
+            for start in starts:
+                self.spans.append(Span(name, start, self.end))
+        self._open = {}
+
+        self.spans.sort(key=lambda span: (span.start, -span.end))
+        self.instants.sort()
+
+    def find_instant(self, name, since=None):
+        for event_time, event_name in self.instants:
+            if event_name == name and (since is None or event_time >= since):
+                return event_time
+
+        return None
+
+
+def read_trace_events(paths):
+    events = []
+    for path in paths:
+        try:
+            app, pid, trace_events = read_trace_file(path)
+        except (IOError, ValueError):
+            continue
+
+        events += [
+            Event(e['time'], app, e['pid'], e['tid'], e['phase'], e['name'])
+            for e in trace_events
+        ]
+
+    return events
+
+
+def read_log_events(log_paths, since=None):
+    '''
+    Turns the log records of the network scripts into events: the
+    kano.profiling timepoints, the time being synced and otherwise
+    instants which only tell when the process was running
+    '''
+
+    events = []
+    for entry in merge_logs(log_paths, since=since):
+        app = entry['app_name']
+        pid = entry.get('pid', 0)
+
+        if 'transition' in entry and 'isStart' in entry:
+            phase = PHASE_BEGIN if entry['isStart'] else PHASE_END
+            name = entry['transition']
+        elif TIME_SYNCED_LOG_RE.match(entry.get('message', '')):
+            phase, name = PHASE_INSTANT, TIME_SYNCED
+        else:
+            phase, name = PHASE_INSTANT, 'log'
+
+        events.append(Event(entry['time'], app, pid, pid, phase, name))
+
+    return events
+
+
+def read_journal_events(journal_lines):
+    '''
+    Finds the DHCP events in the output of journalctl -o short-unix
+    '''
+
+    events = []
+    for line in journal_lines:
+        match = JOURNAL_DHCP_RE.match(line)
+        if match:
+            pid = int(match.group('pid'))
+            events.append(Event(
+                float(match.group('time')), DHCP_HOOK, pid, pid,
+                PHASE_INSTANT, 'dhcp ' + match.group('reason')
+            ))
+
+    return events
+
+
+def merge_events(trace_events, log_events=(), journal_events=()):
+    '''
+    Completes the traces with the events of the processes which weren't
+    traced
+    '''
+
+    traced = set(event.pid for event in trace_events)
+    events = list(trace_events)
+    events += [e for e in log_events if e.pid not in traced]
+
+    if not any(DHCP_EVENT_RE.match(e.name) for e in trace_events):
+        events += journal_events
+
+    return events
+
+
+def build_processes(events):
+    processes = {}
+    for event in sorted(events):
+        process = processes.get(event.pid)
+        if process is None:
+            process = processes[event.pid] = Process(event.app, event.pid)
+        process.add(event)
+
+    for process in processes.itervalues():
+        process.finish()
+
+    return sorted(processes.itervalues(), key=lambda p: p.start)
+
+
+def critical_path(process, start, end):
+    '''
+    Breaks the time from start to end, a point in the process, into the
+    wait for it to start and its outermost spans, with the gaps between
+    them
+    '''
+
+    segments = []
+    if process.start > start:
+        segments.append(
+            Segment('start {}'.format(process.app), start, process.start)
+        )
+
+    position = max(start, process.start)
+    for span in process.spans:
+        if span.start < position or span.start >= end:
+            # nested in the previous span, or later
+            continue
+
+        if span.start > position:
+            segments.append(Segment(process.app, position, span.start))
+
+        segments.append(Segment(span.name, span.start, min(span.end, end)))
+        position = min(span.end, end)
+
+    if end > position:
+        segments.append(Segment(process.app, position, end))
+
+    return segments
+
+
+class BootTimeline(object):
+    '''
+    The processes from the latest DHCP REBOOT or BOUND event on, and the
+    milestones of the network bring-up
+    '''
+
+    def __init__(self, events):
+        dhcp_events = sorted(
+            (e.time, e.pid) for e in events if DHCP_EVENT_RE.match(e.name)
+        )
+
+        self.dhcp_time = None
+        self.dhcp_pid = None
+        if dhcp_events:
+            self.dhcp_time, self.dhcp_pid = dhcp_events[-1]
+
+        self.processes = [
+            process for process in build_processes(events)
+            if self.dhcp_time is None or process.end >= self.dhcp_time
+        ]
+
+    def _after_dhcp(self, process):
+        return self.dhcp_time is None or process.start >= self.dhcp_time
+
+    def get_scripts(self):
+        return [
+            process for process in self.processes
+            if process.app in NETWORK_SCRIPTS and self._after_dhcp(process)
+        ]
+
+    def get_milestones(self):
+        '''
+        Returns the name, time, and the process reaching it, of the time
+        being synced and the network scripts being done
+        '''
+
+        milestones = []
+        scripts = self.get_scripts()
+
+        for process in scripts:
+            synced = process.find_instant(TIME_SYNCED, self.dhcp_time)
+            if synced is not None:
+                milestones.append(('time synced', synced, process))
+                break
+
+        if scripts:
+            last = max(scripts, key=lambda process: process.end)
+            milestones.append(('network scripts done', last.end, last))
+
+        return milestones
+
+
+HEADER = '  {:>9} {:>9} {:>9}'.format('start', 'end', 'duration')
+
+
+def format_duration(seconds):
+    return '{:.3f}s'.format(seconds)
+
+
+def format_report(timeline):
+    if timeline.dhcp_time is None:
+        return 'No DHCP REBOOT or BOUND event found\n'
+
+    origin = timeline.dhcp_time
+    lines = [
+        'DHCP event at {}.{:03d}, times are relative to it'.format(
+            time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(origin)),
+            int(origin % 1 * 1000)
+        ),
+        '',
+        'Processes:',
+        HEADER
+    ]
+
+    for process in timeline.processes:
+        lines.append('  {:>9} {:>9} {:>9}  {} [{}]'.format(
+            format_duration(process.start - origin),
+            format_duration(process.end - origin),
+            format_duration(process.end - process.start),
+            process.app, process.pid
+        ))
+
+    milestones = timeline.get_milestones()
+    if not milestones:
+        lines += ['', 'None of the network scripts ran']
+
+    for name, milestone_time, process in milestones:
+        lines += [
+            '',
+            'Critical path to {}, {}:'.format(
+                name, format_duration(milestone_time - origin)
+            ),
+            HEADER
+        ]
+
+        segments = critical_path(process, origin, milestone_time)
+        for segment in segments:
+            lines.append('  {:>9} {:>9} {:>9}  {}'.format(
+                format_duration(segment.start - origin),
+                format_duration(segment.end - origin),
+                format_duration(segment.end - segment.start),
+                segment.name
+            ))
+
+    missing = [
+        app for app in NETWORK_SCRIPTS
+        if app not in set(p.app for p in timeline.get_scripts())
+    ]
+    if missing and milestones:
+        lines += ['', 'Not seen: {}'.format(', '.join(missing))]
+
+    return '\n'.join(lines) + '\n'
+
+
+def get_boot_time():
+    try:
+        with open('/proc/stat') as f:
+            for line in f:
+                if line.startswith('btime '):
+                    return float(line.split()[1])
+    except IOError:
+        pass
+
+    return None
+
+
+def get_network_log_files(log_dirs=None):
+    if log_dirs is None:
+        log_dirs = logging._get_log_dirs()
+
+    paths = []
+    for log_dir in log_dirs:
+        for app in NETWORK_SCRIPTS:
+            paths += logging.list_log_files(log_dir, app)
+
+    return paths
@@ -0,0 +1,277 @@
+# conf_cache.py
+#
+# Copyright (C) 2019 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Loading of the small YAML configuration files read by every process which
+# logs or profiles, e.g. /etc/kano-logs.conf, without importing yaml.
+#
+# These files only ever hold mappings of plain scalars, which are parsed
+# here directly. Anything else falls back to yaml, so the result is always
+# what yaml.load() would return. Parsed files are cached until they change.
+
+
+import os
+import re
+import copy
+
+# Names, and paths such as the app keys of /etc/kano-profiling.conf
+KEY_RE = re.compile(r'^([A-Za-z_/][\w./-]*):(?:\s+(.*?))?\s*$')
+
+INT_RE = re.compile(r'^[-+]?(0|[1-9][0-9]*)$')
+FLOAT_RE = re.compile(r'^([-+]?[0-9]+\.[0-9]*|\.[0-9]+)$')
+
+# Plain scalars which yaml would turn into something else than a string,
+# i.e. octal and hex numbers, exponents, times, dates, special floats, or
+# which start with an indicator for syntax not handled here
+UNSUPPORTED_RE = re.compile(
+    r'^[-+]?0[0-9xob]|[0-9][eE]|[0-9]_|:|^[0-9]{4}-|^[-+]?\.(inf|nan)|'
+    r'^[\[\]{}&*!|>%@`,?=]|^- |^-$|^<<',
+    re.IGNORECASE
+)
+
+BOOLEANS = {}
+for name in ('true', 'yes', 'on'):
+    BOOLEANS.update(dict.fromkeys([name, name.title(), name.upper()], True))
+for name in ('false', 'no', 'off'):
+    BOOLEANS.update(dict.fromkeys([name, name.title(), name.upper()], False))
+NULLS = ('~', 'null', 'Null', 'NULL')
+
+_cache = {}
+
+
+class UnsupportedConf(Exception):
+    pass
+
+
+def _parse_scalar(value):
+    if value[0] in '\'"':
+        quote = value[0]
+        if len(value) < 2 or value[-1] != quote:
+            raise UnsupportedConf(value)
+
+        inner = value[1:-1]
+        if quote == "'":
+            if "'" in inner.replace("''", ''):
+                raise UnsupportedConf(value)
+            inner = inner.replace("''", "'")
+        elif '"' in inner or '\\' in inner:
+            raise UnsupportedConf(value)
+
+        return _to_str(inner)
+
+    # drop comments at the end of the line
+    value = value.split(' #', 1)[0].rstrip()
+
+    if UNSUPPORTED_RE.search(value):
+        raise UnsupportedConf(value)
+
+    if value in BOOLEANS:
+        return BOOLEANS[value]
+    if value in NULLS:
+        return None
+    if INT_RE.match(value):
+        return int(value)
+    if FLOAT_RE.match(value):
+        return float(value)
+
+    return _to_str(value)
+
+
+def _to_str(value):
+    # yaml gives str for ASCII and unicode for everything else
+    try:
+        value.decode('ascii')
+        return value
+    except UnicodeError:
+        return value.decode('utf8')
+
+
+def _end_scalar(scalar):
+    if scalar is not None:
+        mapping, key, dummy_indent, parts = scalar
+        mapping[key] = _parse_scalar(' '.join(parts))
+
+
+def parse_conf(text):
+    '''
+    Parses a YAML document made of nested mappings of plain scalars, as
+    yaml.load() would. Raises UnsupportedConf for anything else.
+    '''
+
+    root = {}
+    # [indent of the key owning the mapping, mapping, indent of its keys]
+    stack = [[-1, root, None]]
+    pending = None
+    # [mapping, key, indent of the key, lines] of a plain scalar going on
+    # over the following lines, e.g. the commands of the profiling conf
+    scalar = None
+
+    for line in text.splitlines():
+        content = line.lstrip(' ')
+        if not content.strip() or content.startswith('#'):
+            # lines after this one can't be folded into the scalar
+            _end_scalar(scalar)
+            scalar = None
+            continue
+        if content[0] == '\t' or line.startswith('---') or \
+           line.startswith('...'):
+            raise UnsupportedConf(line)
+
+        indent = len(line) - len(content)
+        match = KEY_RE.match(content)
+        if scalar is not None and indent > scalar[2]:
+            if match:
+                raise UnsupportedConf(line)
+            scalar[3].append(content.rstrip())
+            continue
+
+        _end_scalar(scalar)
+        scalar = None
+
+        if not match:
+            if pending is None or indent <= pending[2]:
+                raise UnsupportedConf(line)
+
+            mapping, key, key_indent = pending
+            pending = None
+            scalar = [mapping, key, key_indent, [content.rstrip()]]
+            continue
+
+        if pending is not None:
+            mapping, key, key_indent = pending
+            pending = None
+            if indent > key_indent:
+                child = {}
+                mapping[key] = child
+                stack.append([key_indent, child, indent])
+
+        while indent <= stack[-1][0]:
+            stack.pop()
+
+        frame = stack[-1]
+        if frame[2] is None:
+            frame[2] = indent
+        elif frame[2] != indent:
+            raise UnsupportedConf(line)
+
+        key, value = match.groups()
+        key = _to_str(key)
+        if key in frame[1]:
+            raise UnsupportedConf(line)
+
+        if value is None or value.startswith('#'):
+            frame[1][key] = None
+            pending = (frame[1], key, indent)
+        else:
+            frame[1][key] = _parse_scalar(value)
+
+    _end_scalar(scalar)
+
+    if not root:
+        return None
+
+    return root
+
+
+def _format_scalar(value):
+    if value is None:
+        text = 'null'
+    elif isinstance(value, bool):
+        text = 'true' if value else 'false'
+    elif isinstance(value, (int, long, float)):
+        text = repr(value)
+    elif isinstance(value, basestring):
+        text = value.encode('utf8') if isinstance(value, unicode) else value
+    else:
+        raise UnsupportedConf(value)
+
+    # only write what reads back the same
+    try:
+        if text and not text[0].isspace() and text == text.strip() and \
+           '\n' not in text and _parse_scalar(text) == value and \
+           type(_parse_scalar(text)) == type(value):
+            return text
+    except UnsupportedConf:
+        pass
+
+    raise UnsupportedConf(value)
+
+
+def dump_conf(conf):
+    '''
+    Serialises a flat mapping as "key: value" lines, as yaml.dump() with
+    default_flow_style=False would, falling back to it for other values
+    '''
+
+    try:
+        lines = [
+            '{}: {}\n'.format(key, _format_scalar(conf[key]))
+            for key in sorted(conf)
+        ]
+        return ''.join(lines)
+    except UnsupportedConf:
+        import yaml
+        return yaml.dump(conf, default_flow_style=False)
+
+
+def load_conf(path):
+    '''
+    Returns the contents of the YAML file at path, or None if it doesn't
+    exist or is empty. The file is only parsed again once it changed.
+    '''
+
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    key = (stat.st_mtime, stat.st_size, stat.st_ino)
+    cached = _cache.get(path)
+    if cached is None or cached[0] != key:
+        try:
+            with open(path, 'r') as f:
+                text = f.read()
+        except IOError:
+            return None
+
+        try:
+            conf = parse_conf(text)
+        except UnsupportedConf:
+            import yaml
+            conf = yaml.load(text)
+
+        cached = _cache[path] = (key, conf)
+
+    # callers are free to change what they get
+    return copy.deepcopy(cached[1])
+
+
+def watch_conf(path, callback):
+    '''
+    Calls callback() from a background thread whenever the file at path is
+    written, replaced or removed. This needs pyinotify, returns the
+    notifier to stop() or None if it isn't available.
+    '''
+
+    try:
+        import pyinotify
+    except ImportError:
+        return None
+
+    conf_dir, conf_name = os.path.split(os.path.abspath(path))
+
+    class ConfChangeHandler(pyinotify.ProcessEvent):
+        def process_default(self, event):
+            if event.name == conf_name:
+                callback()
+
+    mask = pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO | \
+        pyinotify.IN_DELETE
+    wm = pyinotify.WatchManager()
+    notifier = pyinotify.ThreadedNotifier(wm, ConfChangeHandler())
+    notifier.daemon = True
+    notifier.start()
+    wm.add_watch(conf_dir, mask)
+
+    return notifier
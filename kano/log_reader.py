@@ -0,0 +1,834 @@
+# log_reader.py
+#
+# Copyright (C) 2019 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Streaming access to the JSON-lines log files written by kano.logging
+
+
+import os
+import re
+import json
+import time
+import heapq
+import bisect
+import datetime
+import itertools
+import multiprocessing
+
+import kano.logging as logging
+
+# How far out of time order the records of a log file can be. Buffered,
+# asynchronous and kano-logd writers and several processes appending to
+# the same file write records up to a few seconds late, and a repeat count
+# up to logging.REPEAT_REPORT_INTERVAL seconds late.
+ORDER_SLACK = 2 * logging.REPEAT_REPORT_INTERVAL
+
+# The most bytes of a log file a worker of query_logs() reads at a time,
+# which bounds what it sends back
+QUERY_CHUNK_SIZE = 1024 * 1024
+
+# Cheaper than json.loads() for the lines written by kano.logging
+TIME_RE = re.compile(r'"time": (-?[0-9.eE+-]+)')
+
+RELATIVE_TIME_RE = re.compile(r'^(\d+(?:\.\d+)?)\s*([smhd])$')
+RELATIVE_TIME_UNITS = {
+    's': 1,
+    'm': 60,
+    'h': 60 * 60,
+    'd': 24 * 60 * 60
+}
+ABSOLUTE_TIME_FORMATS = [
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%d %H:%M',
+    '%Y-%m-%dT%H:%M:%S',
+    '%Y-%m-%d',
+    '%H:%M:%S',
+    '%H:%M'
+]
+
+
+def get_app_name(log_path):
+    return re.sub(r"\.log$", "", os.path.basename(log_path))
+
+
+def parse_time(value, now=None):
+    '''
+    Converts a point in time given on the command line to a timestamp.
+    Accepts timestamps, times relative to now such as "10m" or "2h",
+    dates such as "2019-03-01 12:30" and times of today such as "12:30".
+    '''
+
+    if now is None:
+        now = time.time()
+
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+
+    match = RELATIVE_TIME_RE.match(value)
+    if match:
+        return now - float(match.group(1)) * \
+            RELATIVE_TIME_UNITS[match.group(2)]
+
+    for fmt in ABSOLUTE_TIME_FORMATS:
+        try:
+            dt = datetime.datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+
+        if '%Y' not in fmt:
+            today = datetime.datetime.fromtimestamp(now)
+            dt = dt.replace(year=today.year, month=today.month, day=today.day)
+
+        return time.mktime(dt.timetuple())
+
+    raise ValueError("Unrecognised time '{}'".format(value))
+
+
+def parse_duration(value):
+    '''
+    Converts a duration such as "90", "10m" or "1h" to seconds
+    '''
+
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+
+    match = RELATIVE_TIME_RE.match(value)
+    if match:
+        return float(match.group(1)) * RELATIVE_TIME_UNITS[match.group(2)]
+
+    raise ValueError("Unrecognised duration '{}'".format(value))
+
+
+def _get_line_time(line):
+    match = TIME_RE.search(line)
+    if match:
+        try:
+            return float(match.group(1))
+        except ValueError:
+            pass
+
+    return json.loads(line)["time"]
+
+
+def read_index(log_path):
+    '''
+    Returns the (time, offset) entries of the sidecar index of log_path,
+    sorted by offset, or None if there is no valid index for the file
+    '''
+
+    try:
+        log_stat = os.stat(log_path)
+        with open(logging.get_index_path(log_path), "r") as f:
+            header = f.readline()
+            if header != "# {}\n".format(log_stat.st_ino):
+                return None
+
+            entries = []
+            for line in f:
+                try:
+                    entry_time, offset = line.split()
+                    entries.append((float(entry_time), int(offset)))
+                except ValueError:
+                    # partially written line
+                    continue
+    except (IOError, OSError):
+        return None
+
+    entries.sort(key=lambda entry: entry[1])
+    if entries and entries[-1][1] > log_stat.st_size:
+        # the file was truncated under the index
+        return None
+
+    return entries
+
+
+def build_index(log_path, interval=None):
+    '''
+    Scans log_path to build its sidecar index, saving it next to the log
+    when possible. Returns the entries as read_index() does.
+    '''
+
+    if interval is None:
+        interval = logging.INDEX_INTERVAL
+
+    entries = []
+    with open(log_path, "r") as f:
+        header = logging.get_index_header(f.fileno())
+
+        offset = 0
+        last_offset = 0
+        max_time = None
+        for line in f:
+            if offset - last_offset >= interval and max_time is not None:
+                entries.append((max_time, offset))
+                last_offset = offset
+
+            offset += len(line)
+            try:
+                line_time = _get_line_time(line)
+            except Exception:
+                continue
+
+            if max_time is None or line_time > max_time:
+                max_time = line_time
+
+    index_path = logging.get_index_path(log_path)
+    tmp_path = "{}.{}.tmp".format(index_path, os.getpid())
+    try:
+        with open(tmp_path, "w") as f:
+            f.write(header)
+            for entry_time, entry_offset in entries:
+                f.write("{!r} {}\n".format(entry_time, entry_offset))
+        os.rename(tmp_path, index_path)
+    except (IOError, OSError):
+        # most likely a log we can read but not write to
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+    return entries
+
+
+def find_offset(log_path, since):
+    '''
+    Returns an offset in log_path before which every record was logged
+    before since, using (and building when needed) the sidecar index
+    '''
+
+    entries = read_index(log_path)
+    if entries is None:
+        entries = build_index(log_path)
+
+    # Each entry bounds the records before it, so does every later entry.
+    # Keep the tightest bound for each to get times which never decrease.
+    bounds = []
+    lowest = None
+    for entry_time, dummy_offset in reversed(entries):
+        if lowest is None or entry_time < lowest:
+            lowest = entry_time
+        bounds.append(lowest)
+    bounds.reverse()
+
+    pos = bisect.bisect_left(bounds, since)
+    if pos == 0:
+        return 0
+
+    return entries[pos - 1][1]
+
+
+def _plan_chunks(log_path, since=None):
+    '''
+    Returns (segment, start, end) tuples covering the parts of log_path and
+    of its rotated segments which can hold entries from since on, oldest
+    first, each at most QUERY_CHUNK_SIZE bytes long. A compressed segment
+    can't be split and the live file may still grow, their last chunk has
+    no end.
+    '''
+
+    chunks = []
+    for segment in logging.get_log_segments(log_path):
+        start = 0
+        try:
+            if since is not None:
+                if segment != log_path:
+                    # nothing was written to a segment after it was rotated
+                    if os.path.getmtime(segment) < since:
+                        continue
+                else:
+                    start = find_offset(log_path, since)
+
+            size = os.path.getsize(segment)
+        except (IOError, OSError):
+            # rotated away since the directory was listed
+            continue
+
+        if segment.endswith(".gz"):
+            chunks.append((segment, 0, None))
+            continue
+
+        while start + QUERY_CHUNK_SIZE < size:
+            chunks.append((segment, start, start + QUERY_CHUNK_SIZE))
+            start += QUERY_CHUNK_SIZE
+
+        if segment == log_path:
+            chunks.append((segment, start, None))
+        elif start < size:
+            chunks.append((segment, start, size))
+
+    return chunks
+
+
+def _read_chunk(segment, start, end, app_name, since=None, until=None):
+    '''
+    Yields the entries of the lines of segment starting from start up to
+    end, then None if it met an entry ORDER_SLACK seconds past until, as
+    nothing after that one is wanted.
+    '''
+
+    try:
+        f = logging.open_log_segment(segment)
+    except (IOError, OSError):
+        # rotated away since the directory was listed
+        return
+
+    with f:
+        offset = start
+        if start:
+            # the line across start belongs to the previous chunk
+            f.seek(start - 1)
+            offset += len(f.readline()) - 1
+
+        for line in f:
+            if end is not None and offset >= end:
+                return
+            offset += len(line)
+
+            try:
+                entry = json.loads(line)
+                entry_time = entry["time"]
+            except Exception:
+                continue
+
+            if since is not None and entry_time < since:
+                continue
+
+            if until is not None and entry_time > until:
+                if entry_time > until + ORDER_SLACK:
+                    yield None
+                    return
+                # buffered and concurrent writers leave records a
+                # little out of order, earlier ones may still follow
+                continue
+
+            entry["app_name"] = app_name
+            yield entry
+
+
+def iter_log_file(log_path, app_name=None, since=None, until=None):
+    '''
+    Yields the entries of a log file one at a time, going through its
+    rotated segments first. Every entry gets an "app_name" field, lines
+    that can't be parsed are skipped.
+
+    since and until limit the entries to a time range, seeking straight
+    to the right part of the log file through its index. Reading goes on
+    until an entry ORDER_SLACK seconds past until, as records aren't
+    strictly in time order.
+    '''
+
+    if app_name is None:
+        app_name = get_app_name(log_path)
+
+    for segment, start, end in _plan_chunks(log_path, since):
+        for entry in _read_chunk(segment, start, end, app_name, since,
+                                 until):
+            if entry is None:
+                return
+            yield entry
+
+
+def merge_logs(log_paths, since=None, until=None):
+    '''
+    Merges the entries of several log files into a single stream ordered
+    by time. Each file is read lazily and is expected to be in time order
+    already, which is the case for files appended to by kano.logging.
+    '''
+
+    def decorate(index, entries):
+        for line_no, entry in enumerate(entries):
+            yield entry["time"], index, line_no, entry
+
+    streams = [
+        decorate(index, iter_log_file(path, since=since, until=until))
+        for index, path in enumerate(log_paths)
+    ]
+
+    return itertools.imap(lambda item: item[-1], heapq.merge(*streams))
+
+
+class LogFilter(object):
+    '''
+    Selects the log entries matching all of the criteria it was given:
+    the least severe level to keep, a list of pids, a time range, a regular
+    expression to search the messages for and values of other JSON fields,
+    compared as strings.
+    '''
+
+    def __init__(self, level=None, pids=None, since=None, until=None,
+                 pattern=None, fields=None):
+        self.level = logging.normalise_level(level) if level else None
+        self.pids = set(pids) if pids else None
+        self.since = since
+        self.until = until
+        self.pattern = re.compile(pattern) if pattern else None
+        self.fields = dict(fields or {})
+
+    def matches(self, entry):
+        if self.level is not None:
+            level = logging.LEVELS.get(entry.get('level'))
+            if not level or level > logging.LEVELS[self.level]:
+                return False
+
+        if self.pids is not None and entry.get('pid') not in self.pids:
+            return False
+
+        entry_time = entry['time']
+        if self.since is not None and entry_time < self.since:
+            return False
+        if self.until is not None and entry_time > self.until:
+            return False
+
+        if self.pattern is not None and \
+           not self.pattern.search(unicode(entry.get('message', ''))):
+            return False
+
+        for key, value in self.fields.iteritems():
+            if key not in entry or unicode(entry[key]) != value:
+                return False
+
+        return True
+
+    def iter_entries(self, log_path):
+        for entry in iter_log_file(log_path, since=self.since,
+                                   until=self.until):
+            if self.matches(entry):
+                yield entry
+
+
+def _query_chunk(task):
+    '''
+    Returns the entries of a chunk of a log file matching the filter, and
+    whether the entries of the following chunks are all past the filter's
+    time range
+    '''
+
+    log_path, segment, start, end, log_filter = task
+
+    entries = []
+    for entry in _read_chunk(segment, start, end, get_app_name(log_path),
+                             log_filter.since, log_filter.until):
+        if entry is None:
+            return entries, True
+        if log_filter.matches(entry):
+            entries.append(entry)
+
+    return entries, False
+
+
+def _count_log_file(task):
+    log_path, log_filter, group_by = task
+
+    counts = {}
+    for entry in log_filter.iter_entries(log_path):
+        key = tuple(entry.get(field) for field in group_by)
+        counts[key] = counts.get(key, 0) + 1
+
+    return counts
+
+
+def _map_log_files(func, tasks, processes=None):
+    '''
+    Runs func on each task, in a pool of processes when there is more than
+    one log file to go through
+    '''
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = min(processes, len(tasks))
+
+    if processes <= 1:
+        return [func(task) for task in tasks]
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        return pool.map(func, tasks, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _iter_chunk_results(pool, log_path, log_filter):
+    '''
+    Yields the entries of log_path matching log_filter, parsed by the
+    workers of pool one chunk at a time. The next chunk is read while the
+    entries of the current one are consumed.
+    '''
+
+    tasks = [
+        (log_path, segment, start, end, log_filter)
+        for segment, start, end in _plan_chunks(log_path, log_filter.since)
+    ]
+    # submitted right away so every log is parsed while the first one is
+    # waited for
+    pending = [
+        pool.apply_async(_query_chunk, (task,)) for task in tasks[:2]
+    ]
+    tasks = tasks[2:]
+
+    def results():
+        while pending:
+            entries, done = pending.pop(0).get()
+            if done:
+                del tasks[:]
+                del pending[:]
+            elif tasks:
+                pending.append(pool.apply_async(_query_chunk,
+                                                (tasks.pop(0),)))
+
+            for entry in entries:
+                yield entry
+
+    return results()
+
+
+def query_logs(log_paths, log_filter=None, processes=None):
+    '''
+    Yields the entries of the log files matching log_filter, ordered by
+    time. The files are parsed in parallel by a pool of worker processes,
+    a chunk at a time, and the entries are yielded as soon as every file
+    has some to merge, so memory use doesn't grow with the size of the
+    logs.
+    '''
+
+    if log_filter is None:
+        log_filter = LogFilter()
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+
+    def decorate(index, entries):
+        for line_no, entry in enumerate(entries):
+            yield entry['time'], index, line_no, entry
+
+    if processes <= 1:
+        streams = [
+            decorate(index, log_filter.iter_entries(path))
+            for index, path in enumerate(log_paths)
+        ]
+        for item in heapq.merge(*streams):
+            yield item[-1]
+        return
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        streams = [
+            decorate(index, _iter_chunk_results(pool, path, log_filter))
+            for index, path in enumerate(log_paths)
+        ]
+        for item in heapq.merge(*streams):
+            yield item[-1]
+    finally:
+        # stops the workers still busy when the caller stopped early
+        pool.terminate()
+        pool.join()
+
+
+def count_logs(log_paths, log_filter=None, group_by=(), processes=None):
+    '''
+    Counts the entries of the log files matching log_filter, grouped by
+    the values of the fields in group_by. Returns a dict mapping tuples of
+    those values to counts, with a single () key when not grouping.
+    '''
+
+    if log_filter is None:
+        log_filter = LogFilter()
+
+    counts = {}
+    results = _map_log_files(
+        _count_log_file,
+        [(path, log_filter, tuple(group_by)) for path in log_paths],
+        processes
+    )
+    for file_counts in results:
+        for key, count in file_counts.iteritems():
+            counts[key] = counts.get(key, 0) + count
+
+    return counts
+
+
+class TopCounter(object):
+    '''
+    Keeps track of the most frequent items of a stream in constant memory,
+    using the Space-Saving algorithm. At most size items are counted, an
+    item seen for the first time when they are all taken replaces the least
+    frequent one and inherits its count, which is an upper bound on how
+    much the new count is overestimated.
+    '''
+
+    def __init__(self, size):
+        self.size = size
+        self._counts = {}
+        self._errors = {}
+        # lowest counts first, entries go stale as counts grow
+        self._heap = []
+
+    def __len__(self):
+        return len(self._counts)
+
+    def add(self, item, count=1):
+        if item in self._counts:
+            self._counts[item] += count
+            return
+
+        error = 0
+        if len(self._counts) >= self.size:
+            error = self._evict()
+
+        self._counts[item] = error + count
+        self._errors[item] = error
+        heapq.heappush(self._heap, (error + count, item))
+
+    def top(self, n=None):
+        '''
+        Returns (item, count, error) tuples, most frequent first
+        '''
+
+        items = sorted(
+            self._counts.iteritems(), key=lambda item: item[1], reverse=True
+        )
+        return [
+            (item, count, self._errors[item]) for item, count in items[:n]
+        ]
+
+    def _evict(self):
+        while True:
+            count, item = heapq.heappop(self._heap)
+            if self._counts[item] == count:
+                del self._counts[item]
+                del self._errors[item]
+                return count
+
+            heapq.heappush(self._heap, (self._counts[item], item))
+
+
+class LogStats(object):
+    '''
+    Aggregates log entries in a single pass: counts per app, level and
+    time bucket, error rates, and the most repeated messages and busiest
+    pids. Memory only grows with the number of apps and time buckets.
+    '''
+
+    # Items tracked for the top messages and pids
+    TOP_SIZE = 1000
+
+    def __init__(self, bucket=3600, top_size=TOP_SIZE):
+        self.bucket = bucket
+        self.total = 0
+        self.errors = 0
+        self.first = None
+        self.last = None
+        self.levels = {}
+        self.apps = {}
+        self.buckets = {}
+        self.messages = TopCounter(top_size)
+        self.pids = TopCounter(top_size)
+
+    def add(self, entry):
+        entry_time = entry['time']
+        level = entry.get('level')
+        app_name = entry.get('app_name')
+        is_error = level == 'error'
+
+        self.total += 1
+        self.errors += is_error
+        if self.first is None or entry_time < self.first:
+            self.first = entry_time
+        if self.last is None or entry_time > self.last:
+            self.last = entry_time
+
+        self.levels[level] = self.levels.get(level, 0) + 1
+
+        app = self.apps.get(app_name)
+        if app is None:
+            app = self.apps[app_name] = {'total': 0, 'levels': {}}
+        app['total'] += 1
+        app['levels'][level] = app['levels'].get(level, 0) + 1
+
+        bucket_time = int(entry_time // self.bucket * self.bucket)
+        bucket = self.buckets.get(bucket_time)
+        if bucket is None:
+            bucket = self.buckets[bucket_time] = [0, 0]
+        bucket[0] += 1
+        bucket[1] += is_error
+
+        self.messages.add((app_name, entry.get('message')))
+        self.pids.add((app_name, entry.get('pid')))
+
+    def to_dict(self, top=10):
+        def rate(errors, total):
+            return float(errors) / total if total else 0.0
+
+        apps = {}
+        for app_name, app in self.apps.iteritems():
+            apps[app_name] = {
+                'total': app['total'],
+                'levels': app['levels'],
+                'error_rate': rate(app['levels'].get('error', 0), app['total'])
+            }
+
+        return {
+            'total': self.total,
+            'first': self.first,
+            'last': self.last,
+            'error_rate': rate(self.errors, self.total),
+            'levels': self.levels,
+            'apps': apps,
+            'bucket': self.bucket,
+            'buckets': [
+                {
+                    'time': bucket_time,
+                    'total': total,
+                    'errors': errors,
+                    'error_rate': rate(errors, total)
+                }
+                for bucket_time, (total, errors)
+                in sorted(self.buckets.iteritems())
+            ],
+            'top_messages': [
+                {
+                    'app_name': app_name,
+                    'message': message,
+                    'count': count,
+                    'error': error
+                }
+                for (app_name, message), count, error
+                in self.messages.top(top)
+            ],
+            'top_pids': [
+                {
+                    'app_name': app_name,
+                    'pid': pid,
+                    'count': count,
+                    'error': error
+                }
+                for (app_name, pid), count, error in self.pids.top(top)
+            ]
+        }
+
+
+def log_stats(log_paths, log_filter=None, bucket=3600,
+              top_size=LogStats.TOP_SIZE):
+    '''
+    Returns the LogStats of the entries of the log files which match
+    log_filter, streaming through them once
+    '''
+
+    if log_filter is None:
+        log_filter = LogFilter()
+
+    stats = LogStats(bucket, top_size)
+    for log_path in log_paths:
+        for entry in log_filter.iter_entries(log_path):
+            stats.add(entry)
+
+    return stats
+
+
+class LogTail(object):
+    '''
+    Follows a log file as it is written to, only reading what was appended
+    since the last call. Copes with the file being truncated or rotated.
+    '''
+
+    # How far back from the end of the file to look for the initial entries
+    INITIAL_BYTES = 64 * 1024
+
+    def __init__(self, log_path, app_name=None):
+        self.path = log_path
+        self.app_name = app_name or get_app_name(log_path)
+
+        self._file = None
+        self._inode = None
+        self._offset = 0
+        self._partial = ''
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def initial(self, count):
+        '''
+        Returns the last count entries of the file and starts following it
+        from its current end
+        '''
+
+        if not self._open():
+            return []
+
+        size = os.fstat(self._file.fileno()).st_size
+        self._offset = max(0, size - self.INITIAL_BYTES)
+        self._file.seek(self._offset)
+        if self._offset:
+            # skip the partial line
+            self._offset += len(self._file.readline())
+
+        return self._read_appended()[-count:]
+
+    def read(self):
+        '''
+        Returns the entries appended since the last call
+        '''
+
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            stat = None
+
+        entries = []
+        if self._file is not None and \
+           (stat is None or stat.st_ino != self._inode):
+            # rotated, finish off the old file before moving to the new one
+            entries += self._read_appended()
+            self.close()
+            self._offset = 0
+            self._partial = ''
+
+        if self._file is None:
+            if stat is None or not self._open():
+                return entries
+        elif stat.st_size < self._offset:
+            # truncated, start over
+            self._offset = 0
+            self._partial = ''
+
+        return entries + self._read_appended()
+
+    def _open(self):
+        try:
+            self._file = open(self.path, 'r')
+        except IOError:
+            return False
+
+        self._inode = os.fstat(self._file.fileno()).st_ino
+        return True
+
+    def _read_appended(self):
+        self._file.seek(self._offset)
+        data = self._file.read()
+        self._offset += len(data)
+
+        lines = (self._partial + data).split('\n')
+        # the last line is still being written unless it is empty
+        self._partial = lines.pop()
+
+        entries = []
+        for line in lines:
+            try:
+                entry = json.loads(line)
+                entry['time']
+            except Exception:
+                continue
+
+            entry['app_name'] = self.app_name
+            entries.append(entry)
+
+        return entries
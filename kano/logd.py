@@ -0,0 +1,210 @@
+# logd.py
+#
+# Copyright (C) 2019 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Log collector daemon, see bin/kano-logd
+#
+# Processes using kano.logging send their records to the daemon over a
+# datagram socket in the logs dir instead of each appending to the log files
+# themselves. The daemon batches them up and writes them out in a single call
+# per file, keeping the files open between writes.
+
+
+import os
+import errno
+import select
+import socket
+import time
+from collections import OrderedDict
+
+import kano.logging as logging
+
+# Larger datagrams are rejected by the kernel, clients write those themselves
+MAX_DATAGRAM = 256 * 1024
+
+# Defaults for how long and how much to buffer before writing to the files
+FLUSH_INTERVAL = 1.0
+FLUSH_BYTES = 64 * 1024
+
+MAX_OPEN_FILES = 32
+
+
+class DaemonRunningError(Exception):
+    pass
+
+
+class LogDaemon(object):
+    def __init__(self, logs_dir, flush_interval=FLUSH_INTERVAL,
+                 flush_bytes=FLUSH_BYTES):
+        self.logs_dir = logs_dir
+        self.socket_path = logging.get_logd_socket_path(logs_dir)
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+
+        self._sock = None
+        self._running = False
+        self._reopen = False
+        self._files = OrderedDict()
+        self._pending = {}
+        self._pending_bytes = 0
+        self._flush_at = None
+
+    def bind(self):
+        if not os.path.isdir(self.logs_dir):
+            os.makedirs(self.logs_dir)
+
+        if os.path.exists(self.socket_path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            try:
+                probe.connect(self.socket_path)
+            except socket.error:
+                # left behind by a daemon which didn't shut down cleanly
+                os.remove(self.socket_path)
+            else:
+                raise DaemonRunningError(
+                    'kano-logd is already serving {}'.format(self.logs_dir)
+                )
+            finally:
+                probe.close()
+
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sock.bind(self.socket_path)
+        self._sock.setblocking(0)
+
+    def serve(self):
+        if self._sock is None:
+            self.bind()
+
+        self._running = True
+        try:
+            while self._running:
+                timeout = None
+                if self._flush_at is not None:
+                    timeout = max(0, self._flush_at - time.time())
+
+                try:
+                    readable, dummy, dummy = select.select(
+                        [self._sock], [], [], timeout
+                    )
+                except select.error as err:
+                    if err.args[0] == errno.EINTR:
+                        continue
+                    raise
+
+                if self._reopen:
+                    self._reopen = False
+                    self.close_files()
+
+                if readable:
+                    self._receive()
+
+                flush_due = self._flush_at is not None and \
+                    time.time() >= self._flush_at
+                if self._pending_bytes >= self.flush_bytes or flush_due:
+                    self.flush()
+        finally:
+            self.close()
+
+    # stop() and reopen() only set flags which the loop acts upon, so they
+    # are safe to call from signal handlers
+
+    def stop(self):
+        self._running = False
+
+    def reopen(self):
+        self._reopen = True
+
+    def close(self):
+        self.flush()
+        self.close_files()
+
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+            try:
+                os.remove(self.socket_path)
+            except OSError:
+                pass
+
+    def close_files(self):
+        for log_file in self._files.itervalues():
+            log_file.close()
+        self._files.clear()
+
+    def handle(self, datagram):
+        header, dummy, records = datagram.partition('\n')
+        fields = header.split()
+        if not fields or not records:
+            return
+
+        app_name = fields[0]
+        if app_name != os.path.basename(app_name) or app_name.startswith('.'):
+            return
+
+        if not records.endswith('\n'):
+            records += '\n'
+
+        self._pending.setdefault(app_name, []).append(records)
+        self._pending_bytes += len(records)
+        if self._flush_at is None:
+            self._flush_at = time.time() + self.flush_interval
+
+        if 'flush' in fields[1:]:
+            self.flush(app_name)
+
+    def flush(self, app_name=None):
+        apps = self._pending.keys() if app_name is None else [app_name]
+
+        for app in apps:
+            records = self._pending.pop(app, None)
+            if not records:
+                continue
+
+            data = ''.join(records)
+            self._pending_bytes -= len(data)
+
+            log_file = self._get_log_file(app)
+            try:
+                log_file.write(data)
+                log_file.flush()
+            except (IOError, OSError):
+                # nowhere else to put them, e.g. the disk is full
+                log_file.close()
+
+        if not self._pending:
+            self._pending_bytes = 0
+            self._flush_at = None
+
+    def _receive(self):
+        while True:
+            try:
+                datagram = self._sock.recv(MAX_DATAGRAM)
+            except socket.error as err:
+                if err.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                    return
+                raise
+
+            self.handle(datagram)
+
+    def _get_log_file(self, app_name):
+        log_file = self._files.pop(app_name, None)
+
+        if log_file is None:
+            if len(self._files) >= MAX_OPEN_FILES:
+                dummy, oldest = self._files.popitem(last=False)
+                oldest.close()
+
+            log_file = logging.LogFile(
+                os.path.join(self.logs_dir, '{}.log'.format(app_name)),
+                logging.logger._rotate_size,
+                logging.logger._rotate_count
+            )
+        else:
+            # the configuration may have been reloaded since it was opened
+            log_file.rotate_size = logging.logger._rotate_size
+            log_file.rotate_count = logging.logger._rotate_count
+
+        # most recently used last
+        self._files[app_name] = log_file
+        return log_file
@@ -21,7 +21,14 @@ import sys
 class lazy_logger:
     def __getattr__(self, name):
         import kano._logging
-        return getattr(kano._logging.logger, name)
+        attr = getattr(kano._logging.logger, name)
+
+        # Keep the bound methods so that the next logger.debug() etc. is a
+        # plain attribute lookup rather than another trip through here
+        if callable(attr):
+            self.__dict__[name] = attr
+
+        return attr
 
 
 class loader:
@@ -29,6 +36,7 @@ class loader:
 
     def __init__(self, old_mod):
         self.old_mod = old_mod
+        self.lazy_logger = None
 
     def __getattr__(self, name):
         # avoid importing the module just to make a logger object
@@ -36,7 +44,9 @@ class loader:
             return getattr(self.old_mod, name)
 
         if name == 'logger':
-            return self.ll()
+            if self.lazy_logger is None:
+                self.lazy_logger = self.ll()
+            return self.lazy_logger
 
         # load the real module
         # at this point we have substituted the module once,
@@ -64,6 +74,9 @@ def log_excepthook(exc_class, exc_value, tb):
     except Exception:
         exc_txt = ""
 
+    # Write out what led to the crash first. The error is recorded in turn
+    # if the log level is too low for it, hence the second dump.
+    kano.logging.logger.dump_flight_recorder()
     kano.logging.logger.error(
         "Unhandled exception '{}' at {} (see logfile for full trace)".format(
             exc_value, exc_txt
@@ -72,6 +85,8 @@ def log_excepthook(exc_class, exc_value, tb):
         exc_class=str(exc_class),
         exc_value=str(exc_value)
     )
+    kano.logging.logger.dump_flight_recorder()
+    kano.logging.logger.flush()
     sys.__excepthook__(exc_class, exc_value, tb)
 
 
@@ -0,0 +1,215 @@
+# meminfo.py
+#
+# Copyright (C) 2019 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Memory and garbage collection accounting for the "memory" mode of
+# kano.profiling
+#
+# The memory used by the process is read from /proc/self/smaps_rollup, or
+# summed from /proc/self/smaps on kernels older than 4.14. Collections and
+# the objects they freed come from gc.get_stats() and the time spent in them
+# from gc.callbacks, where available. Python 2 has neither, there a full
+# collection is run at both ends of the timepoint, the last one timed and
+# counting the cyclic garbage the timepoint left. The top allocation sites
+# come from tracemalloc where available, otherwise the objects tracked by
+# the gc are counted by type.
+
+
+import gc
+import time
+from collections import Counter
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+SMAPS_ROLLUP = '/proc/self/smaps_rollup'
+SMAPS = '/proc/self/smaps'
+STATUS = '/proc/self/status'
+
+SMAPS_FIELDS = {
+    'Rss:': 'rss_kb',
+    'Pss:': 'pss_kb',
+    'Swap:': 'swap_kb'
+}
+
+# Snapshots tracing allocations which haven't been compared yet
+_tracemalloc_users = 0
+
+
+def read_memory_usage():
+    '''
+    Returns the RSS, PSS and swap of this process in kB, or only the RSS
+    when smaps isn't available
+    '''
+
+    for path in (SMAPS_ROLLUP, SMAPS):
+        try:
+            with open(path) as f:
+                usage = dict.fromkeys(SMAPS_FIELDS.itervalues(), 0)
+                for line in f:
+                    fields = line.split()
+                    key = SMAPS_FIELDS.get(fields[0]) if fields else None
+                    if key:
+                        usage[key] += int(fields[1])
+
+                return usage
+        except IOError:
+            continue
+
+    try:
+        with open(STATUS) as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return {'rss_kb': int(line.split()[1])}
+    except IOError:
+        pass
+
+    return {}
+
+
+class GcStats(object):
+    '''
+    Counts the collections of each generation and the time spent in them,
+    once installed. Needs gc.callbacks, i.e. Python 3.3 or later.
+    '''
+
+    def __init__(self):
+        self.collections = [0] * 3
+        self.time = 0.0
+        self.installed = False
+        self._start = None
+
+    def install(self):
+        if self.installed or not hasattr(gc, 'callbacks'):
+            return
+
+        gc.callbacks.append(self._callback)
+        self.installed = True
+
+    def _callback(self, phase, info):
+        if phase == 'start':
+            self._start = time.time()
+        elif self._start is not None:
+            self.collections[info['generation']] += 1
+            self.time += time.time() - self._start
+            self._start = None
+
+
+gc_stats = GcStats()
+
+
+def _read_gc_totals():
+    '''
+    Returns the number of collections of each generation so far and of
+    objects they freed, or None before Python 3.4
+    '''
+
+    if not hasattr(gc, 'get_stats'):
+        return None
+
+    stats = gc.get_stats()
+    return (
+        [gen['collections'] for gen in stats],
+        [gen['collected'] for gen in stats]
+    )
+
+
+def _can_count_collections():
+    return hasattr(gc, 'get_stats') or gc_stats.installed
+
+
+def _subtract(begin, end):
+    return [after - before for before, after in zip(begin, end)]
+
+
+def _start_allocations():
+    global _tracemalloc_users
+
+    if tracemalloc is not None:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        _tracemalloc_users += 1
+        return tracemalloc.take_snapshot()
+
+    return Counter(type(obj).__name__ for obj in gc.get_objects())
+
+
+def _compare_allocations(start, top):
+    global _tracemalloc_users
+
+    if tracemalloc is not None:
+        end = tracemalloc.take_snapshot()
+        _tracemalloc_users -= 1
+        if _tracemalloc_users <= 0:
+            tracemalloc.stop()
+
+        return [str(stat) for stat in end.compare_to(start, 'lineno')[:top]]
+
+    end = Counter(type(obj).__name__ for obj in gc.get_objects())
+    return [
+        '{}: {:+d}'.format(name, count)
+        for name, count in (end - start).most_common(top)
+    ]
+
+
+class MemorySnapshot(object):
+    '''
+    The memory and gc state of the process at the start of a timepoint,
+    keeping the allocations too when top is set
+    '''
+
+    def __init__(self, top=0):
+        gc_stats.install()
+
+        self.top = top
+        if not _can_count_collections():
+            # only the garbage of the timepoint is collected at its end
+            gc.collect()
+        self.usage = read_memory_usage()
+        self.gc_totals = _read_gc_totals()
+        self.gc_collections = list(gc_stats.collections)
+        self.gc_time = gc_stats.time
+        self.allocations = _start_allocations() if top else None
+
+    def delta(self):
+        '''
+        Returns what changed since the snapshot, with the top allocation
+        sites, or types, which grew the most. Only call it once.
+        '''
+
+        usage = read_memory_usage()
+        delta = {
+            key: value - self.usage.get(key, 0)
+            for key, value in usage.iteritems()
+        }
+
+        # gc.get_count() isn't activity, only what the thresholds are
+        # compared to, and goes down on every collection
+        gc_totals = _read_gc_totals()
+        if gc_totals is not None:
+            delta['gc_collections'] = _subtract(self.gc_totals[0],
+                                                gc_totals[0])
+            delta['gc_collected'] = _subtract(self.gc_totals[1],
+                                              gc_totals[1])
+        elif gc_stats.installed:
+            delta['gc_collections'] = _subtract(self.gc_collections,
+                                                gc_stats.collections)
+
+        if gc_stats.installed:
+            delta['gc_time'] = gc_stats.time - self.gc_time
+
+        if not _can_count_collections():
+            start = time.time()
+            delta['gc_garbage'] = gc.collect()
+            delta['gc_collect_time'] = time.time() - start
+
+        if self.allocations is not None:
+            delta['top_allocations'] = _compare_allocations(
+                self.allocations, self.top
+            )
+            self.allocations = None
+
+        return delta
@@ -27,8 +27,10 @@ import shlex
 import json
 import re
 import shutil
-from kano.utils import run_cmd, get_user_unsudoed, run_bg, write_file_contents
+from kano.utils import run_argv, run_cmds, stream_cmd, get_user_unsudoed, \
+    run_bg, write_file_contents
 from kano.logging import logger
+from kano.profiling import timepoint
 
 from kano.paths import DNS_FILE, DNS_INTERFACES_FILE, DNS_INTERFACES_BACKUP_FILE,\
     SUPPLICANT_LOGFILE, SUPPLICANT_CONFIG, INTERNET_UP_FILE, KANO_CONNECT_PIDFILE
@@ -43,6 +45,10 @@ RC_INTERNAL_ERROR = 5
 
 SUPPLICANT_CMD = 'wpa_supplicant -D nl80211,wext -t -d -c{} -i{} -f {} -B'
 
+# Seconds to wait for wpa_cli to report the association, and for a scan
+ASSOCIATION_TIMEOUT = 60
+IWLIST_TIMEOUT = 30
+
 
 class IWList():
     def __init__(self, interface, iwlist=None):
@@ -57,6 +63,7 @@ class IWList():
         # Announce country to the driver so we can scan correct channels 13 and above
         get_wireless_country(enable_driver=True)
 
+    @timepoint('iwlist-refresh')
     def refresh(self, iwlist=None):
 
         def getRawData(interface, iwlist=None):
@@ -67,13 +74,13 @@ class IWList():
             '''
 
             # Make sure the wlan interface is up, otherwise the network scan will not proceed
-            run_cmd('ifconfig %s up' % interface)
+            run_argv(['ifconfig', interface, 'up'])
             if iwlist:
                 outdata = open(iwlist, 'r').read()
             else:
                 # Contemplate those seldom cases where the dongle driver returns an empty list
-                cstring = "iwlist " + interface + " scan"
-                outdata, _, _ = run_cmd(cstring)
+                outdata, _, _ = run_argv(['iwlist', interface, 'scan'],
+                                         timeout=IWLIST_TIMEOUT)
 
             return outdata
 
@@ -358,15 +365,14 @@ def is_connected(iface):
     essid = mode = ap = None
     linked = False
 
-    out, err, _ = run_cmd("iwgetid %s --raw" % iface)
-    essid = out.strip()
-
-    out, err, _ = run_cmd("iwgetid %s --raw --ap" % iface)
-    ap = out.strip()
+    results = run_cmds([
+        ['iwgetid', iface, '--raw'],
+        ['iwgetid', iface, '--raw', '--ap'],
+        ['iwgetid', iface, '--raw', '--mode']
+    ])
+    essid, ap, out = [out.strip() for out, dummy, dummy in results]
 
     # mode 2 = Managed
-    out, err, _ = run_cmd("iwgetid %s --raw --mode" % iface)
-    out = out.strip()
     if out == '2':
         mode = 'Managed'
     else:
@@ -383,7 +389,7 @@ def is_gateway(iface):
     '''
     Find the default route gateway, try to contact it. Return True if responding
     '''
-    out, _, _ = run_cmd("ip route show")
+    out, _, _ = run_argv(['ip', 'route', 'show'])
     guess_ip = re.match('^default via ([0-9\.]*) dev {}'.format(iface), out)  # noqa
     if guess_ip:
         return True
@@ -395,7 +401,7 @@ def is_internet():
     '''
     Returns True if Internet is available, False otherwise
     '''
-    _, _, rc = run_cmd('/usr/bin/is_internet')
+    _, _, rc = run_argv(['/usr/bin/is_internet'])
     return rc == 0
 
 
@@ -433,7 +439,7 @@ def get_wireless_country(enable_driver=False):
     # Tell the wireless driver to operate on this country
     # Allows to scan for more channels where available
     if country_code and enable_driver:
-        run_cmd('iw reg set %s' % country_code)
+        run_argv(['iw', 'reg', 'set', country_code])
 
     return country_code
 
@@ -526,20 +532,23 @@ def reload_kernel_module(device_vendor='148f', device_product='5370', module='rt
     reloaded = False
 
     # Terminate wpa_supplicant daemon
-    run_cmd('wpa_cli terminate')
+    run_argv(['wpa_cli', 'terminate'], worker=True)
     time.sleep(0.5)
     logger.info('wpa_cli has been terminated')
 
-    _, _, rc = run_cmd('lsusb -d %s:%s' % (device_vendor, device_product))
+    _, _, rc = run_argv(
+        ['lsusb', '-d', '{}:{}'.format(device_vendor, device_product)],
+        worker=True
+    )
     if rc == 0:
         # The device id is matched, reload the kernel driver
         rc_load = 0
 
-        _, _, rc = run_cmd('rmmod "{}"'.format(module))
+        _, _, rc = run_argv(['rmmod', module], worker=True)
         time.sleep(0.5)
         rc_load += rc
 
-        _, _, rc = run_cmd('modprobe "{}"'.format(module))
+        _, _, rc = run_argv(['modprobe', module], worker=True)
         time.sleep(5)
         rc_load += rc
 
@@ -593,57 +602,45 @@ def do_connect(iface, wpa_file, connection_timeout, debug=False):
         if debug:
             print '[[[ {} ]]]'.format(message)
 
-    def close_wpa_cli(proc):
-        '''
-        Sends a "quit" command to wpa_cli through the standard input pipe
-        '''
-        proc.stdin.write('quit\n')
-        proc.stdin.flush()
-
     # Start the WPA supplicant in the background
     supplicant_command = SUPPLICANT_CMD.format(
         wpa_file, iface, SUPPLICANT_LOGFILE
     )
     debug_msg('do_connect starts: {}'.format(supplicant_command))
-    run_cmd(supplicant_command)
+    run_argv(supplicant_command.split())
 
-    cli = subprocess.Popen(
-        ['wpa_cli'],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        stdin=subprocess.PIPE
-    )
-    time.sleep(1)
-    rc = cli.poll()
-    while rc is None:
-        output = cli.stdout.readline().replace('\n', '')
-        debug_msg(output)
-
-        if output.find('CTRL-EVENT-CONNECTED') != -1:
-            debug_msg('Event "Associated" detected')
-            close_wpa_cli(cli)
-            rc = RC_CONNECTED
-            break
-        elif output.find('reason=WRONG_KEY') != -1:
-            debug_msg('Event "wrong key" detected')
-            close_wpa_cli(cli)
-            rc = RC_BAD_PASSWORD
-            break
-        elif output.find('reason=CONN_FAILED') != -1:
-            debug_msg('Event "AP not in range" detected')
-            close_wpa_cli(cli)
-            rc = RC_AP_NOT_IN_RANGE
-            break
+    # Leaving the block closes the standard input of wpa_cli, so it quits
+    with stream_cmd(['wpa_cli'], timeout=ASSOCIATION_TIMEOUT) as cli:
+        for output in cli:
+            output = output.rstrip('\n')
+            debug_msg(output)
 
-        if output.find('WPS-AP-AVAILABLE') != -1:
-            scans += 1
-            if scans == max_scans:
-                debug_msg('Event "timeout due to too many scans" detected')
-                close_wpa_cli(cli)
+            if output.find('CTRL-EVENT-CONNECTED') != -1:
+                debug_msg('Event "Associated" detected')
+                rc = RC_CONNECTED
+                break
+            elif output.find('reason=WRONG_KEY') != -1:
+                debug_msg('Event "wrong key" detected')
+                rc = RC_BAD_PASSWORD
+                break
+            elif output.find('reason=CONN_FAILED') != -1:
+                debug_msg('Event "AP not in range" detected')
                 rc = RC_AP_NOT_IN_RANGE
                 break
 
-        rc = cli.poll()
+            if output.find('WPS-AP-AVAILABLE') != -1:
+                scans += 1
+                if scans == max_scans:
+                    debug_msg('Event "timeout due to too many scans" detected')
+                    rc = RC_AP_NOT_IN_RANGE
+                    break
+
+    if rc is None:
+        if cli.timed_out:
+            debug_msg('Event "timeout waiting for association" detected')
+            rc = RC_AP_NOT_IN_RANGE
+        else:
+            rc = cli.returncode
 
     # If we are associated, wait for DHCP lease to become available
     if rc == RC_CONNECTED:
@@ -654,6 +651,7 @@ def do_connect(iface, wpa_file, connection_timeout, debug=False):
     return rc
 
 
+@timepoint('connect')
 def connect(iface, essid, encrypt='off', seckey=None,
             wpa_custom_file=None, connect_timeout=60, debug=False):
     '''
@@ -686,24 +684,18 @@ def connect(iface, essid, encrypt='off', seckey=None,
                 'Cancelling kano-connect to give control to {}'
                 .format(sys.argv[0])
             )
-            run_cmd('pkill -f kano-connect')
+            run_argv(['pkill', '-f', 'kano-connect'])
             time.sleep(1)
 
     # terminate wpa supllicant daemon, politely through wpa_cli
-    run_cmd("wpa_cli terminate")
+    run_argv(['wpa_cli', 'terminate'], worker=True)
 
-    #
     # Set the ESSID of the wireless network to associate
-    # escaping single / double quotation marks
-    #
-    escaped_essid = essid.replace("'", "\'")
-    escaped_essid = escaped_essid.replace('"', '\"')
-
-    run_cmd("iwconfig %s power off" % iface)
-    run_cmd("ifconfig %s down" % iface)
-    run_cmd("iwconfig %s essid \"%s\"" % (iface, escaped_essid))
-    run_cmd("iwconfig %s mode managed" % iface)
-    run_cmd("ifconfig %s up" % iface)
+    run_argv(['iwconfig', iface, 'power', 'off'], worker=True)
+    run_argv(['ifconfig', iface, 'down'], worker=True)
+    run_argv(['iwconfig', iface, 'essid', essid], worker=True)
+    run_argv(['iwconfig', iface, 'mode', 'managed'], worker=True)
+    run_argv(['ifconfig', iface, 'up'], worker=True)
 
     if wpa_custom_file:
         # Start the supplicant daemon using a user-defined configuration file
@@ -780,14 +772,14 @@ def disconnect(iface, clear_cache=False):
         return
 
     # Stop the Kano reconnecting to the internet
-    run_cmd('wpa_cli terminate')
+    run_argv(['wpa_cli', 'terminate'])
 
     if clear_cache:
         k = KwifiCache()
         k.empty()
 
-    run_cmd('iwconfig "%s" essid off' % iface)
-    run_cmd('iwconfig "%s" mode managed' % iface)
+    run_argv(['iwconfig', iface, 'essid', 'off'])
+    run_argv(['iwconfig', iface, 'mode', 'managed'])
     time.sleep(3)
     return
 
@@ -893,7 +885,7 @@ def launch_midori(*args):
 
 
 def network_info():
-    out, _, _ = run_cmd('ip route show')
+    out, _, _ = run_argv(['ip', 'route', 'show'])
     network_dict = dict()
 
     for line in out.splitlines():
@@ -905,8 +897,7 @@ def network_info():
         data = dict()
 
         if interface.startswith('wlan'):
-            command_network = "/sbin/iwconfig wlan0"
-            out, _, _ = run_cmd(command_network)
+            out, _, _ = run_argv(['/sbin/iwconfig', 'wlan0'])
 
             essid_match = re.match(r'.*ESSID:"(.*)"\ .*', out, re.MULTILINE)
             essid = essid_match.groups()[0] \
@@ -16,6 +16,23 @@
  and at the end do
    declare_timepoint("transittion_name",False)
 
+ or wrap it in a with block or a decorated function
+   with timepoint("transition_name"):
+       ...
+
+   @timepoint("transition_name")
+   def transition():
+       ...
+
+ Transitions can be nested or overlap, each one is timed (wall and CPU time)
+ and the result logged at debug level when it ends.
+
+ Transitions are also recorded on a timeline shared by all processes, along
+ with any other events, see kano.tracer and kano-trace
+   trace_begin("dhcp", iface="wlan0")
+   trace_end("dhcp")
+   trace_instant("connected")
+
  The configuration file can enable profiling for each individual time point
  Example 1: Enable python profiling in the "load" timepoint of make-pong,
   saving the profile data to /tmp/make-pong/load.prof
@@ -25,7 +42,35 @@
         python:
             statfile: /tmp/make-pong-load.prof
 
- Example 2: Run a command at start and end of a timepoint (eg perf or bootchartd)
+ Example 2: Sample the stacks of the "main" timepoint of kano-updater 200
+  times per second of CPU time, for all its threads, and write them as folded
+  stacks for flamegraph.pl or speedscope. Unlike the python profiler this
+  doesn't slow the app down, the overhead is well under 5%
+  Points still running at exit, e.g. the main loop of a daemon, are written
+  out then.
+
+ /usr/bin/kano-updater:
+     main:
+        sampling:
+            statfile: /tmp/kano-updater-main.folded
+            rate: 200
+            threads: true
+
+ Example 3: Record how the memory use of the "load" timepoint of make-pong
+  changed: RSS, PSS and swap in kB, and the 10 allocation sites (or types of
+  objects on Python 2) which grew the most. On Python 2 a full gc collection
+  is run at both ends of the timepoint, the record has the number of objects
+  and the time of the last one, newer Pythons count the collections and
+  their time instead.
+  These go in the debug record logged at the end of the timepoint, the
+  memory use is also plotted on the timeline.
+
+ /usr/bin/make-pong:
+     load:
+        memory:
+            top: 10
+
+ Example 4: Run a command at start and end of a timepoint (eg perf or bootchartd)
  /usr/bin/make-pong:
     load:
         start_exec:
@@ -35,6 +80,8 @@
 '''
 
 import os
+import functools
+
 CONF_FILE = '/etc/kano-profiling.conf'
 
 isConf = os.path.exists(CONF_FILE)
@@ -54,3 +101,57 @@ def declare_timepoint(name, isStart):
         conf_loaded = True
 
     kano.profiling_late.declare_timepoint(name, isStart)
+
+
+class timepoint(object):
+    '''
+    Declares a transition around a with block or a function call, see
+    declare_timepoint(). Functions are left untouched when profiling isn't
+    configured.
+    '''
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        declare_timepoint(self.name, True)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        declare_timepoint(self.name, False)
+
+    def __call__(self, func):
+        if not isConf:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with self:
+                return func(*args, **kwargs)
+
+        return wrapper
+
+
+def trace_event(phase, name, **args):
+    '''
+    Records an event on the timeline, phase is one of the Chrome trace_event
+    phases in kano.tracer.PHASES
+    '''
+
+    if not isConf:
+        return
+
+    import kano.profiling_late
+    kano.profiling_late.trace_event(phase, name, args)
+
+
+def trace_begin(name, **args):
+    trace_event('B', name, **args)
+
+
+def trace_end(name, **args):
+    trace_event('E', name, **args)
+
+
+def trace_instant(name, **args):
+    trace_event('i', name, **args)
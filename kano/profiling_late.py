@@ -12,114 +12,407 @@ only if the configuration file exists, see profiling.py for more information
 
 import os
 import sys
-import yaml
+import time
+import atexit
+import marshal
+import threading
 import cProfile
+from collections import Counter
 from kano.logging import logger
+from kano.conf_cache import load_conf
 from kano.profiling import CONF_FILE
+from kano.tracer import TraceWriter, get_trace_dir, get_trace_path, \
+    get_tid, get_process_start_time, PHASE_BEGIN, PHASE_END, PHASE_INSTANT, PHASE_COUNTER
+from kano.sampler import sampler, write_folded
+from kano.meminfo import MemorySnapshot
+
+# Samples per second of CPU time in the sampling mode
+DEFAULT_SAMPLING_RATE = 100
 
 conf = None
-myProfile = cProfile.Profile()
 app_name = sys.argv[0]
-point_current = ""
+
+# Timepoints which have started but not ended, oldest first
+active_points = []
+points_lock = threading.Lock()
+
+# Timeline of this process, see kano.tracer
+tracer = None
+tracer_failed = False
+tracer_lock = threading.Lock()
+
+
+class Timepoint(object):
+    '''
+    A transition being measured: its wall and CPU time and, when enabled in
+    the configuration, a cProfile session or the stacks sampled during it,
+    and how the memory use changed.
+
+    A thread can only run one profiler at a time, so a profiled timepoint
+    starting inside another pauses the enclosing one, which resumes when
+    the inner one ends. The stats of the outer timepoint leave out what
+    happened in the inner one.
+    '''
+
+    def __init__(self, name, point_conf):
+        self.name = name
+        self.conf = point_conf
+        self.thread = threading.current_thread().ident
+        self.tid = get_tid()
+        self.profile = None
+        self.paused = False
+        self.samples = None
+        self.memory = None
+        self.memory_delta = None
+        self.start_time = time.time()
+        self.start_cpu = get_cpu_time()
+        self.wall_time = None
+        self.cpu_time = None
+
+    def stop(self):
+        self.wall_time = time.time() - self.start_time
+        self.cpu_time = get_cpu_time() - self.start_cpu
+
+
+def get_cpu_time():
+    times = os.times()
+    return times[0] + times[1]
+
+
+def get_tracer():
+    '''
+    Returns the TraceWriter of this process, or None if its file can't be
+    created
+    '''
+
+    global tracer, tracer_failed
+
+    pid = os.getpid()
+    if tracer is not None and tracer.pid == pid:
+        return tracer
+
+    with tracer_lock:
+        # after fork() the child gets a file of its own
+        if (tracer is None or tracer.pid != pid) and not tracer_failed:
+            trace_dir = get_trace_dir()
+            logger._init_app_name()
+            try:
+                if not os.path.isdir(trace_dir):
+                    os.makedirs(trace_dir)
+                tracer = TraceWriter(
+                    get_trace_path(trace_dir, logger._app_name, pid),
+                    logger._app_name
+                )
+
+                # the time to get here, e.g. importing modules, counts too
+                start_time = get_process_start_time()
+                if start_time is not None:
+                    tracer.event(
+                        PHASE_INSTANT, 'process start', timestamp=start_time
+                    )
+            except (IOError, OSError) as err:
+                tracer_failed = True
+                logger.error('Can\'t trace to {}: {}'.format(trace_dir, err))
+
+        return tracer
+
+
+def trace_event(phase, name, args=None, tid=None):
+    trace = get_tracer()
+    if trace is not None:
+        trace.event(phase, name, args, tid)
 
 
 def load_config():
     global conf
 
     # load the configuration file
-    with open(CONF_FILE, 'r') as inp_conf:
-        conf = yaml.load(inp_conf)
+    conf = load_conf(CONF_FILE)
 
 
 def has_key(d, k):
     return type(d) is dict and k in d
 
 
+def get_point_conf(name):
+    '''
+    Returns the configuration of the timepoint for this app, if any
+    '''
+
+    # Check if the app is contained in the profiling conf file
+    if not has_key(conf, app_name):
+        logger.info(
+            'Profiling conf file doesnt include app:{}'.format(app_name)
+        )
+        return None
+
+    # Check if the timepoint name is contained in the profiling conf file
+    if not has_key(conf[app_name], name):
+        logger.info(
+            'Profiling conf file doesnt include point:{} for app {}'
+            .format(name, app_name)
+        )
+        return None
+
+    return conf[app_name][name]
+
+
+def _get_profiled_point(thread):
+    for point in reversed(active_points):
+        if point.thread == thread and point.profile is not None:
+            return point
+
+    return None
+
+
+def start_timepoint(name, point_conf):
+    point = Timepoint(name, point_conf)
+
+    if has_key(point_conf, 'memory'):
+        memory_conf = point_conf['memory']
+        top = memory_conf.get('top', 0) if type(memory_conf) is dict else 0
+        point.memory = MemorySnapshot(top)
+
+    with points_lock:
+        if has_key(point_conf, 'python'):
+            outer = _get_profiled_point(point.thread)
+            if outer is not None and not outer.paused:
+                outer.profile.disable()
+                outer.paused = True
+
+            point.profile = cProfile.Profile()
+
+        if has_key(point_conf, 'sampling'):
+            start_sampling(point)
+
+        active_points.append(point)
+
+    if point.profile is not None:
+        point.profile.enable()
+
+    return point
+
+
+def end_timepoint(name):
+    '''
+    Ends the latest timepoint of that name, preferably one started by the
+    calling thread, and returns it. Returns None if there is none.
+    '''
+
+    thread = threading.current_thread().ident
+
+    with points_lock:
+        candidates = [p for p in active_points if p.name == name]
+        if not candidates:
+            return None
+
+        same_thread = [p for p in candidates if p.thread == thread]
+        point = (same_thread or candidates)[-1]
+        active_points.remove(point)
+
+        if point.profile is not None:
+            if point.thread != thread:
+                logger.error(
+                    'Can\'t stop profiling point "{}" from another thread'
+                    .format(name)
+                )
+                point.profile = None
+            elif not point.paused:
+                point.profile.disable()
+
+                outer = _get_profiled_point(thread)
+                if outer is not None and outer.paused:
+                    outer.paused = False
+                    outer.profile.enable()
+
+        if point.samples is not None:
+            sampler.remove_sink(point.samples)
+
+    point.stop()
+    if point.memory is not None:
+        point.memory_delta = point.memory.delta()
+
+    return point
+
+
+def start_sampling(point):
+    '''
+    Starts sampling the stacks of the process for the point. The sampling
+    conf can set the rate, in samples per second of CPU time, and whether
+    to sample all the threads rather than only the main one.
+    '''
+
+    sampling_conf = point.conf['sampling']
+    if type(sampling_conf) is not dict:
+        sampling_conf = {}
+
+    samples = Counter()
+    rate = sampling_conf.get('rate') or DEFAULT_SAMPLING_RATE
+    try:
+        sampler.add_sink(
+            samples, 1.0 / rate, bool(sampling_conf.get('threads'))
+        )
+    except ValueError:
+        logger.error(
+            'Can\'t start sampling point "{}" outside of the main thread'
+            .format(point.name)
+        )
+        return
+
+    point.samples = samples
+
+
+def get_statfile(point, key):
+    section = point.conf[key]
+    statfile = section.get('statfile') if type(section) is dict else None
+
+    # Check if the statfile location in specified
+    if not statfile:
+        logger.error(
+            'No statfile entry in profiling conf file "{}"'.format(CONF_FILE)
+        )
+
+    return statfile
+
+
+def log_statfile_error(statfile, err):
+    if err.errno == 2:
+        logger.error(
+            'Path to "{}" probably does not exist'.format(statfile)
+        )
+    else:
+        logger.error(
+            'dump_stats IOError: errno:{0}: {1} '
+            .format(err.errno, err.strerror)
+        )
+
+
+def dump_stats(point):
+    statfile = get_statfile(point, 'python')
+    if not statfile:
+        return
+
+    # Profile.dump_stats() would disable whichever profiler is running in
+    # this thread, which may be the one of another timepoint
+    point.profile.snapshot_stats()
+    try:
+        with open(statfile, 'wb') as f:
+            marshal.dump(point.profile.stats, f)
+    except IOError as err:
+        log_statfile_error(statfile, err)
+
+
+def dump_samples(point):
+    statfile = get_statfile(point, 'sampling')
+    if not statfile:
+        return
+
+    try:
+        write_folded(point.samples, statfile)
+    except IOError as err:
+        log_statfile_error(statfile, err)
+
+
+@atexit.register
+def dump_active_samples():
+    '''
+    Writes out the samples of the points which never ended, e.g. the main
+    loop of a daemon
+    '''
+
+    with points_lock:
+        points = [p for p in active_points if p.samples is not None]
+        for point in points:
+            sampler.remove_sink(point.samples)
+
+    for point in points:
+        dump_samples(point)
+
+
+def trace_memory(point):
+    delta = point.memory_delta
+    usage = {
+        key: point.memory.usage.get(key, 0) + delta.get(key, 0)
+        for key in point.memory.usage
+    }
+    trace_event(PHASE_COUNTER, 'memory', usage)
+
+    # records only hold a few values, the log has the rest
+    summary = {
+        key: delta[key] for key in ('rss_kb', 'pss_kb') if key in delta
+    }
+    if 'gc_time' in delta:
+        summary['gc_ms'] = round(delta['gc_time'] * 1000, 1)
+    trace_event(PHASE_INSTANT, point.name + ' memory', summary, point.tid)
+
+
 def declare_timepoint(name, isStart):
-    global myProfile
-    global point_current
     cmd = None
     pythonProfile = False
+    sampling = False
+    timings = {}
 
-    # Check if the app is contained in the profiling conf file
-    if has_key(conf, app_name):
-        # Check if the timepoint name is contained in the profiling conf file
-        if has_key(conf[app_name], name):
-            ct = conf[app_name][name]
+    ct = get_point_conf(name)
 
-            # Check if python profiler should be started for this timepoint
-            if has_key(ct, 'python'):
-                pythonProfile = True
-                if isStart:
-                    if point_current:
-                        logger.error(
-                            'Stop profiling for point "{0}" and do "{1}" '
-                            'instead'
-                            .format(point_current, name)
-                        )
-                        myProfile.disable()
-                        myProfile.clear()
-                    point_current = name
-                    myProfile.enable()
-                else:
-                    if point_current != name:
-                        logger.error(
-                            'Can\'t stop point "{0}" since a profiling '
-                            'session for "{1}" is being run'
-                            .format(name, point_current)
-                        )
-                    else:
-                        myProfile.disable()
-                        # Check if the statfile location in specified
-                        if ct['python']['statfile']:
-                            try:
-                                myProfile.dump_stats(ct['python']['statfile'])
-                            except IOError as err:
-                                if err.errno == 2:
-                                    logger.error(
-                                        'Path to "{}" probably does not exist'
-                                        .format(ct['python']['statfile'])
-                                    )
-                                else:
-                                    logger.error(
-                                        'dump_stats IOError: errno:{0}: {1} '
-                                        .format(err.errno, err.strerror)
-                                    )
-                        else:
-                            logger.error(
-                                'No statfile entry in profiling conf file "{}"'
-                                .format(CONF_FILE)
-                            )
-                        myProfile.clear()
-                        point_current = ""
-            else:
-                logger.info(
-                    'Profiling conf file doesnt enable the Python '
-                    'profiler for point {} at app {}'
-                    .format(name, app_name)
-                )
+    if isStart:
+        trace_event(PHASE_BEGIN, name)
+        point = start_timepoint(name, ct)
+        pythonProfile = point.profile is not None
+        sampling = point.samples is not None
 
-            # Check if we want to run some other command at this timepoint
-            if isStart and has_key(ct, 'start_exec'):
-                cmd = ct['start_exec']
-                os.system(cmd)
-            if not isStart and has_key(ct, 'end_exec'):
-                cmd = ct['end_exec']
-                os.system(cmd)
+        if point.memory is not None:
+            trace_event(PHASE_COUNTER, 'memory', point.memory.usage)
+    else:
+        point = end_timepoint(name)
+        if point is None:
+            logger.error(
+                'Can\'t stop point "{}" since it wasn\'t started'.format(name)
+            )
         else:
+            ct = point.conf
+            timings = {
+                'wall_time': point.wall_time,
+                'cpu_time': point.cpu_time
+            }
+            trace_event(PHASE_END, name, {
+                key: round(value, 6) for key, value in timings.iteritems()
+            }, point.tid)
+
+            if point.profile is not None:
+                pythonProfile = True
+                dump_stats(point)
+
+            if point.samples is not None:
+                sampling = True
+                dump_samples(point)
+
+            if point.memory_delta is not None:
+                timings['memory'] = point.memory_delta
+                trace_memory(point)
+
+    if ct is not None:
+        if not has_key(ct, 'python') and not has_key(ct, 'sampling'):
             logger.info(
-                'Profiling conf file doesnt include point:{} for app {}'
+                'Profiling conf file doesnt enable the Python '
+                'profiler for point {} at app {}'
                 .format(name, app_name)
             )
-    else:
-        logger.info(
-            'Profiling conf file doesnt include app:{}'.format(app_name)
-        )
+
+        # Check if we want to run some other command at this timepoint
+        if isStart and has_key(ct, 'start_exec'):
+            cmd = ct['start_exec']
+            os.system(cmd)
+        if not isStart and has_key(ct, 'end_exec'):
+            cmd = ct['end_exec']
+            os.system(cmd)
 
     logger.debug(
         'timepoint ' + name,
         transition=name,
         isStart=isStart,
         cmd=cmd,
-        pythonProfile=pythonProfile
+        pythonProfile=pythonProfile,
+        sampling=sampling,
+        depth=len(active_points),
+        **timings
     )
@@ -0,0 +1,149 @@
+# sampler.py
+#
+# Copyright (C) 2019 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Statistical profiler for the "sampling" mode of kano.profiling
+#
+# Rather than tracing every call like cProfile, which makes code 2-3 times
+# slower, the Python stack is looked at every interval seconds of CPU time
+# used by the process (ITIMER_PROF), from a SIGPROF handler. The samples are
+# written in the folded stack format of flamegraph.pl and speedscope, one
+# "outer;inner;innermost count" line per stack.
+
+
+import sys
+import signal
+import threading
+
+DEFAULT_INTERVAL = 0.01
+MAX_DEPTH = 128
+
+# Labels of the code objects already seen, so a sample is mostly lookups
+_labels = {}
+
+
+def fold_stack(frame, prefix=None):
+    '''
+    Returns the stack ending at frame as a folded stack line, outermost
+    call first
+    '''
+
+    names = []
+    while frame is not None and len(names) < MAX_DEPTH:
+        code = frame.f_code
+        label = _labels.get(code)
+        if label is None:
+            label = _labels[code] = '{} ({}:{})'.format(
+                code.co_name, code.co_filename, code.co_firstlineno
+            )
+
+        names.append(label)
+        frame = frame.f_back
+
+    if prefix:
+        names.append(prefix)
+
+    names.reverse()
+    return ';'.join(names)
+
+
+class Sampler(object):
+    '''
+    Counts the stacks of the process into the Counters added as sinks, while
+    there are any. The handler only runs in the main thread, so the sampler
+    has to be started from it. The interval is the one of the first sink.
+    '''
+
+    def __init__(self):
+        self.interval = None
+        # replaced rather than changed, the handler can interrupt anything
+        self._sinks = ()
+        self._installed = False
+        self._previous = None
+
+    def add_sink(self, samples, interval=DEFAULT_INTERVAL, threads=False):
+        '''
+        Starts counting stacks into samples, those of every thread if
+        threads is set, otherwise only the main thread's. Raises ValueError
+        when the sampler isn't running and this isn't the main thread.
+        '''
+
+        if not self._sinks:
+            self._start(interval)
+
+        self._sinks += ((samples, threads),)
+
+    def remove_sink(self, samples):
+        self._sinks = tuple(
+            sink for sink in self._sinks if sink[0] is not samples
+        )
+
+        if not self._sinks:
+            self._stop()
+
+    def _start(self, interval):
+        if not self._installed:
+            self._previous = signal.signal(signal.SIGPROF, self._sample)
+            self._installed = True
+
+        # don't make system calls fail with EINTR
+        signal.siginterrupt(signal.SIGPROF, False)
+        signal.setitimer(signal.ITIMER_PROF, interval, interval)
+        self.interval = interval
+
+    def _stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        self.interval = None
+
+        # the default action for SIGPROF is to terminate
+        previous = self._previous
+        if previous in (None, signal.SIG_DFL):
+            previous = signal.SIG_IGN
+
+        try:
+            signal.signal(signal.SIGPROF, previous)
+            self._installed = False
+        except ValueError:
+            # not the main thread, the handler stays but does nothing
+            pass
+
+    def _sample(self, signum, frame):
+        main_stack = None
+        thread_stacks = None
+
+        for samples, threads in self._sinks:
+            if threads:
+                if thread_stacks is None:
+                    thread_stacks = self._get_thread_stacks(frame)
+                for stack in thread_stacks:
+                    samples[stack] += 1
+            else:
+                if main_stack is None:
+                    main_stack = fold_stack(frame)
+                samples[main_stack] += 1
+
+    def _get_thread_stacks(self, frame):
+        main_ident = threading.current_thread().ident
+        stacks = []
+
+        for ident, thread_frame in sys._current_frames().iteritems():
+            thread = threading._active.get(ident)
+            name = thread.name if thread is not None else str(ident)
+
+            # the handler's own frame for the main thread
+            if ident == main_ident:
+                thread_frame = frame
+
+            stacks.append(fold_stack(thread_frame, name))
+
+        return stacks
+
+
+sampler = Sampler()
+
+
+def write_folded(samples, path):
+    with open(path, 'w') as f:
+        for stack, count in sorted(samples.iteritems()):
+            f.write('{} {}\n'.format(stack, count))
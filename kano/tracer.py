@@ -0,0 +1,309 @@
+# tracer.py
+#
+# Copyright (C) 2019 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Timeline of begin/end events across processes, see bin/kano-trace
+#
+# While profiling is enabled each process records its events in its own file
+# in the trace dir next to the logs. Python and C tools write fixed size
+# records to a memory mapped ring, so an event costs a struct.pack() and the
+# file never grows. Bash scripts can't do that without forking, they append
+# a line per event instead, see logging.sh.
+#
+# The files are merged into the Chrome trace_event JSON format, to be loaded
+# in chrome://tracing or Perfetto.
+
+
+import os
+import re
+import json
+import mmap
+import time
+import struct
+import threading
+
+import kano.logging as logging
+
+TRACE_DIR = 'trace'
+TRACE_SUFFIX = '.ktrace'
+TRACE_FILE_RE = re.compile(r'^(?P<app>.+)-(?P<pid>\d+)\.ktrace$')
+
+MAGIC = 'KTRC'
+VERSION = 1
+
+# Also in kano_c_logging.c, keep them in sync
+# magic, version, record size, capacity, pid, records written, app name
+HEADER = struct.Struct('<4sHHIIQ40s')
+# time, tid, phase, name, args as JSON
+RECORD = struct.Struct('<dIc3x48s64s')
+COUNT_OFFSET = 16
+
+# 1MiB per process
+TRACE_CAPACITY = 8192
+
+PHASE_BEGIN = 'B'
+PHASE_END = 'E'
+PHASE_INSTANT = 'i'
+PHASE_COUNTER = 'C'
+PHASES = (PHASE_BEGIN, PHASE_END, PHASE_INSTANT, PHASE_COUNTER)
+
+
+def get_trace_dir(logs_dir=None):
+    return os.path.join(logs_dir or logging.get_logs_dir(), TRACE_DIR)
+
+
+def get_trace_path(trace_dir, app_name, pid):
+    return os.path.join(
+        trace_dir, '{}-{}{}'.format(app_name, pid, TRACE_SUFFIX)
+    )
+
+
+def _encode(value, size):
+    if isinstance(value, unicode):
+        value = value.encode('utf8')
+
+    return value[:size]
+
+
+def _decode(value):
+    return value.rstrip('\0').decode('utf8', 'ignore')
+
+
+class TraceWriter(object):
+    '''
+    Records the events of this process in a ring of capacity records,
+    overwriting the oldest ones once it is full
+    '''
+
+    def __init__(self, path, app_name, capacity=TRACE_CAPACITY):
+        self.path = path
+        self.pid = os.getpid()
+        self.capacity = capacity
+        self.count = 0
+        self._lock = threading.Lock()
+
+        size = HEADER.size + capacity * RECORD.size
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0644)
+        try:
+            os.ftruncate(fd, size)
+            self._map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+        HEADER.pack_into(
+            self._map, 0, MAGIC, VERSION, RECORD.size, capacity, self.pid,
+            0, _encode(app_name, 40)
+        )
+
+    def event(self, phase, name, args=None, tid=None, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+        if tid is None:
+            tid = get_tid()
+
+        args_json = ''
+        if args:
+            args_json = json.dumps(args, separators=(',', ':'), default=repr)
+            if len(args_json) > 64:
+                args_json = '{"truncated":true}'
+
+        with self._lock:
+            if self._map is None:
+                return
+
+            offset = HEADER.size + (self.count % self.capacity) * RECORD.size
+            RECORD.pack_into(
+                self._map, offset, timestamp, tid & 0xffffffff, phase,
+                _encode(name, 48), args_json
+            )
+            self.count += 1
+            struct.pack_into('<Q', self._map, COUNT_OFFSET, self.count)
+
+    def close(self):
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+
+
+def get_tid():
+    '''
+    Returns an id for the calling thread, the pid for the main thread as
+    the kernel would
+    '''
+
+    thread = threading.current_thread()
+    if isinstance(thread, threading._MainThread):
+        return os.getpid()
+
+    return thread.ident
+
+
+def get_process_start_time():
+    '''
+    Returns when this process started, to within a clock tick, or None if
+    /proc can't tell
+    '''
+
+    try:
+        with open('/proc/self/stat') as f:
+            # the fields after the command name, which may contain spaces
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+
+        start_ticks = int(fields[19])
+    except (IOError, ValueError, IndexError):
+        return None
+
+    return time.time() - uptime + \
+        float(start_ticks) / os.sysconf('SC_CLK_TCK')
+
+
+def _read_binary_trace(data, path):
+    magic, version, record_size, capacity, pid, count, app_name = \
+        HEADER.unpack_from(data, 0)
+    if version != VERSION or record_size != RECORD.size:
+        raise ValueError('Unsupported trace file {}'.format(path))
+
+    app_name = _decode(app_name)
+    if count > capacity:
+        slots = range(count % capacity, capacity) + range(count % capacity)
+    else:
+        slots = range(count)
+
+    events = []
+    for slot in slots:
+        offset = HEADER.size + slot * RECORD.size
+        if offset + RECORD.size > len(data):
+            break
+
+        timestamp, tid, phase, name, args = RECORD.unpack_from(data, offset)
+        if phase not in PHASES:
+            # being written while the file is read
+            continue
+
+        try:
+            args = json.loads(args.rstrip('\0') or '{}')
+        except ValueError:
+            args = {}
+
+        events.append({
+            'time': timestamp,
+            'pid': pid,
+            'tid': tid,
+            'phase': phase,
+            'name': _decode(name),
+            'args': args
+        })
+
+    return app_name, pid, events
+
+
+def _read_text_trace(data, path):
+    # written by logging.sh: time, pid, phase and name, separated by tabs.
+    # Subshells show up as threads of the script.
+    match = TRACE_FILE_RE.match(os.path.basename(path))
+    app_name = match.group('app') if match else os.path.basename(path)
+    pid = int(match.group('pid')) if match else 0
+
+    events = []
+    for line in data.splitlines():
+        fields = line.split('\t', 3)
+        if len(fields) != 4 or fields[2] not in PHASES:
+            continue
+
+        try:
+            timestamp = float(fields[0])
+            event_pid = int(fields[1])
+        except ValueError:
+            continue
+
+        events.append({
+            'time': timestamp,
+            'pid': pid or event_pid,
+            'tid': event_pid,
+            'phase': fields[2],
+            'name': fields[3].decode('utf8', 'ignore'),
+            'args': {}
+        })
+
+    return app_name, pid, events
+
+
+def read_trace_file(path):
+    '''
+    Returns the app name, pid and events, oldest first, of a trace file
+    '''
+
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    if data.startswith(MAGIC):
+        return _read_binary_trace(data, path)
+
+    return _read_text_trace(data, path)
+
+
+def list_trace_files(trace_dirs):
+    paths = []
+    for trace_dir in trace_dirs:
+        if not os.path.isdir(trace_dir):
+            continue
+
+        paths += sorted(
+            os.path.join(trace_dir, name) for name in os.listdir(trace_dir)
+            if name.endswith(TRACE_SUFFIX)
+        )
+
+    return paths
+
+
+def to_chrome_trace(paths):
+    '''
+    Merges the trace files into a Chrome trace_event JSON object
+    '''
+
+    trace_events = []
+    names = {}
+
+    for path in paths:
+        try:
+            app_name, pid, events = read_trace_file(path)
+        except (IOError, ValueError, struct.error):
+            continue
+
+        for event in events:
+            names.setdefault(event['pid'], app_name)
+
+            trace_event = {
+                'name': event['name'],
+                'cat': app_name,
+                'ph': event['phase'],
+                'ts': int(round(event['time'] * 1000000)),
+                'pid': event['pid'],
+                'tid': event['tid'],
+                'args': event['args']
+            }
+            if event['phase'] == PHASE_INSTANT:
+                trace_event['s'] = 't'
+
+            trace_events.append(trace_event)
+
+    trace_events.sort(key=lambda event: event['ts'])
+
+    metadata = [
+        {
+            'name': 'process_name',
+            'ph': 'M',
+            'pid': event_pid,
+            'args': {'name': event_app}
+        }
+        for event_pid, event_app in sorted(names.iteritems())
+    ]
+
+    return {
+        'traceEvents': metadata + trace_events,
+        'displayTimeUnit': 'ms'
+    }
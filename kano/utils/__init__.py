@@ -52,6 +52,11 @@ def ku_processes(name):
     return getattr(kano.utils.processes, name)
 
 
+def ku_probe_cache(name):
+    import kano.utils.probe_cache
+    return getattr(kano.utils.probe_cache, name)
+
+
 def ku_shell(name):
     import kano.utils.shell
     return getattr(kano.utils.shell, name)
@@ -125,7 +130,15 @@ functable = {
     'get_program_name': ku_processes,
     'pkill': ku_processes,
 
+    'cached_probe': ku_probe_cache,
+    'invalidate_probes': ku_probe_cache,
+
     'run_cmd': ku_shell,
+    'run_argv': ku_shell,
+    'run_cmds': ku_shell,
+    'iter_cmds': ku_shell,
+    'stream_cmd': ku_shell,
+    'shell_worker': ku_shell,
     'run_cmd_log': ku_shell,
     'run_bg': ku_shell,
     'run_term_on_error': ku_shell,
@@ -7,8 +7,13 @@
 
 
 import os
+import re
 
-from kano.utils.shell import run_cmd, run_bg, run_cmd_log
+from kano.utils.shell import run_argv, run_bg, run_cmd_log
+from kano.utils.probe_cache import cached_probe
+
+# Seconds for which the volume read from amixer is used, unless set before
+VOLUME_TTL = 5
 
 
 def play_sound(audio_file, background=False, delay=0):
@@ -84,13 +89,16 @@ def percent_to_millibel(percent, raspberry_mod=False):
     return int(millibel)
 
 
+@cached_probe(VOLUME_TTL)
 def get_volume():
     from kano.logging import logger
 
     percent = 100
 
-    cmd = "amixer | head -n 6 | grep -Po '(\d{1,3})(?=%)'"  # noqa
-    output, _, _ = run_cmd(cmd)
+    # the percentages in the first 6 lines, one per line
+    output, _, _ = run_argv(['amixer'])
+    head = '\n'.join(output.splitlines()[:6])
+    output = '\n'.join(re.findall(r'(\d{1,3})(?=%)', head))
 
     try:
         percent = int(output.strip())
@@ -103,5 +111,5 @@ def get_volume():
 
 
 def set_volume(percent):
-    cmd = 'amixer set Master {}%'.format(percent)
-    run_cmd(cmd)
+    run_argv(['amixer', 'set', 'Master', '{}%'.format(percent)])
+    get_volume.invalidate()
@@ -6,7 +6,7 @@
 # Utilities relating to disk manangement
 
 
-from kano.utils.shell import run_cmd
+from kano.utils.shell import run_argv
 
 
 def get_free_space(path="/"):
@@ -20,7 +20,7 @@ def get_free_space(path="/"):
         :rtype: int
     """
 
-    out, dummy_err, dummy_rv = run_cmd("df {}".format(path))
+    out, dummy_err, dummy_rv = run_argv(['df', path])
 
     dummy_device, dummy_size, dummy_used, free, dummy_percent, dummy_mp = \
         out.split('\n')[1].split()
@@ -32,8 +32,9 @@ def get_partition_info():
     device = '/dev/mmcblk0'
 
     try:
-        cmd = 'lsblk -n -b {} -o SIZE'.format(device)
-        stdout, dummy_stderr, returncode = run_cmd(cmd)
+        stdout, dummy_stderr, returncode = run_argv(
+            ['lsblk', '-n', '-b', device, '-o', 'SIZE']
+        )
 
         if returncode != 0:
             from kano.logging import logger
@@ -9,7 +9,8 @@
 import traceback
 
 from kano.logging import logger
-from kano.utils.shell import run_cmd
+from kano.utils.shell import run_argv
+from kano.utils.probe_cache import cached_probe
 from kano.utils.file_operations import read_file_contents_as_lines
 
 
@@ -46,6 +47,16 @@ RPI_3_CPU_PROFILE = 'rpi_3'
 
 CPUINFO_FILE = '/proc/cpuinfo'
 
+# Seconds after which a hung tvservice is killed
+TVSERVICE_TIMEOUT = 5
+
+# Seconds for which the results of the probes are used. Nothing tells the
+# cache when a monitor is plugged in, so is_monitor() only reuses a result
+# for the apps starting together.
+KEYBOARD_PROBE_TTL = 10
+MONITOR_PROBE_TTL = 3
+MAC_ADDRESS_TTL = 3600
+
 
 '''
 Lookup table with keys as given by get_rpi_model() containing:
@@ -149,9 +160,10 @@ def get_board_property(board_key, prop):
     return board_prop
 
 
+@cached_probe(KEYBOARD_PROBE_TTL)
 def detect_kano_keyboard_type():
     # Get information of all devices
-    stdout, dummy_stderr, dummy_ret = run_cmd('lsusb')
+    stdout, dummy_stderr, dummy_ret = run_argv(['lsusb'])
 
     keyboard_ids = {
         'en': [
@@ -347,8 +359,11 @@ def get_board_revision(use_cached=True):
     return ''
 
 
+@cached_probe(MONITOR_PROBE_TTL)
 def is_monitor():
-    status_str, _, _ = run_cmd('/usr/bin/tvservice -s')
+    status_str, _, _ = run_argv(
+        ['/usr/bin/tvservice', '-s'], timeout=TVSERVICE_TIMEOUT
+    )
     return 'RGB full' in status_str
 
 
@@ -366,9 +381,10 @@ def get_cpu_id():
             return parts[1].upper()
 
 
+@cached_probe(MAC_ADDRESS_TTL)
 def get_mac_address():
-    cmd = '/sbin/ifconfig -a eth0 | grep HWaddr'
-    o, _, _ = run_cmd(cmd)
+    out, _, _ = run_argv(['/sbin/ifconfig', '-a', 'eth0'])
+    o = ''.join(line for line in out.splitlines(True) if 'HWaddr' in line)
     if len(o.split('HWaddr')) != 2:
         return
     mac_addr = o.split('HWaddr')[1].strip()
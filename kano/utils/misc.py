@@ -9,6 +9,12 @@
 import datetime
 
 from kano.utils.shell import run_cmd
+from kano.utils.probe_cache import cached_probe
+
+# Seconds for which the result of is_installed() is used. Nothing tells the
+# cache when a package is installed, so it is only long enough to serve the
+# apps starting together.
+IS_INSTALLED_TTL = 5
 
 
 def get_date_now():
@@ -29,6 +35,7 @@ def uniqify_list(seq):
     return [x for x in seq if x not in seen and not seen.add(x)]
 
 
+@cached_probe(IS_INSTALLED_TTL)
 def is_installed(program):
     '''
     Returns True if "program" is recognized as an executable command in PATH
@@ -0,0 +1,224 @@
+# probe_cache.py
+#
+# Copyright (C) 2019 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Caching of the results of system probes, e.g. lsusb or tvservice, which
+# every Kano app runs at startup and which give the same answer for a while
+#
+# Results are kept in a small JSON file shared by all the processes of the
+# user, in /run/user/<uid> (/run for root) or /tmp when that isn't there, so
+# one app's probes serve the next ones too. The file is only read again once
+# it changed. Each probe has its own time to live, and can be invalidated
+# when it is known to have changed, e.g. the volume once it is set.
+
+
+import os
+import json
+import time
+import tempfile
+from functools import wraps
+
+CACHE_FILE = 'kano-probe-cache.json'
+
+# The entries of the cache file, key: (time stored, ttl, value), as last
+# read or written by this process, and the path and stat of the file then
+_entries = {}
+_file_state = None
+
+
+def get_cache_path(uid=None):
+    if uid is None:
+        uid = os.getuid()
+
+    run_dir = '/run' if uid == 0 else '/run/user/{}'.format(uid)
+    if os.access(run_dir, os.W_OK):
+        return os.path.join(run_dir, CACHE_FILE)
+
+    return os.path.join(
+        tempfile.gettempdir(), '{}-{}'.format(uid, CACHE_FILE)
+    )
+
+
+def _to_str(value):
+    # json gives unicode, the probes return str
+    if isinstance(value, unicode):
+        try:
+            return value.encode('ascii')
+        except UnicodeError:
+            return value
+    if isinstance(value, list):
+        return [_to_str(item) for item in value]
+    if isinstance(value, dict):
+        return {_to_str(k): _to_str(v) for k, v in value.iteritems()}
+
+    return value
+
+
+def _is_fresh(entry, now):
+    stored, ttl, dummy_value = entry
+    # the clock is set late during boot, so it can go back too
+    return 0 <= now - stored < ttl
+
+
+def _read_file(path):
+    try:
+        with open(path) as f:
+            # in /tmp, someone else could have made it
+            if os.fstat(f.fileno()).st_uid != os.getuid():
+                return {}
+            entries = json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+    if not isinstance(entries, dict):
+        return {}
+
+    return {
+        _to_str(key): tuple(_to_str(entry))
+        for key, entry in entries.iteritems()
+        if isinstance(entry, list) and len(entry) == 3
+    }
+
+
+def _write_file(path, entries):
+    '''
+    Replaces the file at once, so it is never seen half written. When two
+    processes write at the same time one of them wins, it is only a cache.
+    '''
+
+    try:
+        fd, tmp_path = tempfile.mkstemp(
+            prefix='.{}.'.format(os.path.basename(path)),
+            dir=os.path.dirname(path)
+        )
+    except (IOError, OSError):
+        return
+
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(entries, f)
+        os.rename(tmp_path, path)
+    except (IOError, OSError, TypeError, ValueError):
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+
+def _get_file_state(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return path, None
+
+    return path, (st.st_ino, st.st_mtime, st.st_size)
+
+
+def _load():
+    '''
+    Returns the entries, only reading the file again once another process
+    changed it
+    '''
+
+    global _entries, _file_state
+
+    path = get_cache_path()
+    state = _get_file_state(path)
+    if state != _file_state:
+        _entries = _read_file(path)
+        _file_state = state
+
+    return _entries
+
+
+def _update(change):
+    global _file_state
+
+    entries = _load()
+    change(entries)
+
+    now = time.time()
+    for key in [key for key, entry in entries.iteritems()
+                if not _is_fresh(entry, now)]:
+        del entries[key]
+
+    path = get_cache_path()
+    _write_file(path, entries)
+    # what is in memory is what was written, if it could be
+    _file_state = _get_file_state(path)
+
+
+def get_cached(key):
+    '''
+    Returns (True, value) when there is a fresh result for key, otherwise
+    (False, None)
+    '''
+
+    entry = _load().get(key)
+    if entry is None or not _is_fresh(entry, time.time()):
+        return False, None
+
+    return True, entry[2]
+
+
+def set_cached(key, value, ttl):
+    def store(entries):
+        entries[key] = (time.time(), ttl, value)
+
+    _update(store)
+
+
+def invalidate_probes(name=None):
+    '''
+    Forgets the results of the probe called name, with any arguments, in
+    every process, or of all the probes when no name is given
+    '''
+
+    def remove(entries):
+        for key in entries.keys():
+            if name is None or key == name or key.startswith(name + ' '):
+                del entries[key]
+
+    _update(remove)
+
+
+def cached_probe(ttl, name=None):
+    '''
+    Generates a decorator caching what the function returns for ttl
+    seconds, shared with the other processes of the user. The arguments,
+    if any, are part of the key so they must be strings or numbers, and so
+    must be the results.
+
+    NB: must be called when used as decorator, i.e.
+        @cached_probe(30)
+        def is_monitor():
+            pass
+
+    @params  ttl    Seconds for which a result is used
+    @params  name   Name of the probe, defaults to the function's
+
+    The decorated function has an invalidate() method to forget its
+    results. Until then, or until ttl runs out, every process of the user
+    gets the same answer even if what was probed changed, e.g. a package
+    was installed or a monitor plugged in, so keep ttl short for those.
+    '''
+
+    def cached_probe_decorator(func):
+        probe_name = name or '{}.{}'.format(func.__module__, func.__name__)
+
+        @wraps(func)
+        def probe(*args):
+            key = ' '.join([probe_name] + [str(arg) for arg in args])
+
+            found, value = get_cached(key)
+            if not found:
+                value = func(*args)
+                set_cached(key, value, ttl)
+
+            return value
+
+        probe.invalidate = lambda: invalidate_probes(probe_name)
+        return probe
+
+    return cached_probe_decorator
@@ -10,12 +10,13 @@ import os
 import sys
 import signal
 
-from kano.utils.shell import run_cmd
+from kano.utils.shell import run_argv
 
 
 def kill_child_processes(parent_pid):
-    cmd = "ps -o pid --ppid {} --noheaders".format(parent_pid)
-    o, _, _ = run_cmd(cmd)
+    o, _, _ = run_argv(
+        ['ps', '-o', 'pid', '--ppid', str(parent_pid), '--noheaders']
+    )
     processes = [int(p) for p in o.splitlines()]
     for process in processes:
         os.kill(process, signal.SIGTERM)
@@ -29,11 +30,11 @@ def is_running(program):
     "wpa_supplicant -c/etc/connect.conf"
     '''
     # Search using a regex, to exclude itself (pgrep) from the list
-    cmd = "pgrep -fc '[{}]{}'".format(program[0], program[1:])
+    pattern = '[{}]{}'.format(program[0], program[1:])
     running = 0
     try:
-        result = os.popen(cmd)
-        running = int(result.read().strip())
+        result, _, _ = run_argv(['pgrep', '-fc', pattern])
+        running = int(result.strip())
     except Exception:
         pass
 
@@ -48,9 +49,9 @@ def pkill(clues):
     if type(clues) == str:
         clues = [clues]
 
-    psx, _, _ = run_cmd("ps x")
+    psx, _, _ = run_argv(['ps', 'x'])
     for line in psx.split("\n"):
         for clue in clues:
             if clue in line:
                 pid = line.split()[0]
-                run_cmd("kill {}".format(pid))
+                run_argv(['kill', pid])
@@ -7,9 +7,39 @@
 
 
 import os
+import re
 import sys
+import time
+import errno
+import pipes
+import select
 import signal
+import binascii
+import threading
 import subprocess
+from Queue import Queue, Empty
+
+try:
+    # restores the signals in C between fork() and exec(), rather than with
+    # a preexec_fn running Python code in the child, which isn't safe with
+    # other threads running and is slower. The package depends on it, the
+    # fallback is only for running from a checkout.
+    import subprocess32
+except ImportError:
+    subprocess32 = None
+
+# Commands run at once by run_cmds() unless told otherwise
+DEFAULT_MAX_WORKERS = 4
+
+# Longest line given at once by a CommandStream
+MAX_LINE_LENGTH = 64 * 1024
+
+# Seconds between checks that the ShellWorker is still alive while waiting
+WORKER_POLL_INTERVAL = 0.5
+
+# os.environ with LC_ALL set to "C", and the os.environ it was made from
+_c_env = None
+_c_env_source = None
 
 
 def restore_signals():
@@ -19,27 +49,587 @@ def restore_signals():
             signal.signal(getattr(signal, sig), signal.SIG_DFL)
 
 
-def run_cmd(cmd, localised=False, unsudo=False):
+def get_c_env():
+    '''
+    Returns the environment with LC_ALL set to "C", only copied again once
+    os.environ changed. Don't change it.
+    '''
+
+    global _c_env, _c_env_source
+
+    if _c_env is None or os.environ != _c_env_source:
+        _c_env_source = dict(os.environ)
+        _c_env = dict(_c_env_source, LC_ALL='C')
+
+    return _c_env
+
+
+def _restore_signals_new_session():
+    restore_signals()
+    os.setsid()
+
+
+def _popen_restored(argv, new_session=False, **kwargs):
+    '''
+    Starts argv with the signals restored, and in a session and process
+    group of its own if new_session is set so they can all be killed
+    '''
+
+    if subprocess32 is not None:
+        return subprocess32.Popen(argv, restore_signals=True,
+                                  start_new_session=new_session, **kwargs)
+
+    preexec_fn = _restore_signals_new_session if new_session \
+        else restore_signals
+    return subprocess.Popen(argv, preexec_fn=preexec_fn, **kwargs)
+
+
+def _exec_error(program, err):
+    rc = 127 if err.errno == errno.ENOENT else 126
+    return '', '{}: {}\n'.format(program, err.strerror), rc
+
+
+def _kill_group(process, sig=signal.SIGKILL):
+    '''
+    Signals the process group of a process started with new_session, unless
+    it has been waited for already
+    '''
+
+    if process.returncode is None:
+        try:
+            os.killpg(process.pid, sig)
+        except OSError:
+            pass
+
+
+class _Deadline(object):
+    '''
+    Kills the process group of the process once timeout seconds have passed,
+    unless cancelled before
+    '''
+
+    def __init__(self, process, timeout):
+        self.expired = False
+        self._process = process
+        self._timer = threading.Timer(timeout, self._expire)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _expire(self):
+        self.expired = True
+        _kill_group(self._process)
+
+    def cancel(self):
+        self._timer.cancel()
+
+
+def _communicate(process, timeout):
+    deadline = _Deadline(process, timeout) if timeout is not None else None
+
+    try:
+        stdout, stderr = process.communicate()
+    finally:
+        if deadline:
+            deadline.cancel()
+
+    return stdout, stderr, process.returncode
+
+
+def run_argv(argv, localised=False, unsudo=False, timeout=None,
+             worker=False):
+    '''
+    Executes the program and arguments in the argv list without a shell,
+    returning stdout, stderr, return code as run_cmd() does.
+    Nothing needs quoting and no /bin/sh is started, so prefer it to
+    run_cmd() unless the command uses pipes, redirections or globs.
+    A missing program gives return code 127, as from the shell.
+    The timeout and worker work as for run_cmd().
+    '''
+
+    env = None if localised else get_c_env()
+
+    if unsudo and \
+            'SUDO_USER' in os.environ and \
+            os.environ['SUDO_USER'] != 'root':
+        argv = ['sudo', '-u', os.environ['SUDO_USER']] + list(argv)
+
+    if worker and not localised:
+        return shell_worker.run(
+            ' '.join(pipes.quote(arg) for arg in argv), timeout
+        )
+
+    try:
+        process = _popen_restored(argv, new_session=timeout is not None,
+                                  env=env,
+                                  stdout=subprocess.PIPE,
+                                  stderr=subprocess.PIPE)
+    except OSError as err:
+        return _exec_error(argv[0], err)
+
+    return _communicate(process, timeout)
+
+
+def run_cmd(cmd, localised=False, unsudo=False, timeout=None, worker=False):
     '''
     Executes cmd, returning stdout, stderr, return code
     if localised is False, LC_ALL will be set to "C"
+    If it runs for longer than timeout seconds, cmd is killed along with
+    everything it started, giving return code -9 (SIGKILL) and the output
+    until then. It then runs in a session of its own, without the
+    controlling terminal.
+    If worker is set, cmd is sent to the shell_worker rather than to a new
+    /bin/sh, unless localised.
     '''
-    env = os.environ.copy()
-    if not localised:
-        env['LC_ALL'] = 'C'
+    env = None if localised else get_c_env()
 
     if unsudo and \
             'SUDO_USER' in os.environ and \
             os.environ['SUDO_USER'] != 'root':
         cmd = "sudo -u {} bash -c '{}' ".format(os.environ['SUDO_USER'], cmd)
 
-    process = subprocess.Popen(cmd, shell=True, env=env,
-                               stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                               preexec_fn=restore_signals)
+    if worker and not localised:
+        return shell_worker.run(cmd, timeout)
+
+    process = _popen_restored(cmd, shell=True,
+                              new_session=timeout is not None, env=env,
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    return _communicate(process, timeout)
+
+
+class CommandStream(object):
+    '''
+    A command running in the background, giving the lines of its stdout as
+    they are written when iterated over. Only a line at a time is kept, and
+    lines longer than MAX_LINE_LENGTH come in pieces.
+
+    The command is a shell string or an argv list, as for run_cmds(). Its
+    stdin is a pipe, written to with send(), so interactive programs such
+    as wpa_cli keep running. Its stderr is discarded unless merge_stderr is
+    set, when it comes mixed with stdout.
+
+    Once timeout seconds have passed the command is killed along with
+    everything it started, ending the lines. close() stops it early, it is
+    done when leaving a with block too. returncode is set once it is over.
+    '''
+
+    def __init__(self, command, localised=False, timeout=None,
+                 merge_stderr=False):
+        shell = isinstance(command, basestring)
+        env = None if localised else get_c_env()
+
+        self.returncode = None
+        self._devnull = None
+        if merge_stderr:
+            stderr = subprocess.STDOUT
+        else:
+            stderr = self._devnull = open(os.devnull, 'w')
+
+        # Popen doesn't buffer by default on Python 2, readline() would
+        # then read the output a byte at a time
+        try:
+            self._process = _popen_restored(
+                command, shell=shell, new_session=True, env=env, bufsize=-1,
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=stderr
+            )
+        except OSError:
+            self._close_devnull()
+            raise
+
+        self._deadline = None
+        if timeout is not None:
+            self._deadline = _Deadline(self._process, timeout)
+
+    @property
+    def timed_out(self):
+        return self._deadline is not None and self._deadline.expired
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        line = ''
+        if self.returncode is None:
+            line = self._process.stdout.readline(MAX_LINE_LENGTH)
+
+        if not line:
+            self._wait()
+            raise StopIteration
+
+        return line
+
+    def send(self, text):
+        self._process.stdin.write(text)
+        self._process.stdin.flush()
+
+    def close(self):
+        '''
+        Closes stdin, and terminates the command if it is still running
+        '''
+
+        if self.returncode is not None:
+            return
+
+        try:
+            self._process.stdin.close()
+        except IOError:
+            pass
+
+        if self._process.poll() is None:
+            _kill_group(self._process, signal.SIGTERM)
+
+        self._wait()
+
+    def _wait(self):
+        if self.returncode is not None:
+            return
+
+        self.returncode = self._process.wait()
+
+        if self._deadline:
+            self._deadline.cancel()
+
+        for pipe in (self._process.stdin, self._process.stdout):
+            try:
+                pipe.close()
+            except IOError:
+                pass
+
+        self._close_devnull()
+
+    def _close_devnull(self):
+        if self._devnull:
+            self._devnull.close()
+            self._devnull = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def stream_cmd(command, localised=False, timeout=None, merge_stderr=False):
+    '''
+    Starts the command, returning a CommandStream to iterate over the lines
+    of its output as they come, rather than all at once at the end as with
+    run_cmd()
+    '''
+
+    return CommandStream(command, localised, timeout, merge_stderr)
+
+
+class ShellWorker(object):
+    '''
+    A /bin/sh kept running in the background, the commands sent to it one
+    at a time over its stdin, rather than a new shell being started by
+    Python for each of them. Worth it for sequences of quick commands.
+
+    Each command runs in a subshell, so it can't change the worker with
+    cd, exit or variables, with stdin from /dev/null. Its end is marked on
+    stdout, with the return code, and on stderr by a line with a random
+    marker. Commands shouldn't leave anything writing to stdout or stderr
+    behind them.
+
+    It is started on first use, and again whenever it died, os.environ
+    changed, or in a forked child. A command timing out kills the worker
+    along with it. Threads take turns.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._process = None
+        self._pid = None
+        self._env = None
+        self._marker = None
+        self._out_end_re = None
+        self._err_end = None
+
+    def _is_running(self):
+        if self._process is None:
+            return False
+
+        if self._pid != os.getpid():
+            # forked, the worker belongs to the parent
+            for pipe in (self._process.stdin, self._process.stdout,
+                         self._process.stderr):
+                pipe.close()
+            self._process = None
+            return False
+
+        return self._process.poll() is None and self._env is get_c_env()
+
+    def _start(self):
+        self.stop()
+
+        self._env = get_c_env()
+        self._process = _popen_restored(
+            ['/bin/sh'], new_session=True, env=self._env, close_fds=True,
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE
+        )
+        self._pid = os.getpid()
+
+        self._marker = 'kano-shell-worker-{}'.format(
+            binascii.hexlify(os.urandom(8))
+        )
+        self._out_end_re = re.compile(
+            r'\n{} (\d+)\n$'.format(self._marker)
+        )
+        self._err_end = '\n{}\n'.format(self._marker)
+
+    def stop(self):
+        '''
+        Ends the worker, once the command running, if any, is done
+        '''
+
+        if self._process is None or self._pid != os.getpid():
+            self._process = None
+            return
+
+        try:
+            self._process.stdin.close()
+        except IOError:
+            pass
+
+        self._process.wait()
+        self._process.stdout.close()
+        self._process.stderr.close()
+        self._process = None
+
+    def run(self, cmd, timeout=None):
+        '''
+        Runs cmd in the worker, returning stdout, stderr, return code as
+        run_cmd() does, with the same timeout
+        '''
+
+        # eval, so a syntax error in cmd doesn't swallow the markers
+        frame = (
+            '( eval {cmd} ) </dev/null; '
+            'printf \'\\n%s %d\\n\' {marker} $?; '
+            'printf \'\\n%s\\n\' {marker} >&2\n'
+        )
+
+        with self._lock:
+            for attempt in (1, 2):
+                if not self._is_running():
+                    self._start()
+
+                try:
+                    self._process.stdin.write(frame.format(
+                        cmd=pipes.quote(cmd), marker=self._marker
+                    ))
+                    self._process.stdin.flush()
+                    break
+                except IOError:
+                    # died since, nothing was run yet
+                    self._process.wait()
+                    if attempt == 2:
+                        raise
+
+            return self._read_results(timeout)
+
+    def _read_results(self, timeout):
+        deadline = None if timeout is None else time.time() + timeout
+        out_fd = self._process.stdout.fileno()
+        err_fd = self._process.stderr.fileno()
+
+        chunks = {out_fd: [], err_fd: []}
+        # enough of the end of the outputs to find the markers in
+        tails = {out_fd: '', err_fd: ''}
+        tail_length = len(self._marker) + 16
+        rc = None
+        err_done = False
+
+        while rc is None or not err_done:
+            if self._process.poll() is not None:
+                # the worker died, what it started could hold the pipes.
+                # Its group id can't be reused while any of them is left.
+                try:
+                    os.killpg(self._process.pid, signal.SIGKILL)
+                except OSError:
+                    pass
+                return self._end_early(chunks, None)
+
+            wait = WORKER_POLL_INTERVAL
+            if deadline is not None:
+                if deadline <= time.time():
+                    _kill_group(self._process)
+                    return self._end_early(chunks, -signal.SIGKILL)
+                wait = min(wait, deadline - time.time())
+
+            try:
+                fds = [fd for fd, done in ((out_fd, rc is not None),
+                                           (err_fd, err_done)) if not done]
+                readable, _, _ = select.select(fds, [], [], wait)
+            except select.error as err:
+                if err.args[0] == errno.EINTR:
+                    continue
+                raise
+
+            for fd in readable:
+                data = os.read(fd, 65536)
+                if not data:
+                    # the worker died
+                    return self._end_early(chunks, None)
+
+                chunks[fd].append(data)
+                tails[fd] = (tails[fd] + data)[-tail_length:]
+
+            match = self._out_end_re.search(tails[out_fd])
+            if match:
+                rc = int(match.group(1))
+            err_done = tails[err_fd].endswith(self._err_end)
+
+        out = ''.join(chunks[out_fd])
+        err = ''.join(chunks[err_fd])
+        return out[:out.rindex('\n' + self._marker)], \
+            err[:-len(self._err_end)], rc
+
+    def _end_early(self, chunks, rc):
+        self._process.wait()
+        if rc is None:
+            rc = self._process.returncode
+
+        out, err = [
+            ''.join(chunks[pipe.fileno()])
+            for pipe in (self._process.stdout, self._process.stderr)
+        ]
+        self.stop()
+        return out, err, rc
+
+
+shell_worker = ShellWorker()
+
+
+class _CommandBatch(object):
+    '''
+    Commands run by a few threads, each putting (index, result) in the
+    results queue once its command is done
+    '''
+
+    def __init__(self, commands, localised):
+        self.env = None if localised else get_c_env()
+        self.pending = Queue()
+        self.results = Queue()
+        self.running = {}
+        self.cancelled = False
+        self._lock = threading.Lock()
+
+        for index, command in enumerate(commands):
+            self.pending.put((index, command))
+
+    def work(self):
+        while True:
+            try:
+                index, command = self.pending.get_nowait()
+            except Empty:
+                return
+
+            self.results.put((index, self._run(index, command)))
+
+    def _run(self, index, command):
+        shell = isinstance(command, basestring)
+
+        with self._lock:
+            if self.cancelled:
+                return '', '', None
+
+            try:
+                process = _popen_restored(
+                    command, shell=shell, new_session=True, env=self.env,
+                    stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                    # or the pipes of the others leak into it, delaying
+                    # their end of file until it is done too
+                    close_fds=True
+                )
+            except OSError as err:
+                return _exec_error('/bin/sh' if shell else command[0], err)
+
+            self.running[index] = process
+
+        stdout, stderr = process.communicate()
+
+        with self._lock:
+            del self.running[index]
+
+        return stdout, stderr, process.returncode
+
+    def cancel(self):
+        '''
+        Kills the commands still running, with whatever they started, and
+        doesn't start the others
+        '''
+
+        with self._lock:
+            self.cancelled = True
+            for process in self.running.itervalues():
+                _kill_group(process)
+
+
+def iter_cmds(commands, max_workers=DEFAULT_MAX_WORKERS, timeout=None,
+              localised=False):
+    '''
+    Runs the commands, up to max_workers at a time, yielding
+    (index, (stdout, stderr, return code)) as each one finishes.
+    A command is a string run by the shell as with run_cmd(), or a list
+    run without one as with run_argv().
+    Once timeout seconds have passed, the commands still running are
+    killed and give the negative signal as return code, those which
+    haven't started give None.
+    '''
+
+    commands = list(commands)
+    if not commands:
+        return
+
+    batch = _CommandBatch(commands, localised)
+    for dummy in xrange(min(max_workers, len(commands))):
+        worker = threading.Thread(target=batch.work)
+        worker.daemon = True
+        worker.start()
+
+    deadline = None if timeout is None else time.time() + timeout
+    remaining = len(commands)
+
+    try:
+        while remaining:
+            try:
+                if deadline is None or batch.cancelled:
+                    # a timed get() polls, only use it for the deadline
+                    result = batch.results.get()
+                else:
+                    result = batch.results.get(
+                        True, max(deadline - time.time(), 0)
+                    )
+            except Empty:
+                batch.cancel()
+                continue
+
+            remaining -= 1
+            yield result
+    finally:
+        if remaining:
+            # the caller stopped early or timed out
+            batch.cancel()
+
+
+def run_cmds(commands, max_workers=DEFAULT_MAX_WORKERS, timeout=None,
+             localised=False):
+    '''
+    Runs the commands concurrently as iter_cmds() does, returning the list
+    of their (stdout, stderr, return code) in the order of the commands.
+    Takes about as long as the slowest command, rather than all of them.
+    '''
+
+    commands = list(commands)
+    results = [None] * len(commands)
+
+    for index, result in iter_cmds(commands, max_workers, timeout,
+                                   localised):
+        results[index] = result
 
-    stdout, stderr = process.communicate()
-    returncode = process.returncode
-    return stdout, stderr, returncode
+    return results
 
 
 def run_cmd_log(cmd, localised=False, unsudo=False):
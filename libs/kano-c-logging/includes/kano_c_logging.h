@@ -5,7 +5,7 @@
 //
 // Implementation of logging
 
-// Currently uses syslog, needs to change to use out log files
+// Writes to the same log files as kano.logging, see kano-logs
 
 #ifndef KANO_LOG_H
 #define KANO_LOG_H
@@ -15,4 +15,13 @@ void kano_log_warning(char *msg,...);
 void kano_log_info(char *msg,...);
 void kano_log_debug(char *msg,...);
 
+// Writes out the buffered records, call it before exec()
+void kano_log_flush(void);
+
+// Record events on the timeline while profiling is enabled, see kano-trace
+void kano_trace_event(char phase, const char *name, const char *args);
+void kano_trace_begin(const char *name);
+void kano_trace_end(const char *name);
+void kano_trace_instant(const char *name);
+
 #endif // KANO_LOG_H
@@ -1,38 +1,786 @@
 // kano-log.c
 //
-// Copyright (C) 2015 Kano Computing Ltd.
+// Copyright (C) 2015-2019 Kano Computing Ltd.
 // License: http://www.gnu.org/licenses/gpl-2.0.txt GNU General Public License v2
 //
 // Implementation of logging
+//
+// Writes the same JSON-lines records as kano.logging to the app's log file,
+// or hands them to kano-logd when it is running. The levels are read from
+// /etc/kano-logs.conf (or LOG_LEVEL and OUTPUT_LEVEL) on the first call, so
+// a disabled call returns before its message is formatted.
+//
+// Records are buffered and written out when the buffer fills up, a warning
+// or an error is logged, a second has passed since the first pending record
+// and at exit. Call kano_log_flush() before exec() or _exit().
+//
+// While profiling is enabled, i.e. /etc/kano-profiling.conf exists, the
+// kano_trace_*() calls record events on the timeline shared with
+// kano.profiling, in the same memory mapped ring files, see kano.tracer.
+//
+// In a setuid program, e.g. kano-launcher, the files are created and
+// written with the real ids of the user who ran it, never as root.
+//
+// Not thread safe.
 
-// Currently uses syslog, needs to change to use out log files
-#include <syslog.h>
+#define _GNU_SOURCE             /* for program_invocation_short_name */
+#include <ctype.h>
+#include <dirent.h>
+#include <errno.h>
+#include <fcntl.h>
+#include <limits.h>
+#include <pwd.h>
 #include <stdarg.h>
+#include <stdint.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
 #include <syslog.h>
+#include <sys/mman.h>
+#include <sys/socket.h>
+#include <sys/stat.h>
+#include <sys/syscall.h>
+#include <sys/time.h>
+#include <sys/uio.h>
+#include <sys/un.h>
+#include <time.h>
+#include <unistd.h>
+
+#include "../includes/kano_c_logging.h"
+
+#define CONF_FILE "/etc/kano-logs.conf"
+#define LOG_ENV "LOG_LEVEL"
+#define OUTPUT_ENV "OUTPUT_LEVEL"
+
+#define SYSTEM_LOGS_DIR "/var/log/kano"
+#define USER_LOGS_DIR ".kano-logs"
+#define LOGD_SOCKET ".kano-logd.sock"
+#define INDEX_SUFFIX ".idx"
+
+// same defaults as kano.logging
+#define ROTATE_SIZE (1024 * 1024)
+#define ROTATE_COUNT 4
+
+#define MAX_MESSAGE 4096
+#define MAX_RECORD (MAX_MESSAGE * 2 + 512)
+#define BUFFER_SIZE (16 * 1024)
+#define BUFFER_INTERVAL 1
+
+#define PROFILING_CONF_FILE "/etc/kano-profiling.conf"
+#define TRACE_DIR "trace"
+#define TRACE_MAGIC "KTRC"
+#define TRACE_VERSION 1
+#define TRACE_CAPACITY 8192
+
+// Same little endian layout as HEADER and RECORD in kano.tracer
+struct trace_header {
+  char magic[4];
+  uint16_t version;
+  uint16_t record_size;
+  uint32_t capacity;
+  uint32_t pid;
+  uint64_t count;
+  char app_name[40];
+} __attribute__((packed));
+
+struct trace_record {
+  double time;
+  uint32_t tid;
+  char phase;
+  char pad[3];
+  char name[48];
+  char args[64];
+} __attribute__((packed));
+
+#define TRACE_SIZE (sizeof(struct trace_header) + \
+                    TRACE_CAPACITY * sizeof(struct trace_record))
+
+enum {LEVEL_NONE, LEVEL_ERROR, LEVEL_WARNING, LEVEL_INFO, LEVEL_DEBUG};
+
+static const char *level_names[]={"none","error","warning","info","debug"};
+static const int syslog_priorities[]={LOG_ERR,LOG_ERR,LOG_WARNING,LOG_INFO,LOG_DEBUG};
+
+// -1 until the conf has been read
+static int threshold=-1;
+static int log_threshold=LEVEL_NONE;
+static int output_threshold=LEVEL_NONE;
+static long rotate_size=ROTATE_SIZE;
+static int rotate_count=ROTATE_COUNT;
+
+static char app_name[256];
+static char log_path[PATH_MAX];
+
+static int logd_fd=-2;  // -2: not looked for yet, -1: not running
+static int log_fd=-1;
+static int log_failed=0;
+
+static int trace_state=-1;  // -1: conf not looked for yet, 0: off, 1: on
+static struct trace_header *trace_map=NULL;
+static pid_t trace_pid=0;
+
+static uid_t saved_euid;
+static gid_t saved_egid;
+
+static char buffer[BUFFER_SIZE];
+static size_t buffer_len=0;
+static time_t buffer_since=0;
+
+
+/**
+ * @name normalise_level - Match a level name the way kano.logging does
+ * @param name - the name or its first letters, e.g. "warn"
+ * @return int - the level, LEVEL_NONE if it doesn't match any
+ */
+static int normalise_level(const char *name){
+  size_t len=strlen(name);
+  int level;
+
+  if(!len) return LEVEL_NONE;
+
+  for(level=LEVEL_NONE;level<=LEVEL_DEBUG;level++){
+    if(len<=strlen(level_names[level]) &&
+       !strncasecmp(name,level_names[level],len))
+      return level;
+  }
+
+  return LEVEL_NONE;
+}
+
+
+/**
+ * @name strip - Remove the whitespace around a string, in place
+ * @param str - the string
+ * @return char * - the start of the stripped string
+ */
+static char *strip(char *str){
+  size_t len;
+
+  while(isspace((unsigned char)*str)) str++;
+
+  len=strlen(str);
+  while(len>0 && isspace((unsigned char)str[len-1])) str[--len]='\0';
+
+  return str;
+}
+
+
+/**
+ * @name load_conf - Read the levels and rotation settings
+ *
+ * Only understands the flat "key: value" lines kano-logs config writes.
+ */
+static void load_conf(void){
+  char line[256];
+  const char *env;
+  FILE *conf;
+
+  conf=fopen(CONF_FILE,"re");
+  if(conf){
+    while(fgets(line,sizeof(line),conf)){
+      char *sep=strchr(line,':');
+      char *key,*value;
+      size_t len;
+
+      if(!sep) continue;
+      *sep='\0';
+      key=strip(line);
+      value=strip(sep+1);
+
+      len=strlen(value);
+      if(len>=2 && (value[0]=='\'' || value[0]=='"') && value[len-1]==value[0]){
+        value[len-1]='\0';
+        value++;
+      }
+
+      if(!strcmp(key,"log_level")) log_threshold=normalise_level(value);
+      else if(!strcmp(key,"output_level")) output_threshold=normalise_level(value);
+      else if(!strcmp(key,"rotate_size")) rotate_size=strtol(value,NULL,10);
+      else if(!strcmp(key,"rotate_count")) rotate_count=atoi(value);
+    }
+    fclose(conf);
+  }
+
+  env=getenv(LOG_ENV);
+  if(env) log_threshold=normalise_level(env);
+
+  env=getenv(OUTPUT_ENV);
+  if(env) output_threshold=normalise_level(env);
+
+  threshold=log_threshold>output_threshold ? log_threshold : output_threshold;
+}
+
+
+/**
+ * @name enabled - Whether a record at this level goes anywhere
+ */
+static inline int enabled(int level){
+  if(threshold<0) load_conf();
+  return level<=threshold;
+}
+
+
+/**
+ * @name get_logs_dir - Find the directory kano.logging would log to
+ * @param buf - buffer for the path
+ * @param size - size of buf
+ * @return int - zero on success
+ */
+static int get_logs_dir(char *buf, size_t size){
+  const char *home=NULL;
+  const char *sudo_user=getenv("SUDO_USER");
+  int n;
+
+  if(getuid()==0 && !sudo_user){
+    n=snprintf(buf,size,"%s",SYSTEM_LOGS_DIR);
+    return (n<0 || (size_t)n>=size);
+  }
+
+  if(sudo_user){
+    struct passwd *pw=getpwnam(sudo_user);
+    if(pw) home=pw->pw_dir;
+  }
+  else
+    home=getenv("HOME");
+
+  if(!home) return 1;
+
+  n=snprintf(buf,size,"%s/%s",home,USER_LOGS_DIR);
+  return (n<0 || (size_t)n>=size);
+}
+
+
+/**
+ * @name as_real_user - Switch the effective ids to the real ones
+ *
+ * A setuid program must not touch the files in the logs dir of the user,
+ * who can point them anywhere with symlinks, with the rights of root.
+ * @return int - zero when nothing changed, 1 when switched, -1 on failure
+ */
+static int as_real_user(void){
+  if(getuid()==geteuid() && getgid()==getegid()) return 0;
+
+  saved_euid=geteuid();
+  saved_egid=getegid();
+
+  // the group first, it needs the rights being dropped
+  if(setegid(getgid()) || seteuid(getuid())){
+    setegid(saved_egid);
+    return -1;
+  }
+
+  return 1;
+}
+
+
+/**
+ * @name as_effective_user - Undo as_real_user()
+ * @param switched - what as_real_user() returned
+ */
+static void as_effective_user(int switched){
+  if(switched<=0) return;
+
+  if(seteuid(saved_euid) || setegid(saved_egid))
+    syslog(LOG_USER | LOG_ERR,"kano-c-logging: can't restore the ids: %m");
+}
+
+
+/**
+ * @name fix_owner - Give a file created under sudo or setuid to the user
+ */
+static void fix_owner(int fd, const char *path){
+  const char *sudo_uid=getenv("SUDO_UID");
+  const char *sudo_gid=getenv("SUDO_GID");
+  uid_t uid;
+  gid_t gid;
+
+  if(sudo_uid && sudo_gid){
+    uid=atoi(sudo_uid);
+    gid=atoi(sudo_gid);
+  }
+  else if(getuid()!=geteuid() || getgid()!=getegid()){
+    uid=getuid();
+    gid=getgid();
+  }
+  else
+    return;
+
+  if(fd>=0) fchown(fd,uid,gid);
+  else lchown(path,uid,gid);
+}
+
+
+/**
+ * @name init_app_name - Name the app the way kano.logging does
+ */
+static void init_app_name(void){
+  int i;
+
+  snprintf(app_name,sizeof(app_name),"%s",program_invocation_short_name);
+  for(i=0;app_name[i];i++){
+    if(app_name[i]==' ') app_name[i]='_';
+    else app_name[i]=tolower((unsigned char)app_name[i]);
+  }
+}
+
+
+/**
+ * @name logd_connect - Connect to kano-logd if it is running
+ */
+static void logd_connect(const char *logs_dir){
+  struct sockaddr_un addr;
+  int n,fd;
+
+  logd_fd=-1;
+
+  memset(&addr,0,sizeof(addr));
+  addr.sun_family=AF_UNIX;
+  n=snprintf(addr.sun_path,sizeof(addr.sun_path),"%s/%s",logs_dir,LOGD_SOCKET);
+  if(n<0 || (size_t)n>=sizeof(addr.sun_path)) return;
+
+  fd=socket(AF_UNIX,SOCK_DGRAM|SOCK_CLOEXEC,0);
+  if(fd<0) return;
+
+  if(connect(fd,(struct sockaddr *)&addr,sizeof(addr))){
+    close(fd);
+    return;
+  }
+
+  logd_fd=fd;
+}
+
+
+/**
+ * @name init_output - Find where the records go, done on the first record
+ * @return int - zero if they can go to the daemon or the log file
+ */
+static int init_output(void){
+  char logs_dir[PATH_MAX];
+  int n,switched;
+
+  init_app_name();
+  logd_fd=-1;
+
+  if(get_logs_dir(logs_dir,sizeof(logs_dir))) return 1;
+
+  n=snprintf(log_path,sizeof(log_path),"%s/%s.log",logs_dir,app_name);
+  if(n<0 || (size_t)n>=sizeof(log_path)){
+    log_path[0]='\0';
+    return 1;
+  }
+
+  switched=as_real_user();
+  if(switched<0) return 1;
+  if(mkdir(logs_dir,0755)==0) fix_owner(-1,logs_dir);
+  as_effective_user(switched);
+
+  logd_connect(logs_dir);
+  atexit(kano_log_flush);
+
+  return 0;
+}
+
+
+/**
+ * @name prune_segments - Remove all but the newest rotate_count segments
+ */
+static void prune_segments(const char *logs_dir, const char *log_name){
+  struct dirent **names;
+  char path[PATH_MAX];
+  size_t len=strlen(log_name);
+  int i,n,found=0;
+
+  n=scandir(logs_dir,&names,NULL,alphasort);
+  if(n<0) return;
+
+  // the timestamps sort in time order, count back from the newest
+  for(i=n-1;i>=0;i--){
+    const char *name=names[i]->d_name;
+
+    if(!strncmp(name,log_name,len) && name[len]=='.' &&
+       isdigit((unsigned char)name[len+1]) &&
+       !strstr(name+len,INDEX_SUFFIX) && ++found>rotate_count){
+      snprintf(path,sizeof(path),"%s/%s",logs_dir,name);
+      unlink(path);
+    }
+    free(names[i]);
+  }
+  free(names);
+}
+
+
+/**
+ * @name rotate_log_file - Move the log file aside as kano.logging does
+ *
+ * The segments are left for kano.logging to compress.
+ */
+static void rotate_log_file(void){
+  char segment[PATH_MAX+64];
+  char index[PATH_MAX+8];
+  char stamp[16];
+  char *logs_dir,*log_name;
+  struct timeval now;
+  struct tm tm;
+
+  gettimeofday(&now,NULL);
+  localtime_r(&now.tv_sec,&tm);
+  strftime(stamp,sizeof(stamp),"%Y%m%dT%H%M%S",&tm);
+
+  snprintf(segment,sizeof(segment),"%s.%s.%06ld",log_path,stamp,(long)now.tv_usec);
+  if(rename(log_path,segment)) return;
+
+  snprintf(index,sizeof(index),"%s%s",log_path,INDEX_SUFFIX);
+  unlink(index);
+
+  logs_dir=strdup(log_path);
+  if(!logs_dir) return;
+  log_name=strrchr(logs_dir,'/');
+  *log_name++='\0';
+  prune_segments(logs_dir,log_name);
+  free(logs_dir);
+}
+
+
+/**
+ * @name open_log_file - Make sure log_fd is the current log file
+ *
+ * Reopens it after another process rotated it and rotates it when it has
+ * grown past rotate_size. Call it as the real user.
+ */
+static int open_log_file(void){
+  struct stat fd_st,path_st;
+
+  if(log_fd>=0){
+    if(fstat(log_fd,&fd_st) || stat(log_path,&path_st) ||
+       fd_st.st_ino!=path_st.st_ino || fd_st.st_dev!=path_st.st_dev){
+      close(log_fd);
+      log_fd=-1;
+    }
+    else if(rotate_size>0 && fd_st.st_size>=rotate_size){
+      close(log_fd);
+      log_fd=-1;
+      rotate_log_file();
+    }
+    else
+      return 0;
+  }
+
+  log_fd=open(log_path,O_WRONLY|O_APPEND|O_CREAT|O_EXCL|O_NOFOLLOW|O_CLOEXEC,0644);
+  if(log_fd>=0)
+    fix_owner(log_fd,NULL);
+  else if(errno==EEXIST)
+    log_fd=open(log_path,O_WRONLY|O_APPEND|O_NOFOLLOW|O_CLOEXEC);
+
+  return log_fd<0;
+}
+
+
+/**
+ * @name write_data - Write whole records out
+ * @param data - the records
+ * @param len - their length
+ * @return int - zero on success
+ */
+static int write_data(const char *data, size_t len){
+  int switched,failed;
+
+  if(logd_fd>=0){
+    struct iovec iov[3];
+    struct msghdr msg;
+
+    iov[0].iov_base=app_name;
+    iov[0].iov_len=strlen(app_name);
+    iov[1].iov_base=" flush\n";
+    iov[1].iov_len=7;
+    iov[2].iov_base=(void *)data;
+    iov[2].iov_len=len;
+
+    memset(&msg,0,sizeof(msg));
+    msg.msg_iov=iov;
+    msg.msg_iovlen=3;
+
+    if(sendmsg(logd_fd,&msg,MSG_DONTWAIT)>=0) return 0;
+
+    // keep the socket if the daemon is only busy
+    if(errno!=EAGAIN && errno!=EWOULDBLOCK && errno!=EMSGSIZE && errno!=ENOBUFS){
+      close(logd_fd);
+      logd_fd=-1;
+    }
+  }
+
+  switched=as_real_user();
+  if(switched<0) return 1;
+  failed=open_log_file();
+  as_effective_user(switched);
+  if(failed) return 1;
+
+  while(len>0){
+    ssize_t n=write(log_fd,data,len);
+
+    if(n<0){
+      if(errno==EINTR) continue;
+      return 1;
+    }
+    data+=n;
+    len-=n;
+  }
+
+  return 0;
+}
+
+
+/**
+ * @name kano_log_flush - Write out the buffered records
+ */
+void kano_log_flush(void){
+  if(!buffer_len) return;
+
+  write_data(buffer,buffer_len);
+  buffer_len=0;
+}
+
+
+/**
+ * @name buffer_record - Add a record to the buffer, flushing it as needed
+ */
+static void buffer_record(const char *record, size_t len){
+  if(buffer_len+len>sizeof(buffer)) kano_log_flush();
+
+  if(len>sizeof(buffer)){
+    write_data(record,len);
+    return;
+  }
+
+  if(!buffer_len) buffer_since=time(NULL);
+  memcpy(buffer+buffer_len,record,len);
+  buffer_len+=len;
+}
+
+
+/**
+ * @name json_escape - Append a string to a JSON string being built
+ * @param dst - buffer with the JSON so far
+ * @param len - length of the JSON in dst
+ * @param size - size of dst
+ * @param src - the string to append
+ * @param src_len - the length of src
+ * @return int - the new length or -1 if it doesn't fit
+ */
+static int json_escape(char *dst, size_t len, size_t size, const char *src, size_t src_len){
+  size_t i;
+  int n;
+
+  for(i=0;i<src_len;i++){
+    unsigned char c=(unsigned char)src[i];
+
+    if(size-len<7) return -1;
+
+    if(c=='"' || c=='\\'){
+      dst[len++]='\\';
+      dst[len++]=c;
+    }
+    else if(c=='\t'){
+      dst[len++]='\\';
+      dst[len++]='t';
+    }
+    else if(c<0x20){
+      n=snprintf(dst+len,size-len,"\\u%04x",c);
+      len+=n;
+    }
+    else
+      dst[len++]=c;
+  }
+
+  return len;
+}
+
+
+/**
+ * @name log_records - Write a record for each line of the message
+ */
+static void log_records(int level, const char *msg){
+  char record[MAX_RECORD];
+  struct timeval now;
+  const char *line,*end;
+  int len;
+
+  gettimeofday(&now,NULL);
+
+  for(line=msg;line;line=end ? end+1 : NULL){
+    end=strchr(line,'\n');
+
+    len=snprintf(record,sizeof(record),
+                 "{\"pid\": %d, \"level\": \"%s\", \"time\": %ld.%06ld, \"message\": \"",
+                 (int)getpid(),level_names[level],(long)now.tv_sec,(long)now.tv_usec);
+    if(len<0 || (size_t)len>=sizeof(record)) return;
+
+    len=json_escape(record,len,sizeof(record),line,end ? (size_t)(end-line) : strlen(line));
+    if(len<0 || (size_t)len+4>sizeof(record)) return;
+    len+=snprintf(record+len,sizeof(record)-len,"\"}\n");
+
+    buffer_record(record,len);
+  }
+
+  if(level<=LEVEL_WARNING || time(NULL)-buffer_since>=BUFFER_INTERVAL)
+    kano_log_flush();
+}
+
+
+static void kano_log(int level, const char *fmt, va_list ap){
+  char buf[MAX_MESSAGE];
+  char *msg;
+
+  vsnprintf(buf,sizeof(buf),fmt,ap);
+
+  // most callers end their messages with a newline
+  msg=strip(buf);
+
+  if(level<=output_threshold)
+    fprintf(stderr,"%s[%d] %s %s\n",program_invocation_short_name,(int)getpid(),
+            level_names[level],msg);
+
+  if(level>log_threshold) return;
+
+  if(logd_fd==-2 && init_output()) log_failed=1;
+
+  if(log_failed)
+    syslog(LOG_USER | syslog_priorities[level],"%s",msg);
+  else
+    log_records(level,msg);
+}
+
 
 void kano_log_error(char *msg,...){
   va_list ap;
+  if(!enabled(LEVEL_ERROR)) return;
   va_start(ap,msg);
-  vsyslog(LOG_USER | LOG_ERR, msg, ap);
+  kano_log(LEVEL_ERROR,msg,ap);
   va_end(ap);
 }
 void kano_log_warning(char *msg,...){
   va_list ap;
+  if(!enabled(LEVEL_WARNING)) return;
   va_start(ap,msg);
-  vsyslog(LOG_USER | LOG_WARNING, msg, ap);
+  kano_log(LEVEL_WARNING,msg,ap);
   va_end(ap);
 }
 void kano_log_info(char *msg,...){
   va_list ap;
+  if(!enabled(LEVEL_INFO)) return;
   va_start(ap,msg);
-  vsyslog(LOG_USER | LOG_INFO, msg, ap);
+  kano_log(LEVEL_INFO,msg,ap);
   va_end(ap);
 }
 void kano_log_debug(char *msg,...){
   va_list ap;
+  if(!enabled(LEVEL_DEBUG)) return;
   va_start(ap,msg);
-  vsyslog(LOG_USER | LOG_ERR, msg, ap);
+  kano_log(LEVEL_DEBUG,msg,ap);
   va_end(ap);
 }
 
 
+/**
+ * @name trace_open - Create the trace file of this process
+ * @return int - zero on success
+ */
+static int trace_open(void){
+  char logs_dir[PATH_MAX];
+  char trace_dir[PATH_MAX+16];
+  char path[PATH_MAX+320];
+  int fd,switched;
+  void *map;
+
+  // after fork() the child gets a file of its own
+  if(trace_map){
+    munmap(trace_map,TRACE_SIZE);
+    trace_map=NULL;
+  }
+
+  if(get_logs_dir(logs_dir,sizeof(logs_dir))) return 1;
+  if(!app_name[0]) init_app_name();
+
+  snprintf(trace_dir,sizeof(trace_dir),"%s/%s",logs_dir,TRACE_DIR);
+  trace_pid=getpid();
+  snprintf(path,sizeof(path),"%s/%s-%d.ktrace",trace_dir,app_name,(int)trace_pid);
+
+  switched=as_real_user();
+  if(switched<0) return 1;
+
+  if(mkdir(logs_dir,0755)==0) fix_owner(-1,logs_dir);
+  if(mkdir(trace_dir,0755)==0) fix_owner(-1,trace_dir);
+  fd=open(path,O_RDWR | O_CREAT | O_TRUNC | O_NOFOLLOW | O_CLOEXEC,0644);
+  if(fd>=0) fix_owner(fd,path);
+
+  as_effective_user(switched);
+  if(fd<0) return 1;
+  if(ftruncate(fd,TRACE_SIZE)){
+    close(fd);
+    return 1;
+  }
+
+  map=mmap(NULL,TRACE_SIZE,PROT_READ | PROT_WRITE,MAP_SHARED,fd,0);
+  close(fd);
+  if(map==MAP_FAILED) return 1;
+
+  trace_map=map;
+  memcpy(trace_map->magic,TRACE_MAGIC,sizeof(trace_map->magic));
+  trace_map->version=TRACE_VERSION;
+  trace_map->record_size=sizeof(struct trace_record);
+  trace_map->capacity=TRACE_CAPACITY;
+  trace_map->pid=trace_pid;
+  trace_map->count=0;
+  strncpy(trace_map->app_name,app_name,sizeof(trace_map->app_name));
+
+  return 0;
+}
+
+
+/**
+ * @name kano_trace_event - Record an event on the timeline
+ * @param phase - Chrome trace_event phase, 'B', 'E', 'i' or 'C'
+ * @param name - event name, cut to 48 bytes
+ * @param args - JSON object of arguments up to 64 bytes, or NULL
+ */
+void kano_trace_event(char phase, const char *name, const char *args){
+  struct trace_record *record;
+  struct timeval now;
+  size_t len;
+
+  if(trace_state<0) trace_state=(access(PROFILING_CONF_FILE,F_OK)==0);
+  if(!trace_state) return;
+
+  if(!trace_map || trace_pid!=getpid()){
+    if(trace_open()){
+      trace_state=0;
+      return;
+    }
+  }
+
+  gettimeofday(&now,NULL);
+
+  record=(struct trace_record *)(trace_map+1)+trace_map->count%TRACE_CAPACITY;
+  memset(record,0,sizeof(*record));
+  record->time=now.tv_sec+now.tv_usec/1e6;
+  record->tid=(uint32_t)syscall(SYS_gettid);
+  record->phase=phase;
+
+  len=strlen(name);
+  memcpy(record->name,name,len<sizeof(record->name) ? len : sizeof(record->name));
+
+  if(args){
+    len=strlen(args);
+    if(len<=sizeof(record->args)) memcpy(record->args,args,len);
+  }
+
+  trace_map->count++;
+}
+
+void kano_trace_begin(const char *name){
+  kano_trace_event('B',name,NULL);
+}
+void kano_trace_end(const char *name){
+  kano_trace_event('E',name,NULL);
+}
+void kano_trace_instant(const char *name){
+  kano_trace_event('i',name,NULL);
+}
@@ -17,3 +17,4 @@ from tests.fixtures.cpu import *
 from tests.fixtures.disk import *
 from tests.fixtures.boards import *
 from tests.fixtures.keyboard import *
+from tests.fixtures.probe_cache import *
@@ -39,7 +39,7 @@ def df(monkeypatch):
     Note: This fixture auto-reimports the `kano.utils.disk` module, which we
           expect to be the one which requires the patch, however depending on
           the module, it may be required to re-import the module being tested
-          as this fixture patches `kano.utils.run_cmd` and if the tested module
+          as this fixture patches `kano.utils.run_argv` and if the tested module
           depends on this directly and has already been loaded then the updated
           version will not propagate. To re-import use:
 
@@ -51,15 +51,15 @@ def df(monkeypatch):
 
     import kano.utils.shell
 
-    def mock_run_cmd(cmd):
-        if cmd.startswith('df'):
+    def mock_run_argv(argv):
+        if argv[0] == 'df':
             return DF_OUTPUT, '', 0
         else:
             raise NotImplementedError(
-                'Command run is not df: {}'.format(cmd)
+                'Command run is not df: {}'.format(argv)
             )
 
-    patch = monkeypatch.setattr(kano.utils.shell, 'run_cmd', mock_run_cmd)
+    patch = monkeypatch.setattr(kano.utils.shell, 'run_argv', mock_run_argv)
     import kano.utils.disk
     imp.reload(kano.utils.disk)
     return patch
@@ -74,7 +74,7 @@ def lsblk(monkeypatch):
     Note: This fixture auto-reimports the `kano.utils.disk` module, which we
           expect to be the one which requires the patch, however depending on
           the module, it may be required to re-import the module being tested
-          as this fixture patches `kano.utils.run_cmd` and if the tested module
+          as this fixture patches `kano.utils.run_argv` and if the tested module
           depends on this directly and has already been loaded then the updated
           version will not propagate. To re-import use:
 
@@ -86,15 +86,15 @@ def lsblk(monkeypatch):
 
     import kano.utils.shell
 
-    def mock_run_cmd(cmd):
-        if cmd.startswith('lsblk'):
+    def mock_run_argv(argv):
+        if argv[0] == 'lsblk':
             return LSBLK_OUTPUT, '', 0
         else:
             raise NotImplementedError(
-                'Command run is not lsblk: {}'.format(cmd)
+                'Command run is not lsblk: {}'.format(argv)
             )
 
-    patch = monkeypatch.setattr(kano.utils.shell, 'run_cmd', mock_run_cmd)
+    patch = monkeypatch.setattr(kano.utils.shell, 'run_argv', mock_run_argv)
     import kano.utils.disk
     imp.reload(kano.utils.disk)
 
@@ -34,7 +34,7 @@ def keyboard(request, fs, monkeypatch):
     Note: This fixture auto-reimports the `kano.utils.hardware` module, which we
           expect to be the one which requires the patch, however depending on
           the module, it may be required to re-import the module being tested
-          as this fixture patches `kano.utils.run_cmd` and if the tested module
+          as this fixture patches `kano.utils.run_argv` and if the tested module
           depends on this directly and has already been loaded then the updated
           version will not propagate. To re-import use:
 
@@ -54,16 +54,16 @@ def keyboard(request, fs, monkeypatch):
     with open(lsusb_output_path, 'r') as lsusb_output_f:
         lsusb_output = lsusb_output_f.read()
 
-    def fake_lsusb_out(cmd):
-        if cmd.startswith('lsusb'):
+    def fake_lsusb_out(argv):
+        if argv[0] == 'lsusb':
             return lsusb_output, None, None
         else:
             raise NotImplementedError(
-                'Command run is not lsusb: {}'.format(cmd)
+                'Command run is not lsusb: {}'.format(argv)
             )
 
     import kano.utils.shell
-    monkeypatch.setattr(kano.utils.shell, 'run_cmd', fake_lsusb_out)
+    monkeypatch.setattr(kano.utils.shell, 'run_argv', fake_lsusb_out)
     imp.reload(kano.utils.hardware)
 
     return version
@@ -0,0 +1,31 @@
+#
+# probe_cache.py
+#
+# Copyright (C) 2019 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Fixtures for the cache of the system probes
+#
+
+
+import pytest
+
+
+@pytest.fixture(scope='function', autouse=True)
+def probe_cache(tmpdir, monkeypatch):
+    '''
+    Gives every test an empty probe cache of its own, so the probes see the
+    output faked for them rather than an earlier result.
+    Returns the path of the cache file.
+    '''
+
+    import kano.utils.probe_cache
+
+    cache_path = str(tmpdir.join('kano-probe-cache.json'))
+    monkeypatch.setattr(
+        kano.utils.probe_cache, 'get_cache_path', lambda: cache_path
+    )
+    monkeypatch.setattr(kano.utils.probe_cache, '_entries', {})
+    monkeypatch.setattr(kano.utils.probe_cache, '_file_state', None)
+
+    return cache_path
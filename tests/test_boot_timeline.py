@@ -0,0 +1,146 @@
+#
+# test_boot_timeline.py
+#
+# Copyright (C) 2019 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Tests for the critical path of the network bring-up
+#
+
+
+import json
+
+from kano.boot_timeline import BootTimeline, Event, critical_path, \
+    format_report, read_trace_events, read_log_events, read_journal_events, \
+    merge_events
+from kano.tracer import TraceWriter
+
+BOOT = 1500000000.0
+
+
+def write_script_trace(tmpdir, app, pid, lines):
+    path = tmpdir.join('{}-{}.ktrace'.format(app, pid))
+    path.write(''.join(
+        '{:.6f}\t{}\t{}\t{}\n'.format(BOOT + offset, pid, phase, name)
+        for offset, phase, name in lines
+    ))
+    return str(path)
+
+
+def get_trace_paths(tmpdir):
+    paths = [
+        write_script_trace(tmpdir, 'kano-dhcp-hook', 100, [
+            (0.0, 'i', 'dhcp REBOOT'),
+            (0.1, 'B', 'launch network up scripts'),
+            (0.4, 'E', 'launch network up scripts')
+        ]),
+        write_script_trace(tmpdir, 'kano-sentry-startup', 200, [
+            (0.2, 'B', 'start sentry server'),
+            (0.9, 'E', 'start sentry server')
+        ]),
+        write_script_trace(tmpdir, 'kano-set-system-date', 300, [
+            (0.3, 'B', 'tzupdate'),
+            (1.3, 'E', 'tzupdate'),
+            (1.3, 'B', 'rdate'),
+            (3.3, 'i', 'time synced'),
+            (3.3, 'E', 'rdate')
+        ])
+    ]
+
+    path = str(tmpdir.join('kano-network-hook-400.ktrace'))
+    writer = TraceWriter(path, 'kano-network-hook')
+    writer.event('i', 'process start', timestamp=BOOT + 0.4, tid=400)
+    writer.event('B', 'send-cpu-id', timestamp=BOOT + 2.0, tid=400)
+    writer.event('E', 'send-cpu-id', timestamp=BOOT + 5.0, tid=400)
+    writer.close()
+
+    return paths + [path]
+
+
+def test_boot_timeline(tmpdir):
+    events = read_trace_events(get_trace_paths(tmpdir))
+    # an earlier DHCP event which isn't the one being looked at
+    events.append(Event(BOOT - 100, 'kano-dhcp-hook', 50, 50, 'i',
+                        'dhcp REBOOT'))
+    timeline = BootTimeline(events)
+
+    assert timeline.dhcp_time == BOOT
+    assert [p.app for p in timeline.processes] == [
+        'kano-dhcp-hook', 'kano-sentry-startup', 'kano-set-system-date',
+        'kano-network-hook'
+    ]
+
+    milestones = timeline.get_milestones()
+    assert [(name, round(t - BOOT, 3), p.app) for name, t, p in milestones] \
+        == [
+            ('time synced', 3.3, 'kano-set-system-date'),
+            ('network scripts done', 5.0, 'kano-network-hook')
+        ]
+
+    segments = critical_path(milestones[1][2], BOOT, milestones[1][1])
+    assert [
+        (s.name, round(s.start - BOOT, 3), round(s.end - BOOT, 3))
+        for s in segments
+    ] == [
+        ('start kano-network-hook', 0.0, 0.4),
+        ('kano-network-hook', 0.4, 2.0),
+        ('send-cpu-id', 2.0, 5.0)
+    ]
+
+    report = format_report(timeline)
+    assert 'Critical path to time synced, 3.300s:' in report
+    assert '    1.300s    3.300s    2.000s  rdate' in report
+    assert 'Not seen' not in report
+
+
+def test_boot_timeline_from_logs(tmpdir):
+    log_path = tmpdir.join('kano-set-system-date.log')
+    log_path.write(''.join(json.dumps(entry) + '\n' for entry in [
+        {'message': 'skipping tzupdate', 'level': 'info', 'pid': 300,
+         'time': BOOT + 0.5},
+        {'message': 'rdate SUCCESS: done', 'level': 'info', 'pid': 300,
+         'time': BOOT + 2.5}
+    ]))
+    journal = [
+        '{:.6f} kano root[99]: kano-dhcp-hook: info reason=REBOOT'
+        .format(BOOT),
+        '{:.6f} kano root[100]: kano-dhcp-hook: REBOOT event ipaddr= on '
+        'iface=wlan0'.format(BOOT + 0.1)
+    ]
+
+    events = merge_events(
+        [],
+        read_log_events([str(log_path)]),
+        read_journal_events(journal)
+    )
+    timeline = BootTimeline(events)
+
+    assert round(timeline.dhcp_time - BOOT, 3) == 0.1
+    assert [(name, round(t - BOOT, 3)) for name, t, p in
+            timeline.get_milestones()] == [
+        ('time synced', 2.5), ('network scripts done', 2.5)
+    ]
+
+    report = format_report(timeline)
+    assert 'Not seen: kano-sentry-startup, kano-network-hook' in report
+
+
+def test_merge_events_prefers_traces(tmpdir):
+    trace_events = read_trace_events(get_trace_paths(tmpdir))
+    log_events = [
+        Event(BOOT + 1, 'kano-set-system-date', 300, 300, 'i', 'log'),
+        Event(BOOT + 1, 'kano-set-system-date', 301, 301, 'i', 'log')
+    ]
+    journal_events = [
+        Event(BOOT + 1, 'kano-dhcp-hook', 1, 1, 'i', 'dhcp BOUND')
+    ]
+
+    events = merge_events(trace_events, log_events, journal_events)
+
+    assert [e.pid for e in events if e.name == 'log'] == [301]
+    assert not [e for e in events if e.name == 'dhcp BOUND']
+
+
+def test_no_dhcp_event():
+    assert format_report(BootTimeline([])) == \
+        'No DHCP REBOOT or BOUND event found\n'
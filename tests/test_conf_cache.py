@@ -0,0 +1,157 @@
+#
+# test_conf_cache.py
+#
+# Copyright (C) 2019 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Tests for loading the configuration files without yaml
+#
+
+
+import os
+
+import pytest
+import yaml
+
+
+SUPPORTED_CONFS = [
+    '',
+    '# only a comment\n',
+    'log_level: debug\noutput_level: none\n',
+    'a: 1\nb: -2\nc: 1.5\nd: .5\ne: true\nf: No\ng: ~\nh:\ni: y\nj: tRue\n',
+    'a: \'single \'\'quoted\'\'\'\nb: "double"\nc: caf\xc3\xa9\nd: x # note\n',
+    'app:\n'
+    '  point:\n'
+    '    python:\n'
+    '      statfile: /tmp/point.stats\n'
+    '    start_exec: echo start\n'
+    '  other:\n'
+    '\n'
+    '    # comment\n'
+    '    end_exec: ls -l\n'
+    'second:\n',
+    '/usr/bin/make-pong:\n  load:\n    memory:\n      top: 10\n',
+    'a:\n  touch\n    /tmp/a\n  b\nc:\n  2\n\nd: 3\n',
+]
+
+UNSUPPORTED_CONFS = [
+    'a: 0755\n',
+    'a: 0x1f\n',
+    'a: 1e5\n',
+    'a: 1_000\n',
+    'a: 12:30\n',
+    'a: 2019-01-01\n',
+    'a: [1, 2]\n',
+    'a:\n  - 1\n',
+    'a: |\n  text\n',
+    'a: &anchor 1\nb: *anchor\n',
+    'a: "escaped \\n"\n',
+    'a: 1\n  b: 2\n',
+    'a: 1\na: 2\n',
+    '---\na: 1\n',
+    'a:\n  text\n\n  more\n',
+    'a:\n  text\n  b: 1\n',
+]
+
+
+@pytest.mark.parametrize('text', SUPPORTED_CONFS)
+def test_parse_conf(text):
+    from kano.conf_cache import parse_conf
+
+    conf = parse_conf(text)
+
+    # same values and same str/unicode types
+    assert repr(conf) == repr(yaml.load(text))
+
+
+def test_load_profiling_conf(tmpdir, monkeypatch):
+    ''' The examples of the profiling conf are read without yaml '''
+
+    import sys
+    import textwrap
+    import kano.profiling
+    from kano.conf_cache import load_conf
+
+    examples = []
+    for line in kano.profiling.__doc__.splitlines():
+        if line.startswith(' /'):
+            examples.append([])
+        elif not line.strip() or line.startswith(' Example'):
+            examples.append(None)
+            continue
+        if examples and examples[-1] is not None:
+            examples[-1].append(line + '\n')
+
+    examples = [textwrap.dedent(''.join(e)) for e in examples if e]
+    assert len(examples) == 4
+
+    expected = [yaml.load(text) for text in examples]
+    monkeypatch.setitem(sys.modules, 'yaml', None)
+
+    for index, text in enumerate(examples):
+        path = str(tmpdir.join('profiling-{}.conf'.format(index)))
+        with open(path, 'w') as f:
+            f.write(text)
+
+        assert load_conf(path) == expected[index]
+
+
+@pytest.mark.parametrize('text', UNSUPPORTED_CONFS)
+def test_parse_conf_unsupported(text):
+    from kano.conf_cache import parse_conf, UnsupportedConf
+
+    with pytest.raises(UnsupportedConf):
+        parse_conf(text)
+
+
+def test_dump_conf():
+    from kano.conf_cache import dump_conf
+
+    conf = {'log_level': 'debug', 'output_level': 'none', 'rotate_size': 10}
+    assert dump_conf(conf) == yaml.dump(conf, default_flow_style=False)
+
+    ambiguous = {'a': 'yes', 'b': '1', 'c': '', 'd': None, 'e': [1]}
+    assert yaml.load(dump_conf(ambiguous)) == ambiguous
+
+
+def test_load_conf(tmpdir):
+    from kano.conf_cache import load_conf
+
+    path = str(tmpdir.join('test.conf'))
+    assert load_conf(path) is None
+
+    with open(path, 'w') as f:
+        f.write('log_level: debug\n')
+    assert load_conf(path) == {'log_level': 'debug'}
+
+    # callers get their own copy
+    load_conf(path)['log_level'] = 'error'
+    assert load_conf(path) == {'log_level': 'debug'}
+
+    with open(path, 'w') as f:
+        f.write('log_level: info\nlist:\n  - 1\n')
+    os.utime(path, (0, 0))
+    assert load_conf(path) == {'log_level': 'info', 'list': [1]}
+
+
+def test_logger_reload_conf(tmpdir, monkeypatch):
+    import kano.logging
+
+    conf_path = str(tmpdir.join('kano-logs.conf'))
+    with open(conf_path, 'w') as f:
+        f.write('log_level: error\noutput_level: none\n')
+
+    monkeypatch.delenv(kano.logging.LOG_ENV, raising=False)
+    monkeypatch.setenv(kano.logging.OUTPUT_ENV, 'warning')
+    monkeypatch.setattr(kano._logging, 'CONF_FILE', conf_path)
+
+    logger = kano.logging.Logger()
+    assert logger.get_log_level() == 'error'
+
+    with open(conf_path, 'w') as f:
+        f.write('log_level: debug\noutput_level: none\n')
+    os.utime(conf_path, (0, 0))
+    logger.reload_conf()
+
+    assert logger.get_log_level() == 'debug'
+    assert logger.get_output_level() == 'warning'
@@ -0,0 +1,372 @@
+#
+# test_log_reader.py
+#
+# Copyright (C) 2019 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Tests for streaming the Kano log files
+#
+
+
+import os
+import gzip
+import json
+
+import pytest
+
+
+def write_log(path, entries, compress=False):
+    opener = gzip.open if compress else open
+    with opener(path, 'wb') as f:
+        for entry in entries:
+            if isinstance(entry, dict):
+                entry = json.dumps(entry)
+            f.write('{}\n'.format(entry))
+
+
+def make_entry(time, message, level='info', pid=1):
+    return {
+        'time': time,
+        'message': message,
+        'level': level,
+        'pid': pid
+    }
+
+
+@pytest.fixture(scope='function')
+def log_dir(tmpdir):
+    return str(tmpdir)
+
+
+@pytest.fixture(scope='function')
+def new_logger_dir(log_dir, monkeypatch):
+    '''
+    Points the loggers created by the test to a temporary log dir
+    '''
+
+    import kano
+
+    monkeypatch.setenv(kano.logging.LOG_ENV, 'debug')
+    monkeypatch.setenv(kano.logging.OUTPUT_ENV, 'none')
+    monkeypatch.setattr(kano._logging, 'SYSTEM_LOGS_DIR', log_dir)
+    monkeypatch.setattr(kano._logging, 'USER_LOGS_DIR', log_dir)
+
+    return log_dir
+
+
+def test_iter_log_file_segments(log_dir):
+    from kano.log_reader import iter_log_file
+
+    log_path = os.path.join(log_dir, 'app.log')
+    write_log(
+        '{}.20190101T000000.000000.gz'.format(log_path),
+        [make_entry(1, 'one')],
+        compress=True
+    )
+    write_log(
+        '{}.20190102T000000.000000'.format(log_path),
+        [make_entry(2, 'two'), 'not json']
+    )
+    write_log(log_path, [make_entry(3, 'three'), '{"no": "time"}'])
+
+    entries = list(iter_log_file(log_path))
+
+    assert [e['message'] for e in entries] == ['one', 'two', 'three']
+    assert all(e['app_name'] == 'app' for e in entries)
+
+
+def test_merge_logs(log_dir):
+    from kano.log_reader import merge_logs
+
+    first = os.path.join(log_dir, 'first.log')
+    second = os.path.join(log_dir, 'second.log')
+    write_log(first, [make_entry(t, 'a{}'.format(t)) for t in (1, 4, 4, 6)])
+    write_log(second, [make_entry(t, 'b{}'.format(t)) for t in (2, 3, 4, 7)])
+
+    entries = list(merge_logs([first, second]))
+
+    assert [e['time'] for e in entries] == [1, 2, 3, 4, 4, 4, 6, 7]
+    assert [e['message'] for e in entries if e['time'] == 4] == \
+        ['a4', 'a4', 'b4']
+    assert entries[0]['app_name'] == 'first'
+    assert entries[1]['app_name'] == 'second'
+
+
+def test_parse_time():
+    from kano.log_reader import parse_time
+
+    now = 1550000000.0
+
+    assert parse_time('1549999000.5', now) == 1549999000.5
+    assert parse_time('10m', now) == now - 600
+    assert parse_time('2h', now) == now - 7200
+    assert parse_time('1d', now) == now - 86400
+
+    with pytest.raises(ValueError):
+        parse_time('yesterday', now)
+
+
+def test_index_seek(log_dir, monkeypatch):
+    from kano import logging
+    from kano.log_reader import iter_log_file, read_index, find_offset
+
+    monkeypatch.setattr(logging, 'INDEX_INTERVAL', 200)
+
+    log_path = os.path.join(log_dir, 'app.log')
+    write_log(log_path, [make_entry(t, 'msg {}'.format(t)) for t in xrange(100)])
+
+    assert read_index(log_path) is None
+
+    entries = list(iter_log_file(log_path, since=50, until=59.5))
+    assert [e['time'] for e in entries] == range(50, 60)
+
+    index = read_index(log_path)
+    assert index, 'The index was not saved'
+
+    # Every record before the offset must be older than the time asked for
+    offset = find_offset(log_path, 50)
+    assert offset > 0
+    with open(log_path) as f:
+        before = f.read(offset).splitlines()
+    assert all(json.loads(line)['time'] < 50 for line in before)
+
+    # A stale index is rebuilt
+    write_log(log_path, [make_entry(t, 'msg {}'.format(t)) for t in xrange(5)])
+    entries = list(iter_log_file(log_path, since=3))
+    assert [e['time'] for e in entries] == [3, 4]
+
+
+def test_until_out_of_order(log_dir):
+    ''' Records written late still come after the first one past until '''
+
+    from kano.log_reader import iter_log_file, ORDER_SLACK
+
+    log_path = os.path.join(log_dir, 'app.log')
+    times = [1, 2, 12, 3, 9, 4, 11 + ORDER_SLACK, 5]
+    write_log(log_path, [make_entry(t, 'msg {}'.format(t)) for t in times])
+
+    entries = list(iter_log_file(log_path, since=2, until=10))
+
+    assert [e['time'] for e in entries] == [2, 3, 9, 4]
+
+
+def test_logger_index(new_logger_dir, monkeypatch):
+    ''' The logger maintains the index of the log files it writes '''
+
+    import kano
+    from kano.log_reader import read_index, iter_log_file
+
+    monkeypatch.setattr(kano._logging, 'INDEX_INTERVAL', 100)
+
+    logger = kano._logging.Logger()
+    logger.set_app_name('indexed')
+    for i in xrange(20):
+        logger.error('message {}'.format(i))
+    logger.flush()
+
+    log_path = os.path.join(new_logger_dir, 'indexed.log')
+    index = read_index(log_path)
+    assert len(index) > 5
+
+    entries = list(iter_log_file(log_path, since=index[3][0] + 1e-6))
+    assert entries
+    assert entries[-1]['message'] == 'message 19'
+
+
+def append_log(path, entries):
+    with open(path, 'a') as f:
+        for entry in entries:
+            f.write('{}\n'.format(json.dumps(entry)))
+
+
+def test_log_tail(log_dir):
+    from kano.log_reader import LogTail
+
+    log_path = os.path.join(log_dir, 'app.log')
+    write_log(log_path, [make_entry(t, 'old {}'.format(t)) for t in xrange(20)])
+
+    tail = LogTail(log_path)
+    assert [e['message'] for e in tail.initial(2)] == ['old 18', 'old 19']
+    assert tail.read() == []
+
+    # Records sharing a timestamp are all picked up
+    append_log(log_path, [make_entry(30, 'new a'), make_entry(30, 'new b')])
+    assert [e['message'] for e in tail.read()] == ['new a', 'new b']
+
+    # A partially written line waits for the rest of it
+    with open(log_path, 'a') as f:
+        f.write('{"time": 31, "message": "par')
+    assert tail.read() == []
+    with open(log_path, 'a') as f:
+        f.write('tial", "level": "info", "pid": 1}\n')
+    assert [e['message'] for e in tail.read()] == ['partial']
+
+    # Rotation: the rest of the old file is read before the new one
+    append_log(log_path, [make_entry(32, 'before rotation')])
+    os.rename(log_path, log_path + '.20190101T000000.000000')
+    write_log(log_path, [make_entry(33, 'after rotation')])
+    assert [e['message'] for e in tail.read()] == \
+        ['before rotation', 'after rotation']
+
+    # Truncation
+    write_log(log_path, [make_entry(34, 'truncated')])
+    assert [e['message'] for e in tail.read()] == ['truncated']
+
+    tail.close()
+
+
+def test_log_filter():
+    from kano.log_reader import LogFilter
+
+    entry = make_entry(10, 'Connected to wlan0', level='warning', pid=42)
+    entry['network'] = 'kano'
+
+    assert LogFilter().matches(entry)
+    assert LogFilter(level='warn').matches(entry)
+    assert LogFilter(level='info').matches(entry)
+    assert not LogFilter(level='error').matches(entry)
+    assert LogFilter(pids=[1, 42]).matches(entry)
+    assert not LogFilter(pids=[1]).matches(entry)
+    assert LogFilter(since=5, until=10).matches(entry)
+    assert not LogFilter(since=11).matches(entry)
+    assert LogFilter(pattern=r'wlan\d').matches(entry)
+    assert not LogFilter(pattern=r'^wlan').matches(entry)
+    assert LogFilter(fields={'network': u'kano', 'pid': u'42'}).matches(entry)
+    assert not LogFilter(fields={'network': u'other'}).matches(entry)
+    assert not LogFilter(fields={'missing': u''}).matches(entry)
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_query_logs(log_dir, processes):
+    from kano.log_reader import LogFilter, query_logs
+
+    first = os.path.join(log_dir, 'first.log')
+    second = os.path.join(log_dir, 'second.log')
+    write_log(first, [
+        make_entry(1, 'a', level='error'),
+        make_entry(3, 'b'),
+        make_entry(5, 'c', level='error', pid=2)
+    ])
+    write_log(second, [
+        make_entry(2, 'd', level='error'),
+        make_entry(4, 'e', level='error')
+    ])
+
+    entries = list(query_logs(
+        [first, second], LogFilter(level='error'), processes=processes
+    ))
+    assert [e['message'] for e in entries] == ['a', 'd', 'e', 'c']
+    assert [e['app_name'] for e in entries] == \
+        ['first', 'second', 'second', 'first']
+
+    entries = query_logs(
+        [first, second], LogFilter(pids=[2], since=2), processes=processes
+    )
+    assert [e['message'] for e in entries] == ['c']
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_query_logs_chunks(log_dir, monkeypatch, processes):
+    ''' Logs are read a chunk at a time, every entry exactly once '''
+
+    from kano import log_reader
+    from kano.log_reader import LogFilter, query_logs, merge_logs
+
+    monkeypatch.setattr(log_reader, 'QUERY_CHUNK_SIZE', 100)
+
+    first = os.path.join(log_dir, 'first.log')
+    second = os.path.join(log_dir, 'second.log')
+    write_log(
+        '{}.20190101T000000.000000'.format(first),
+        [make_entry(t, 'a{}'.format(t)) for t in xrange(0, 20, 2)]
+    )
+    write_log(first, [make_entry(t, 'a{}'.format(t)) for t in xrange(20, 60, 2)])
+    write_log(second, [make_entry(t, 'b{}'.format(t)) for t in xrange(1, 60, 2)])
+    paths = [first, second]
+
+    entries = list(query_logs(paths, processes=processes))
+    assert [e['time'] for e in entries] == range(60)
+    assert entries == list(merge_logs(paths))
+
+    log_filter = LogFilter(since=15, until=40)
+    entries = query_logs(paths, log_filter, processes=processes)
+    assert [e['time'] for e in entries] == range(15, 41)
+
+    # Entries come before all of the logs are read
+    entries = query_logs(paths, processes=processes)
+    assert next(entries)['time'] == 0
+    entries.close()
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_count_logs(log_dir, processes):
+    from kano.log_reader import LogFilter, count_logs
+
+    first = os.path.join(log_dir, 'first.log')
+    second = os.path.join(log_dir, 'second.log')
+    write_log(first, [make_entry(1, 'a', level='error'), make_entry(2, 'b')])
+    write_log(second, [make_entry(3, 'c', level='error')])
+
+    paths = [first, second]
+    assert count_logs(paths, processes=processes) == {(): 3}
+    assert count_logs(paths, LogFilter(level='e'), processes=processes) == \
+        {(): 2}
+    assert count_logs(paths, group_by=['app_name', 'level'],
+                      processes=processes) == {
+        ('first', 'error'): 1,
+        ('first', 'info'): 1,
+        ('second', 'error'): 1
+    }
+
+
+def test_top_counter():
+    from kano.log_reader import TopCounter
+
+    counter = TopCounter(3)
+    stream = ['a'] * 10 + ['b'] * 5 + ['c', 'd', 'e'] + ['b'] * 2 + ['f']
+    for item in stream:
+        counter.add(item)
+
+    assert len(counter) == 3
+    top = counter.top(2)
+    assert top[0] == ('a', 10, 0)
+    assert top[1] == ('b', 7, 0)
+
+    # the item which took over a slot may be overestimated by its error
+    item, count, error = counter.top()[2]
+    assert item == 'f'
+    assert count - error <= stream.count('f') <= count
+
+
+def test_log_stats(log_dir):
+    from kano.log_reader import LogFilter, log_stats
+
+    first = os.path.join(log_dir, 'first.log')
+    second = os.path.join(log_dir, 'second.log')
+    write_log(first, [
+        make_entry(10, 'spam', pid=1),
+        make_entry(20, 'spam', pid=1),
+        make_entry(70, 'spam', pid=1),
+        make_entry(80, 'oops', level='error', pid=2)
+    ])
+    write_log(second, [make_entry(30, 'hello', level='debug', pid=3)])
+
+    stats = log_stats([first, second], bucket=60).to_dict(top=2)
+
+    assert stats['total'] == 5
+    assert (stats['first'], stats['last']) == (10, 80)
+    assert stats['error_rate'] == 0.2
+    assert stats['levels'] == {'info': 3, 'error': 1, 'debug': 1}
+    assert stats['apps']['first']['total'] == 4
+    assert stats['apps']['first']['error_rate'] == 0.25
+    assert stats['apps']['second']['levels'] == {'debug': 1}
+    assert [(b['time'], b['total'], b['errors']) for b in stats['buckets']] == \
+        [(0, 3, 0), (60, 2, 1)]
+    assert stats['top_messages'][0]['message'] == 'spam'
+    assert stats['top_messages'][0]['count'] == 3
+    assert len(stats['top_messages']) == 2
+    assert (stats['top_pids'][0]['app_name'], stats['top_pids'][0]['pid']) == \
+        ('first', 1)
+
+    stats = log_stats([first, second], LogFilter(level='error'))
+    assert stats.total == 1
@@ -0,0 +1,127 @@
+#
+# test_logd.py
+#
+# Copyright (C) 2019 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Tests for the log collector daemon
+#
+
+
+import os
+import json
+import threading
+
+import pytest
+
+
+@pytest.fixture(scope='function')
+def log_daemon(tmpdir, monkeypatch):
+    '''
+    Runs a log daemon serving a temporary logs dir in a thread
+    '''
+
+    import kano
+    from kano.logd import LogDaemon
+
+    logs_dir = str(tmpdir)
+    monkeypatch.setenv(kano.logging.LOG_ENV, 'debug')
+    monkeypatch.setenv(kano.logging.OUTPUT_ENV, 'none')
+    monkeypatch.setattr(kano._logging, 'SYSTEM_LOGS_DIR', logs_dir)
+    monkeypatch.setattr(kano._logging, 'USER_LOGS_DIR', logs_dir)
+
+    daemon = LogDaemon(logs_dir, flush_interval=60)
+    daemon.bind()
+
+    thread = threading.Thread(target=daemon.serve)
+    thread.start()
+
+    yield daemon
+
+    daemon.stop()
+    # wake the daemon up so that it notices
+    sock = kano._logging.connect_logd(logs_dir)
+    sock.send('wakeup\n')
+    sock.close()
+    thread.join()
+
+
+def read_entries(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_logger_uses_daemon(log_daemon):
+    import kano
+
+    logger = kano._logging.Logger()
+    logger.set_app_name('through-daemon')
+    logger.info('first')
+    logger.error('second', force_flush=True)
+
+    log_path = os.path.join(log_daemon.logs_dir, 'through-daemon.log')
+    assert logger._logd is not None, 'The logger did not find the daemon'
+
+    # The daemon has been asked to flush by now, wait for it to get there
+    for dummy in xrange(100):
+        if os.path.exists(log_path) and len(read_entries(log_path)) == 2:
+            break
+        threading.Event().wait(0.01)
+
+    assert [e['message'] for e in read_entries(log_path)] == \
+        ['first', 'second']
+
+
+def test_daemon_batches_records(tmpdir):
+    from kano.logd import LogDaemon
+
+    daemon = LogDaemon(str(tmpdir), flush_interval=60)
+    daemon.handle('app\n{"time": 1, "message": "a"}\n')
+    daemon.handle('app\n{"time": 2, "message": "b"}')
+    daemon.handle('../escape\n{"time": 3, "message": "c"}\n')
+
+    log_path = os.path.join(str(tmpdir), 'app.log')
+    assert not os.path.exists(log_path)
+
+    daemon.close()
+
+    assert [e['message'] for e in read_entries(log_path)] == ['a', 'b']
+    assert os.listdir(str(tmpdir)) == ['app.log']
+
+
+def test_daemon_rotation_reloaded(tmpdir, monkeypatch):
+    ''' The open files pick up the rotation settings of a new conf '''
+
+    import kano
+    from kano.logd import LogDaemon
+
+    daemon = LogDaemon(str(tmpdir))
+    log_file = daemon._get_log_file('app')
+
+    monkeypatch.setattr(kano.logging.logger, '_rotate_size', 1234)
+    monkeypatch.setattr(kano.logging.logger, '_rotate_count', 2)
+
+    assert daemon._get_log_file('app') is log_file
+    assert (log_file.rotate_size, log_file.rotate_count) == (1234, 2)
+
+
+def test_fallback_without_daemon(tmpdir, monkeypatch):
+    import kano
+
+    logs_dir = str(tmpdir)
+    monkeypatch.setenv(kano.logging.LOG_ENV, 'debug')
+    monkeypatch.setenv(kano.logging.OUTPUT_ENV, 'none')
+    monkeypatch.setattr(kano._logging, 'SYSTEM_LOGS_DIR', logs_dir)
+    monkeypatch.setattr(kano._logging, 'USER_LOGS_DIR', logs_dir)
+
+    # A socket left behind by a daemon that is no longer running
+    open(kano._logging.get_logd_socket_path(logs_dir), 'w').close()
+
+    logger = kano._logging.Logger()
+    logger.set_app_name('direct')
+    logger.info('message')
+    logger.flush()
+
+    assert logger._logd is None
+    entries = read_entries(os.path.join(logs_dir, 'direct.log'))
+    assert [e['message'] for e in entries] == ['message']
@@ -220,3 +220,491 @@ def test_force_flush_fns(new_logger):
 
         msgs = [a['message'] for a in entries]
         logger.check_if_messages_are_in(msgs)
+
+
+def test_buffered_write(new_logger):
+    ''' Print a message for each of the levels in buffered mode and check
+    that nothing reaches the log file until the buffer is flushed
+    '''
+
+    with new_logger() as logger:
+        logger.set_buffered(max_records=100, interval=60)
+
+        logger.error(logger.msg_err_str)
+        logger.warn(logger.msg_warn_str)
+        logger.info(logger.msg_info_str)
+        logger.debug(logger.msg_debug_str)
+
+        assert not os.path.exists(logger.log_file_path), \
+            'Buffered records were written before a flush'
+
+        logger.flush()
+
+        entries = logger.read_log_file()
+
+        msgs = [a['message'] for a in entries]
+        logger.check_if_messages_are_in(msgs)
+
+        logger.unset_buffered()
+
+
+def test_buffered_record_limit(new_logger):
+    ''' Check that the buffer is written out once the record limit is hit
+    '''
+
+    with new_logger() as logger:
+        logger.set_buffered(max_records=4, interval=60)
+
+        logger.error(logger.msg_err_str)
+        logger.warn(logger.msg_warn_str)
+        logger.info(logger.msg_info_str)
+        logger.debug(logger.msg_debug_str)
+
+        entries = logger.read_log_file()
+
+        msgs = [a['message'] for a in entries]
+        logger.check_if_messages_are_in(msgs)
+
+        logger.unset_buffered()
+
+
+def test_buffered_env(new_logger, monkeypatch):
+    ''' Enable the buffered mode through the env var and check that the
+    records are written out when the logger is flushed
+    '''
+
+    from kano import logging
+
+    monkeypatch.setenv(logging.BUFFER_ENV, '1')
+
+    with new_logger() as logger:
+        logger.error(logger.msg_err_str)
+        logger.warn(logger.msg_warn_str)
+        logger.info(logger.msg_info_str)
+        logger.debug(logger.msg_debug_str)
+
+        assert not os.path.exists(logger.log_file_path), \
+            'Buffered records were written before a flush'
+
+        logger.flush()
+
+        entries = logger.read_log_file()
+
+        msgs = [a['message'] for a in entries]
+        logger.check_if_messages_are_in(msgs)
+
+        logger.unset_buffered()
+
+
+def test_async_write(new_logger):
+    ''' Print a message for each of the levels through the background
+    writer and check that they are all in the log file after a flush
+    '''
+
+    with new_logger() as logger:
+        logger.set_async()
+
+        logger.error(logger.msg_err_str)
+        logger.warn(logger.msg_warn_str)
+        logger.info(logger.msg_info_str)
+        logger.debug(logger.msg_debug_str)
+
+        logger.flush()
+
+        entries = logger.read_log_file()
+
+        msgs = [a['message'] for a in entries]
+        logger.check_if_messages_are_in(msgs)
+
+        logger.unset_async()
+
+
+def test_async_stopped_at_exit(new_logger):
+    ''' The exit handler writes out the queued records and stops the
+    writer thread and the flush timers
+    '''
+
+    with new_logger() as logger:
+        logger.set_buffered()
+        logger.set_async()
+
+        logger.error(logger.msg_err_str)
+        writer = logger._writer
+        logger.flush()
+        timer = logger._cancelled_timers[-1]
+        logger.warn(logger.msg_warn_str)
+
+        logger._at_exit()
+
+        assert not writer.is_alive()
+        assert not timer.is_alive()
+        msgs = [a['message'] for a in logger.read_log_file()]
+        assert msgs == [logger.msg_err_str, logger.msg_warn_str]
+
+
+def test_async_queue_full_drop(new_logger):
+    ''' Fill the queue of a stalled writer and check that the records which
+    did not fit are counted and reported once the writer catches up
+    '''
+
+    from kano import logging
+
+    with new_logger() as logger:
+        logger.set_async(queue_size=2, policy=logging.QUEUE_FULL_DROP)
+
+        import threading
+        started = threading.Event()
+        release = threading.Event()
+
+        class StallingMessage(str):
+            def strip(self):
+                started.set()
+                release.wait()
+                return str.strip(self)
+
+        # Stall the writer so that the queue fills up
+        logger.info(StallingMessage(logger.msg_info_str))
+        started.wait()
+
+        logger.warn(logger.msg_warn_str)
+        logger.warn(logger.msg_warn_str)
+        logger.error(logger.msg_err_str)
+        logger.debug(logger.msg_debug_str)
+
+        release.set()
+        logger.flush()
+
+        assert logger.get_dropped_count() >= 2
+
+        entries = logger.read_log_file()
+        dropped = [a for a in entries if 'dropped' in a]
+        assert dropped, 'The dropped records were not reported'
+
+        logger.unset_async()
+
+
+def test_rotation(new_logger):
+    ''' Write enough to rotate the log file several times and check that
+    old segments are compressed, pruned and still read back
+    '''
+
+    import threading
+    from kano import logging
+
+    with new_logger() as logger:
+        logger._rotate_size = 1024
+        logger._rotate_count = 2
+
+        for i in xrange(60):
+            logger.error('{} {}'.format(logger.msg_err_str, i))
+
+        logger.flush()
+        for thread in threading.enumerate():
+            if thread.name == 'kano-logging-compress':
+                thread.join()
+
+        segments = logging.get_log_segments(logger.log_file_path)
+        assert len(segments) == 3, 'Rotated segments were not pruned'
+        assert segments[0].endswith('.gz'), 'Old segments were not compressed'
+        assert not segments[1].endswith('.gz'), \
+            'The newest segment should be compressed on the next rotation'
+        assert segments[-1] == logger.log_file_path
+
+        msgs = [a['message'] for a in logger.read_log_file()]
+        assert msgs[-1] == '{} {}'.format(logger.msg_err_str, 59)
+        assert msgs == sorted(msgs, key=lambda m: int(m.split()[-1])), \
+            'Segments were not read in order'
+
+
+def test_disabled_calls_are_not_formatted(new_logger):
+    ''' Messages given as callables or with arguments are only built when
+    the record is written somewhere
+    '''
+
+    calls = []
+
+    def build_msg():
+        calls.append(True)
+        return 'built'
+
+    with new_logger(log_level='error', output_level='none') as logger:
+        logger.debug(build_msg)
+        logger.info(build_msg)
+        logger.warn('{} {}', build_msg, build_msg)
+
+        assert not calls, 'A disabled log call built its message'
+
+        logger.error(build_msg)
+        logger.error('{} number {}', 'message', 2)
+        logger.flush()
+
+        assert calls == [True]
+
+        msgs = [a['message'] for a in logger.read_log_file()]
+        assert msgs == ['built', 'message number 2']
+
+
+def test_forced_level_enables_calls(new_logger):
+    ''' Forcing the log level updates the precomputed threshold
+    '''
+
+    with new_logger(log_level='none', output_level='none') as logger:
+        logger.debug(logger.msg_debug_str)
+
+        logger.force_log_level('debug')
+        logger.debug(logger.msg_debug_str, force_flush=True)
+
+        msgs = [a['message'] for a in logger.read_log_file()]
+        assert msgs == [logger.msg_debug_str]
+
+
+def test_suppress_repeats(new_logger):
+    ''' Identical consecutive records are collapsed into one with a repeat
+    count
+    '''
+
+    with new_logger(output_level='none') as logger:
+        logger.set_suppress_repeats()
+
+        for dummy in xrange(5):
+            logger.error('Failed to parse')
+        logger.error('Failed to parse', interface='wlan0')
+        logger.info('Something else')
+        logger.info('Something else')
+        logger.flush()
+
+        entries = logger.read_log_file()
+
+        assert [(e['message'], e.get('repeat')) for e in entries] == [
+            ('Failed to parse', None),
+            ('Failed to parse', 4),
+            ('Failed to parse', None),
+            ('Something else', None),
+            ('Something else', 1)
+        ]
+        assert entries[2]['interface'] == 'wlan0'
+
+        logger.unset_suppress_repeats()
+
+
+def test_suppress_repeats_at_exit(new_logger, monkeypatch):
+    ''' The pending repeat count is written out when the process exits
+    '''
+
+    import atexit
+
+    handlers = []
+    monkeypatch.setattr(atexit, 'register', handlers.append)
+
+    with new_logger(output_level='none') as logger:
+        logger.set_suppress_repeats()
+
+        for dummy in xrange(5):
+            logger.error('Failed to parse')
+
+        assert handlers
+        for handler in handlers:
+            handler()
+
+        entries = logger.read_log_file()
+        assert [e.get('repeat') for e in entries] == [None, 4]
+
+
+def test_rate_limit_per_level(new_logger, monkeypatch):
+    ''' Records over the rate limit are dropped and counted on the next
+    record let through
+    '''
+
+    import kano
+
+    now = [1000.0]
+    monkeypatch.setattr(kano._logging.time, 'time', lambda: now[0])
+
+    with new_logger(output_level='none') as logger:
+        logger.set_rate_limit(1, burst=2)
+
+        for index in xrange(5):
+            logger.error('error {}', index)
+        logger.info('info')
+
+        now[0] += 1
+        logger.error('error after a second')
+        logger.flush()
+
+        entries = logger.read_log_file()
+
+        assert [e['message'] for e in entries] == \
+            ['error 0', 'error 1', 'info', 'error after a second']
+        assert entries[-1]['rate_limited'] == 3
+        assert logger.get_rate_limited_count() == 3
+
+        logger.unset_rate_limit()
+
+
+def test_rate_limit_per_call_site(new_logger):
+    ''' Each line logging gets its own rate limit
+    '''
+
+    import kano
+
+    with new_logger(output_level='none') as logger:
+        logger.set_rate_limit(0.001, burst=1,
+                              scope=kano.logging.RATE_LIMIT_CALL_SITE)
+
+        for index in xrange(3):
+            logger.error('first site {}', index)
+            logger.error('second site {}', index)
+        logger.flush()
+
+        msgs = [e['message'] for e in logger.read_log_file()]
+        assert msgs == ['first site 0', 'second site 0']
+
+        logger.unset_rate_limit()
+
+
+def test_flight_recorder(new_logger):
+    ''' Records below the log level are kept in memory and written out on
+    demand, the last ones only
+    '''
+
+    with new_logger(log_level='error', output_level='none') as logger:
+        logger.set_flight_recorder(3)
+
+        logger.debug('debug {}', 1)
+        logger.info(lambda: 'info 2')
+        logger.error('error 3')
+        logger.warn('warning 4')
+        logger.debug('debug 5', interface='wlan0')
+        logger.info('info 6')
+        logger.flush()
+
+        msgs = [e['message'] for e in logger.read_log_file()]
+        assert msgs == ['error 3']
+
+        assert logger.dump_flight_recorder() == 3
+        entries = logger.read_log_file()[1:]
+        assert [e['message'] for e in entries] == \
+            ['warning 4', 'debug 5', 'info 6']
+        assert [e['level'] for e in entries] == ['warning', 'debug', 'info']
+        assert entries[1]['interface'] == 'wlan0'
+        assert all(e['flight_recorder'] for e in entries)
+
+        assert logger.dump_flight_recorder() == 0
+
+        logger.unset_flight_recorder()
+        logger.debug('not recorded')
+        assert logger.dump_flight_recorder() == 0
+
+
+def test_flight_recorder_buffered_async(new_logger):
+    ''' Dumping the flight recorder while the background writer has
+    buffered records to write mustn't deadlock
+    '''
+
+    import time
+    import threading
+
+    with new_logger(log_level='error') as logger:
+        logger.set_buffered()
+        logger.set_async()
+        logger.set_flight_recorder(50)
+
+        started = threading.Event()
+        release = threading.Event()
+
+        class StallingMessage(str):
+            def strip(self):
+                started.set()
+                release.wait()
+                return str.strip(self)
+
+        logger.debug(logger.msg_debug_str)
+        # Stall the writer just before it writes the record
+        logger.error(StallingMessage(logger.msg_err_str))
+        started.wait()
+
+        dump = threading.Thread(target=logger.dump_flight_recorder)
+        dump.daemon = True
+        dump.start()
+        time.sleep(0.2)
+        release.set()
+
+        dump.join(5)
+        assert not dump.is_alive(), 'dump_flight_recorder() is stuck'
+
+        logger.flush()
+        entries = logger.read_log_file()
+        assert [(e['level'], 'flight_recorder' in e) for e in entries] == [
+            ('error', False), ('debug', True)
+        ]
+
+        logger.unset_async()
+
+
+def test_flight_recorder_excepthook(new_logger, monkeypatch):
+    ''' The excepthook writes out the flight recorder along with the
+    unhandled exception, even when logging is off
+    '''
+
+    import kano
+
+    with new_logger(log_level='none', output_level='none') as logger:
+        logger.set_flight_recorder()
+        monkeypatch.setattr(kano._logging, 'logger', logger)
+        monkeypatch.setattr(sys, '__excepthook__', lambda *args: None)
+
+        logger.info('about to fail')
+        try:
+            raise ValueError('oops')
+        except ValueError:
+            kano._logging.log_excepthook(*sys.exc_info())
+
+        entries = logger.read_log_file()
+        assert [e['level'] for e in entries] == ['info', 'error']
+        assert entries[0]['message'] == 'about to fail'
+        assert 'oops' in entries[1]['message']
+
+
+def test_reload_conf(new_logger, monkeypatch):
+    ''' A reload sets the features back to what the configuration says,
+    turning off the ones it no longer mentions
+    '''
+
+    import kano
+
+    conf = {
+        'suppress_repeats': True,
+        'rate_limit': 5,
+        'flight_recorder': 10,
+        'rotate_size': 1000
+    }
+    monkeypatch.setattr(kano._logging, 'load_conf', lambda path: dict(conf))
+    monkeypatch.delenv(kano._logging.FLIGHT_RECORDER_ENV, raising=False)
+
+    with new_logger() as logger:
+        assert logger._suppress_repeats
+        assert logger._rate_limit == 5
+        assert logger._recorder_size == 10
+
+        logger.info('opens the log file')
+        logger.flush()
+        assert logger._log_file.rotate_size == 1000
+
+        # The recorder keeps its records when its size doesn't change
+        slots = logger._recorder_msgs
+        conf['rotate_size'] = 2000
+        logger.reload_conf()
+        assert logger._recorder_msgs is slots
+        assert logger._log_file.rotate_size == 2000
+
+        conf.clear()
+        logger.reload_conf()
+        assert not logger._suppress_repeats
+        assert logger._rate_limit == 0
+        assert logger._recorder_size == 0
+        assert logger._log_file.rotate_size == kano._logging.ROTATE_SIZE
+
+        # The environment still takes precedence
+        monkeypatch.setenv(kano._logging.FLIGHT_RECORDER_ENV, '20')
+        logger.reload_conf()
+        assert logger._recorder_size == 20
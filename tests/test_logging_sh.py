@@ -0,0 +1,110 @@
+#
+# test_logging_sh.py
+#
+# Copyright (C) 2019 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Tests for the bash logging functions in bash/logging.sh
+#
+
+
+import os
+import re
+import sys
+import json
+import time
+import subprocess
+
+import pytest
+
+
+LOGGING_SH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'bash', 'logging.sh'
+)
+
+
+def run_bash(script, args=(), **env):
+    '''
+    Runs script with args after sourcing logging.sh, with env added to the
+    environment, and returns what it printed
+    '''
+
+    full_env = dict(os.environ)
+    for key in ('LOG_LEVEL', 'OUTPUT_LEVEL', 'SUDO_USER'):
+        full_env.pop(key, None)
+    full_env.update(env)
+
+    return subprocess.check_output(
+        ['bash', '-c', '. "$0"\n' + script, LOGGING_SH] + list(args),
+        env=full_env
+    )
+
+
+def test_env_over_conf(tmpdir):
+    conf = tmpdir.join('kano-logs.conf')
+    conf.write('log_level: error\noutput_level: debug\n')
+
+    output = run_bash(
+        'set_log_envs "$1"; echo "$LOG_LEVEL $OUTPUT_LEVEL"', [str(conf)],
+        LOG_LEVEL='info'
+    )
+
+    assert output.split() == ['info', 'debug']
+
+
+@pytest.mark.parametrize('sudo_user', [None, 'root', 'nobody', 'no-such-user'])
+def test_logs_dir(sudo_user):
+    ''' The logs go where kano.logging puts them '''
+
+    env = {'SUDO_USER': sudo_user} if sudo_user else {}
+
+    bash_dir = run_bash('echo "$_klog_dir"', **env).strip()
+
+    python_env = dict(os.environ)
+    python_env.pop('SUDO_USER', None)
+    python_env.update(env)
+    python_dir = subprocess.check_output([
+        sys.executable, '-c',
+        'import kano._logging as l; print l.get_logs_dir()'
+    ], env=python_env).strip()
+
+    assert os.path.normpath(bash_dir) == os.path.normpath(python_dir)
+
+
+def test_logs_dir_created(tmpdir):
+    logs_dir = os.path.join(str(tmpdir), 'logs')
+
+    run_bash(
+        '_klog_dir="$1"; logger_set_app_name app; logger_error "$2"',
+        [logs_dir, 'it\'s "bad"'], LOG_LEVEL='error', OUTPUT_LEVEL='none'
+    )
+
+    with open(os.path.join(logs_dir, 'app.log')) as f:
+        entries = [json.loads(line) for line in f]
+
+    assert [e['message'] for e in entries] == ['it\'s "bad"']
+    assert entries[0]['level'] == 'error'
+
+
+def test_time():
+    output = run_bash('_klog_now; echo "$_klog_time"')
+    assert re.match(r'^\d+\.\d{6}$', output.strip())
+    assert abs(float(output) - time.time()) < 5
+
+    # Without EPOCHREALTIME, as on bash < 5, only whole seconds
+    output = run_bash('unset EPOCHREALTIME; _klog_now; echo "$_klog_time"')
+    assert re.match(r'^\d+$', output.strip())
+    assert abs(float(output) - time.time()) < 5
+
+
+def test_logging_py_bare_name(tmpdir):
+    ''' logging_py.sh finds logging.sh when sourced from its own dir '''
+
+    bash_dir = os.path.dirname(LOGGING_SH)
+    output = subprocess.check_output(
+        ['bash', '-c', '. logging_py.sh; type -t logger_log_msg'],
+        cwd=bash_dir
+    )
+
+    assert output.strip() == 'function'
@@ -0,0 +1,83 @@
+#
+# test_meminfo.py
+#
+# Copyright (C) 2019 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Tests for the memory accounting of profiling timepoints
+#
+
+
+import gc
+
+import kano.meminfo
+from kano.meminfo import read_memory_usage, MemorySnapshot
+
+
+def test_read_memory_usage():
+    usage = read_memory_usage()
+
+    assert set(usage) == set(['rss_kb', 'pss_kb', 'swap_kb'])
+    assert usage['rss_kb'] > 0
+    assert 0 < usage['pss_kb'] <= usage['rss_kb']
+
+
+def test_read_memory_usage_fallback(tmpdir, monkeypatch):
+    smaps = tmpdir.join('smaps')
+    smaps.write(
+        '00400000-00401000 r-xp 00000000 08:01 1 /usr/bin/python\n'
+        'Size:                  4 kB\n'
+        'Rss:                   4 kB\n'
+        'Pss:                   2 kB\n'
+        'Swap:                  0 kB\n'
+        'SwapPss:               0 kB\n'
+        '00600000-00700000 rw-p 00000000 00:00 0 [heap]\n'
+        'Rss:                 100 kB\n'
+        'Pss:                 100 kB\n'
+        'Swap:                 12 kB\n'
+    )
+    monkeypatch.setattr(kano.meminfo, 'SMAPS_ROLLUP', str(tmpdir.join('none')))
+    monkeypatch.setattr(kano.meminfo, 'SMAPS', str(smaps))
+
+    assert read_memory_usage() == {'rss_kb': 104, 'pss_kb': 102, 'swap_kb': 12}
+
+    status = tmpdir.join('status')
+    status.write('Name:\tpython\nVmRSS:\t  2048 kB\n')
+    monkeypatch.setattr(kano.meminfo, 'SMAPS', str(tmpdir.join('none')))
+    monkeypatch.setattr(kano.meminfo, 'STATUS', str(status))
+
+    assert read_memory_usage() == {'rss_kb': 2048}
+
+
+def test_memory_snapshot():
+    snapshot = MemorySnapshot()
+    # above the largest mmap threshold of glibc, so it can't reuse pages
+    # freed by earlier tests
+    data = 'x' * (40 * 1024 * 1024)
+    delta = snapshot.delta()
+
+    assert delta['rss_kb'] >= 40 * 1024 - 256
+    assert 'top_allocations' not in delta
+    assert 'gc_count' not in delta
+    del data
+
+
+def test_memory_snapshot_gc():
+    ''' Only actual collections are reported, where they can be counted '''
+
+    snapshot = MemorySnapshot()
+    gc.collect()
+    cycles = [[] for dummy in xrange(100)]
+    for cycle in cycles:
+        cycle.append(cycle)
+    del cycles, cycle
+    delta = snapshot.delta()
+
+    if hasattr(gc, 'get_stats'):
+        assert delta['gc_collections'][2] >= 1
+        assert len(delta['gc_collected']) == 3
+    else:
+        # the cycles left behind are collected at the end
+        assert 'gc_collections' not in delta
+        assert delta['gc_garbage'] >= 100
+        assert delta['gc_collect_time'] >= 0
@@ -0,0 +1,212 @@
+#
+# test_profiling.py
+#
+# Copyright (C) 2019 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Tests for the profiling timepoints
+#
+
+
+import os
+import pstats
+
+import pytest
+
+from kano.tracer import TraceWriter, read_trace_file
+
+
+def busy_outer():
+    return sum(xrange(1000))
+
+
+def busy_inner():
+    return sum(xrange(1000))
+
+
+@pytest.fixture(scope='function')
+def profiling(tmpdir, monkeypatch):
+    '''
+    Enables profiling for the "outer" and "inner" timepoints of the test,
+    returning the paths of their stat files
+    '''
+
+    import kano.profiling
+    import kano.profiling_late
+
+    stats = {
+        name: str(tmpdir.join('{}.prof'.format(name)))
+        for name in ('outer', 'inner')
+    }
+    conf = {
+        'test-app': {
+            name: {'python': {'statfile': path}}
+            for name, path in stats.iteritems()
+        }
+    }
+    conf['test-app']['timed'] = {}
+    conf['test-app']['measured'] = {'memory': {'top': 5}}
+    conf['test-app']['sampled'] = {
+        'sampling': {
+            'statfile': str(tmpdir.join('sampled.folded')),
+            'rate': 500
+        }
+    }
+
+    monkeypatch.setattr(kano.profiling, 'isConf', True)
+    monkeypatch.setattr(kano.profiling, 'conf_loaded', True)
+    monkeypatch.setattr(kano.profiling_late, 'conf', conf)
+    monkeypatch.setattr(kano.profiling_late, 'app_name', 'test-app')
+    monkeypatch.setattr(kano.profiling_late, 'active_points', [])
+    monkeypatch.setattr(
+        kano.profiling_late, 'tracer',
+        TraceWriter(str(tmpdir.join('test-app.ktrace')), 'test-app')
+    )
+
+    return stats
+
+
+class Leak(object):
+    pass
+
+
+def get_profiled_functions(statfile):
+    return set(func[2] for func in pstats.Stats(statfile).stats)
+
+
+def test_nested_timepoints(profiling):
+    from kano.profiling import declare_timepoint
+    import kano.profiling_late
+
+    declare_timepoint('outer', True)
+    busy_outer()
+
+    declare_timepoint('inner', True)
+    busy_inner()
+    declare_timepoint('inner', False)
+
+    busy_outer()
+    declare_timepoint('outer', False)
+
+    assert not kano.profiling_late.active_points
+
+    inner = get_profiled_functions(profiling['inner'])
+    outer = get_profiled_functions(profiling['outer'])
+    assert 'busy_inner' in inner and 'busy_outer' not in inner
+    assert 'busy_outer' in outer and 'busy_inner' not in outer
+
+
+def test_overlapping_timepoints(profiling):
+    from kano.profiling import declare_timepoint
+    import kano.profiling_late
+
+    declare_timepoint('outer', True)
+    declare_timepoint('inner', True)
+    declare_timepoint('outer', False)
+    busy_inner()
+    declare_timepoint('inner', False)
+
+    assert not kano.profiling_late.active_points
+    assert os.path.exists(profiling['outer'])
+    assert 'busy_inner' in get_profiled_functions(profiling['inner'])
+
+
+def test_timepoint_timings(profiling, monkeypatch):
+    from kano.profiling import timepoint
+    import kano.profiling_late
+
+    ended = []
+    end_timepoint = kano.profiling_late.end_timepoint
+
+    def record_end(name):
+        point = end_timepoint(name)
+        ended.append(point)
+        return point
+
+    monkeypatch.setattr(kano.profiling_late, 'end_timepoint', record_end)
+
+    @timepoint('timed')
+    def timed():
+        with timepoint('untimed'):
+            busy_inner()
+
+    timed()
+
+    assert [point.name for point in ended] == ['untimed', 'timed']
+    assert all(point.wall_time >= 0 for point in ended)
+    assert ended[0].wall_time <= ended[1].wall_time
+    assert all(point.profile is None for point in ended)
+
+
+def test_timepoint_trace(profiling, tmpdir):
+    from kano.profiling import timepoint, trace_instant
+
+    with timepoint('outer'):
+        trace_instant('mark', step=1)
+
+    dummy, dummy, events = read_trace_file(str(tmpdir.join('test-app.ktrace')))
+
+    assert [(e['phase'], e['name']) for e in events] == [
+        ('B', 'outer'), ('i', 'mark'), ('E', 'outer')
+    ]
+    assert events[1]['args'] == {'step': 1}
+    assert set(events[2]['args']) == set(['wall_time', 'cpu_time'])
+
+
+def test_sampled_timepoint(profiling, tmpdir):
+    from kano.profiling import timepoint
+    from kano.sampler import sampler
+
+    with timepoint('sampled'):
+        end = sum(os.times()[:2]) + 0.1
+        while sum(os.times()[:2]) < end:
+            busy_inner()
+
+    assert sampler.interval is None
+
+    with open(str(tmpdir.join('sampled.folded'))) as f:
+        stacks = [line.rsplit(' ', 1)[0] for line in f]
+
+    assert stacks
+    assert any('busy_inner (' in stack for stack in stacks)
+    assert all('test_sampled_timepoint (' in stack for stack in stacks)
+
+
+def test_memory_timepoint(profiling, tmpdir, monkeypatch):
+    from kano.profiling import timepoint
+    import kano.profiling_late
+
+    records = []
+    monkeypatch.setattr(
+        kano.profiling_late.logger, 'debug',
+        lambda msg, **kwargs: records.append(kwargs)
+    )
+
+    with timepoint('measured'):
+        kept = [Leak() for dummy in xrange(1000)]
+        kept.append('x' * (40 * 1024 * 1024))
+
+    memory = records[-1]['memory']
+    assert memory['rss_kb'] >= 40 * 1024 - 256
+    assert memory['pss_kb'] > 0
+    assert memory['top_allocations'][0] == 'Leak: +1000'
+
+    dummy, dummy, events = read_trace_file(str(tmpdir.join('test-app.ktrace')))
+    counters = [e for e in events if e['phase'] == 'C']
+    assert [e['name'] for e in counters] == ['memory', 'memory']
+    assert counters[1]['args']['rss_kb'] - counters[0]['args']['rss_kb'] == \
+        memory['rss_kb']
+    assert [e['args'] for e in events if e['name'] == 'measured memory'] == [
+        {'rss_kb': memory['rss_kb'], 'pss_kb': memory['pss_kb']}
+    ]
+
+
+def test_timepoint_without_conf(monkeypatch):
+    import kano.profiling
+
+    monkeypatch.setattr(kano.profiling, 'isConf', False)
+
+    def func():
+        pass
+
+    assert kano.profiling.timepoint('point')(func) is func
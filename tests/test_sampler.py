@@ -0,0 +1,77 @@
+#
+# test_sampler.py
+#
+# Copyright (C) 2019 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Tests for the sampling profiler
+#
+
+
+import os
+import signal
+import threading
+from collections import Counter
+
+from kano.sampler import Sampler, fold_stack, write_folded
+
+
+def spin(seconds):
+    end = sum(os.times()[:2]) + seconds
+    while sum(os.times()[:2]) < end:
+        pass
+
+
+def test_fold_stack():
+    import sys
+
+    def inner():
+        return fold_stack(sys._getframe(), 'main')
+
+    stack = inner().split(';')
+
+    assert stack[0] == 'main'
+    assert stack[-1].startswith('inner (')
+    assert stack[-2].startswith('test_fold_stack ({}:'.format(__file__.rstrip('c')))
+
+
+def test_sampler(tmpdir):
+    sampler = Sampler()
+    samples = Counter()
+
+    sampler.add_sink(samples, 0.002)
+    assert sampler.interval == 0.002
+    spin(0.2)
+    sampler.remove_sink(samples)
+
+    assert sampler.interval is None
+    assert signal.getitimer(signal.ITIMER_PROF) == (0.0, 0.0)
+    assert signal.getsignal(signal.SIGPROF) == signal.SIG_IGN
+
+    assert sum(samples.values()) > 10
+    assert all('spin (' in stack for stack in samples)
+
+    path = str(tmpdir.join('samples.folded'))
+    write_folded(samples, path)
+    with open(path) as f:
+        lines = f.read().splitlines()
+
+    assert len(lines) == len(samples)
+    assert all(line.rsplit(' ', 1)[1].isdigit() for line in lines)
+
+
+def test_sampler_threads():
+    sampler = Sampler()
+    samples = Counter()
+    stop = threading.Event()
+    thread = threading.Thread(target=stop.wait, name='waiter')
+    thread.start()
+
+    sampler.add_sink(samples, 0.002, threads=True)
+    spin(0.1)
+    sampler.remove_sink(samples)
+    stop.set()
+    thread.join()
+
+    assert any(stack.startswith('waiter;') for stack in samples)
+    assert any(stack.startswith('MainThread;') for stack in samples)
@@ -0,0 +1,245 @@
+#
+# test_shell.py
+#
+# Copyright (C) 2019 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Tests for running commands
+#
+
+
+import os
+import time
+import signal
+import threading
+
+from kano.utils.shell import run_argv, run_cmd, get_c_env, run_cmds, \
+    iter_cmds, stream_cmd, ShellWorker
+
+
+def test_run_argv():
+    out, err, rc = run_argv(['printf', '%s\\n', 'a b', '$HOME', '"quoted"'])
+
+    assert (out, err, rc) == ('a b\n$HOME\n"quoted"\n', '', 0)
+
+
+def test_run_argv_return_code():
+    out, err, rc = run_argv(['sh', '-c', 'echo oops >&2; exit 3'])
+    assert (out, err, rc) == ('', 'oops\n', 3)
+
+    out, err, rc = run_argv(['kano-no-such-program'])
+    assert out == ''
+    assert err.startswith('kano-no-such-program: ')
+    assert rc == 127
+
+
+def test_run_argv_locale(monkeypatch):
+    monkeypatch.setenv('LC_ALL', 'en_GB.UTF-8')
+
+    out, dummy, dummy = run_argv(['sh', '-c', 'echo $LC_ALL'])
+    assert out == 'C\n'
+
+    out, dummy, dummy = run_argv(['sh', '-c', 'echo $LC_ALL'], localised=True)
+    assert out == 'en_GB.UTF-8\n'
+
+
+def test_c_env_cache(monkeypatch):
+    env = get_c_env()
+    assert get_c_env() is env
+    assert env['LC_ALL'] == 'C'
+
+    monkeypatch.setenv('KANO_TEST_SHELL', '1')
+    env = get_c_env()
+    assert env['KANO_TEST_SHELL'] == '1'
+    assert get_c_env() is env
+
+
+def test_signals_restored():
+    # python ignores SIGPIPE, the commands it runs shouldn't
+    assert signal.getsignal(signal.SIGPIPE) == signal.SIG_IGN
+    sigpipe = 1 << (signal.SIGPIPE - 1)
+
+    for out, dummy, dummy in (
+        run_argv(['grep', 'SigIgn', '/proc/self/status']),
+        run_cmd('grep SigIgn /proc/self/status')
+    ):
+        ignored = int(out.split()[1], 16)
+        assert not ignored & sigpipe
+
+
+def test_run_cmds():
+    start = time.time()
+    results = run_cmds([
+        'sleep 0.3; echo first',
+        ['sh', '-c', 'echo second >&2; exit 2'],
+        ['kano-no-such-program'],
+        'sleep 0.3; echo $LC_ALL'
+    ])
+
+    assert time.time() - start < 0.55
+    assert results[0] == ('first\n', '', 0)
+    assert results[1] == ('', 'second\n', 2)
+    assert results[2][2] == 127
+    assert results[3] == ('C\n', '', 0)
+
+
+def test_iter_cmds_as_completed():
+    commands = ['sleep 0.4; echo slow', 'echo fast', 'sleep 0.2; echo mid']
+    indexes = [index for index, result in iter_cmds(commands)]
+
+    assert indexes == [1, 2, 0]
+
+
+def test_run_cmds_max_workers():
+    start = time.time()
+    run_cmds(['sleep 0.2'] * 4, max_workers=2)
+
+    assert time.time() - start >= 0.4
+
+
+def test_run_cmds_timeout():
+    start = time.time()
+    results = run_cmds(
+        # the sleeps inherit the pipes, so the whole group has to be killed
+        ['sleep 5 | cat', 'echo done', ['sleep', '5'], 'echo late'],
+        max_workers=3, timeout=0.3
+    )
+
+    assert time.time() - start < 2
+    assert results[0][2] == -signal.SIGKILL
+    assert results[1] == ('done\n', '', 0)
+    assert results[2][2] == -signal.SIGKILL
+    assert results[3] == ('late\n', '', 0)
+
+
+def test_run_cmd_timeout():
+    start = time.time()
+    # the sleep started by the shell holds stdout open, it has to go too
+    out, err, rc = run_cmd('echo started; sleep 5; echo done', timeout=0.3)
+
+    assert time.time() - start < 2
+    assert (out, rc) == ('started\n', -signal.SIGKILL)
+
+    assert run_argv(['echo', 'quick'], timeout=5) == ('quick\n', '', 0)
+
+
+def test_stream_cmd():
+    stream = stream_cmd('echo one; sleep 0.2; echo two >&2; echo three',
+                        merge_stderr=True)
+    start = time.time()
+
+    assert next(stream) == 'one\n'
+    assert time.time() - start < 0.15
+    assert list(stream) == ['two\n', 'three\n']
+    assert stream.returncode == 0
+
+
+def test_stream_cmd_long_line(monkeypatch):
+    monkeypatch.setattr('kano.utils.shell.MAX_LINE_LENGTH', 4)
+
+    assert list(stream_cmd(['printf', 'abcdefghij\nk'])) == \
+        ['abcd', 'efgh', 'ij\n', 'k']
+
+
+def test_stream_cmd_interactive():
+    with stream_cmd(['cat']) as stream:
+        stream.send('hello\n')
+        assert next(stream) == 'hello\n'
+
+    # stdin was closed, so cat was done
+    assert stream.returncode in (0, -signal.SIGTERM)
+    assert not stream.timed_out
+
+
+def test_stream_cmd_timeout():
+    start = time.time()
+    stream = stream_cmd('echo started; sleep 5 | cat', timeout=0.3)
+
+    assert list(stream) == ['started\n']
+    assert time.time() - start < 2
+    assert stream.timed_out
+    assert stream.returncode == -signal.SIGKILL
+
+
+def test_shell_worker():
+    worker = ShellWorker()
+
+    assert worker.run('echo one; echo two >&2; exit 3') == \
+        ('one\n', 'two\n', 3)
+    assert worker.run('printf "no newline"') == ('no newline', '', 0)
+    assert worker.run('echo $LC_ALL') == ('C\n', '', 0)
+
+    # commands can't change the worker
+    worker.run('cd /; KANO_TEST_SHELL=1')
+    assert worker.run('echo "$KANO_TEST_SHELL"; pwd')[0] == \
+        '\n{}\n'.format(os.getcwd())
+
+    # a syntax error doesn't get the markers lost
+    out, err, rc = worker.run('echo "unbalanced')
+    assert (out, rc) == ('', 2)
+    assert worker.run('echo still here') == ('still here\n', '', 0)
+
+    worker.stop()
+
+
+def test_shell_worker_run_argv():
+    out, err, rc = run_argv(['printf', '%s\\n', 'a b', '$HOME', "it's"],
+                            worker=True)
+    assert (out, err, rc) == ('a b\n$HOME\nit\'s\n', '', 0)
+
+    out, err, rc = run_argv(['kano-no-such-program'], worker=True)
+    assert rc == 127
+
+    assert run_cmd('echo one | tr o 0', worker=True) == ('0ne\n', '', 0)
+
+
+def test_shell_worker_restarts():
+    worker = ShellWorker()
+    worker.run('true')
+    pid = worker._process.pid
+
+    os.kill(pid, signal.SIGKILL)
+    worker._process.wait()
+    assert worker.run('echo again') == ('again\n', '', 0)
+    assert worker._process.pid != pid
+
+    # killed while running a command
+    out, err, rc = worker.run('echo before; kill -9 $$; sleep 5')
+    assert out == 'before\n'
+    assert rc == -signal.SIGKILL
+    assert worker.run('echo again') == ('again\n', '', 0)
+
+    worker.stop()
+
+
+def test_shell_worker_timeout():
+    worker = ShellWorker()
+
+    start = time.time()
+    out, err, rc = worker.run('echo started; sleep 5', timeout=0.3)
+
+    assert time.time() - start < 2
+    assert (out, rc) == ('started\n', -signal.SIGKILL)
+    assert worker.run('echo again') == ('again\n', '', 0)
+
+    worker.stop()
+
+
+def test_shell_worker_threads():
+    worker = ShellWorker()
+    results = {}
+
+    def run(index):
+        results[index] = worker.run('echo {}; echo {} >&2'.format(index, -index))
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in xrange(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == {
+        i: ('{}\n'.format(i), '{}\n'.format(-i), 0) for i in xrange(8)
+    }
+
+    worker.stop()
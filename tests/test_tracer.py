@@ -0,0 +1,108 @@
+#
+# test_tracer.py
+#
+# Copyright (C) 2019 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Tests for the timeline recorded while profiling
+#
+
+
+import os
+import threading
+
+import pytest
+
+from kano.tracer import TraceWriter, read_trace_file, to_chrome_trace, \
+    get_trace_path
+
+
+@pytest.fixture(scope='function')
+def trace_path(tmpdir):
+    return get_trace_path(str(tmpdir), 'test-app', os.getpid())
+
+
+def test_trace_events(trace_path):
+    writer = TraceWriter(trace_path, 'test-app')
+    writer.event('B', 'load', timestamp=10.0)
+    writer.event('i', u'caf\xe9', {'step': 1}, timestamp=10.5)
+    writer.event('E', 'load', {'wall_time': 1.0}, timestamp=11.0)
+    writer.close()
+
+    app_name, pid, events = read_trace_file(trace_path)
+
+    assert app_name == 'test-app'
+    assert pid == os.getpid()
+    assert [(e['phase'], e['name'], e['args']) for e in events] == [
+        ('B', 'load', {}),
+        ('i', u'caf\xe9', {'step': 1}),
+        ('E', 'load', {'wall_time': 1.0})
+    ]
+    assert events[0]['time'] == 10.0
+    assert events[0]['tid'] == os.getpid()
+
+
+def test_trace_ring(trace_path):
+    writer = TraceWriter(trace_path, 'test-app', capacity=4)
+    for i in xrange(10):
+        writer.event('i', str(i), timestamp=i)
+
+    dummy, dummy, events = read_trace_file(trace_path)
+
+    assert [e['name'] for e in events] == ['6', '7', '8', '9']
+    assert os.path.getsize(trace_path) == 64 + 4 * 128
+
+
+def test_trace_threads(trace_path):
+    writer = TraceWriter(trace_path, 'test-app')
+    thread = threading.Thread(target=writer.event, args=('i', 'thread'))
+    thread.start()
+    thread.join()
+
+    dummy, dummy, events = read_trace_file(trace_path)
+
+    assert events[0]['tid'] == thread.ident & 0xffffffff
+    assert events[0]['tid'] != os.getpid()
+
+
+def test_trace_args_too_long(trace_path):
+    writer = TraceWriter(trace_path, 'test-app')
+    writer.event('i', 'x' * 100, {'text': 'y' * 100})
+
+    dummy, dummy, events = read_trace_file(trace_path)
+
+    assert events[0]['name'] == 'x' * 48
+    assert events[0]['args'] == {'truncated': True}
+
+
+def test_chrome_trace(tmpdir, trace_path):
+    writer = TraceWriter(trace_path, 'test-app')
+    writer.event('B', 'connect', timestamp=2.0)
+    writer.event('E', 'connect', timestamp=4.0)
+
+    # as written by logging.sh, with a subshell
+    script_path = str(tmpdir.join('hook-1234.ktrace'))
+    with open(script_path, 'w') as f:
+        f.write('1.000000\t1234\tB\tdhcp\n')
+        f.write('3.000000\t1240\ti\tbound\n')
+        f.write('truncated line\n')
+        f.write('5.000000\t1234\tE\tdhcp\n')
+
+    trace = to_chrome_trace([trace_path, script_path])
+    events = trace['traceEvents']
+
+    assert sorted(e['args']['name'] for e in events if e['ph'] == 'M') == \
+        ['hook', 'test-app']
+
+    timeline = [
+        (e['ts'], e['pid'], e['tid'], e['ph'], e['name'])
+        for e in events if e['ph'] != 'M'
+    ]
+    assert timeline == [
+        (1000000, 1234, 1234, 'B', 'dhcp'),
+        (2000000, os.getpid(), os.getpid(), 'B', 'connect'),
+        (3000000, 1234, 1240, 'i', 'bound'),
+        (4000000, os.getpid(), os.getpid(), 'E', 'connect'),
+        (5000000, 1234, 1234, 'E', 'dhcp')
+    ]
+    assert [e['s'] for e in events if e['ph'] == 'i'] == ['t']
@@ -0,0 +1,107 @@
+#
+# test_probe_cache.py
+#
+# Copyright (C) 2019 Kano Computing Ltd.
+# License: http://www.gnu.org/licenses/gpl-2.0.txt GNU GPL v2
+#
+# Tests for the kano.utils.probe_cache module
+#
+
+
+import json
+import time
+
+import kano.utils.probe_cache as probe_cache
+from kano.utils.probe_cache import cached_probe, invalidate_probes
+
+
+def make_probe(ttl=60, name='test-probe'):
+    calls = []
+
+    @cached_probe(ttl, name)
+    def probe(*args):
+        calls.append(args)
+        return 'result {}'.format(len(calls))
+
+    return probe, calls
+
+
+def forget_process_cache(monkeypatch):
+    # as seen from another process
+    monkeypatch.setattr(probe_cache, '_entries', {})
+    monkeypatch.setattr(probe_cache, '_file_state', None)
+
+
+def test_cached_probe(probe_cache):
+    probe, calls = make_probe()
+
+    assert probe() == 'result 1'
+    assert probe() == 'result 1'
+    assert probe('eth0') == 'result 2'
+    assert probe('eth0') == 'result 2'
+    assert calls == [(), ('eth0',)]
+
+    with open(probe_cache) as f:
+        entries = json.load(f)
+    assert sorted(entries) == ['test-probe', 'test-probe eth0']
+
+
+def test_cached_probe_shared(probe_cache, monkeypatch):
+    probe, calls = make_probe()
+    assert probe() == 'result 1'
+
+    forget_process_cache(monkeypatch)
+    other_probe, other_calls = make_probe()
+
+    result = other_probe()
+    assert result == 'result 1'
+    assert isinstance(result, str)
+    assert not other_calls
+
+
+def test_cached_probe_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, 'time', lambda: now[0])
+    probe, calls = make_probe(ttl=10)
+
+    assert probe() == 'result 1'
+    now[0] += 9
+    assert probe() == 'result 1'
+    now[0] += 1
+    assert probe() == 'result 2'
+
+    # the clock went back
+    now[0] -= 100
+    assert probe() == 'result 3'
+
+
+def test_invalidate(monkeypatch):
+    probe, calls = make_probe()
+    other, other_calls = make_probe(name='test-probe-other')
+
+    probe()
+    probe('eth0')
+    other()
+
+    probe.invalidate()
+    assert probe() == 'result 3'
+    assert probe('eth0') == 'result 4'
+    assert other() == 'result 1'
+
+    # from another process
+    state = probe_cache._entries, probe_cache._file_state
+    forget_process_cache(monkeypatch)
+    invalidate_probes()
+    probe_cache._entries, probe_cache._file_state = state
+
+    assert other() == 'result 2'
+    assert probe() == 'result 5'
+
+
+def test_unreadable_cache(probe_cache):
+    with open(probe_cache, 'w') as f:
+        f.write('{"test-probe": [')
+
+    probe, calls = make_probe()
+    assert probe() == 'result 1'
+    assert probe() == 'result 1'